@@ -0,0 +1,8 @@
+"""
+Package: benchmarks
+Performance benchmarks for the customers service. They are not part of the
+unit tests; run each one as a module from the repository root, e.g.
+
+    python -m benchmarks.bench_name_search --rows 1000000
+    python -m benchmarks.suite --database sqlite
+"""
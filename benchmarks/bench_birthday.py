@@ -0,0 +1,72 @@
+"""
+Birthday Benchmark
+
+Measures finding the customers born on a day of the year the way the
+birthday campaigns used to, reading the whole table and filtering in
+Python, against the birthday_mmdd lookups behind
+GET /customers?birthday_month=...&birthday_day=... and birthday_window=...,
+fetching one page the way the route does.
+
+Usage: python -m benchmarks.bench_birthday [--rows 1000000] [--samples 50]
+"""
+import argparse
+import json
+import random
+from datetime import date, timedelta
+
+from benchmarks.common import ensure_seeded, summarize, time_calls
+from service.models import CustomerModel, db
+
+PAGE_SIZE = 100
+
+
+def legacy_birthdays(month, day):
+    """Every Customer read and filtered in Python, as the campaigns did"""
+    return [row for row in db.session.query(CustomerModel.customer_id, CustomerModel.birthday)
+            if (row.birthday.month, row.birthday.day) == (month, day)]
+
+
+def explain(query):
+    """Returns the PostgreSQL plan of a query, or None on other databases"""
+    if db.engine.dialect.name != "postgresql":
+        return None
+    statement = query.statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+    rows = db.session.execute(db.text(f"EXPLAIN {statement}")).fetchall()
+    return "\n".join(row[0] for row in rows)
+
+
+def main():
+    """Runs the benchmark and prints a JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--samples", type=int, default=50)
+    options = parser.parse_args()
+
+    ensure_seeded(options.rows)
+    rng = random.Random(7)
+    days = [date(2000, 1, 1) + timedelta(days=rng.randrange(366)) for _ in range(options.samples)]
+    days = [(day.month, day.day) for day in days]
+    cases = {
+        "legacy_python_filter": lambda month, day: legacy_birthdays(month, day),
+        "month_day": lambda month, day: CustomerModel.paginate(
+            PAGE_SIZE, query=CustomerModel.find_by_birthday_month_day(month, day)),
+        "window_7_days": lambda month, day: CustomerModel.paginate(
+            PAGE_SIZE, query=CustomerModel.find_by_birthday_window((month, day), (month, min(day + 6, 28)))),
+        "window_over_new_year": lambda month, day: CustomerModel.paginate(
+            PAGE_SIZE, query=CustomerModel.find_by_birthday_window((12, 28), (1, 3))),
+    }
+
+    report = {"rows": options.rows, "page_size": PAGE_SIZE, "cases": {}, "plans": {}}
+    for name, run in cases.items():
+        samples = days[:5] if name.startswith("legacy") else days
+        time_calls(run, samples[:2])  # warm up the connection and caches
+        report["cases"][name] = summarize(time_calls(run, samples))
+    query = CustomerModel.find_by_birthday_month_day(*days[0]).order_by(CustomerModel.customer_id).limit(PAGE_SIZE)
+    report["plans"]["month_day"] = explain(query)
+    query = CustomerModel.find_by_birthday_window((12, 28), (1, 3)).order_by(CustomerModel.customer_id).limit(PAGE_SIZE)
+    report["plans"]["window_over_new_year"] = explain(query)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Cold Start Benchmark
+
+Starts gunicorn the way a pod does, held to --cpus CPUs, and measures:
+
+    import_ms       importing and setting up the service in a fresh interpreter
+    first_response  from starting gunicorn to its first answer to /health
+    settled         from starting gunicorn to its processes going idle,
+                    every worker booted, with the CPU time that took
+    respawn         from killing the workers to the service answering again
+    pss_mb          the proportional memory of gunicorn and its workers
+
+for each startup mode: "per_worker", the way the service used to start,
+with every worker importing the app and creating the schema, and
+"preload", the app imported once by the gunicorn master without DDL
+and forked into the workers.
+
+The CPU limit and --db-latency-ms work as in benchmarks.bench_serving.
+
+Usage: python -m benchmarks.bench_cold_start [--cpus 0.2] [--workers 1] [--repeat 3] [--db-latency-ms 0]
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import shutil
+
+from benchmarks.bench_serving import LatencyProxy, cpu_limited_cgroup, join_cgroup
+from benchmarks.suite import HttpDriver
+
+# name: environment
+MODES = {
+    "per_worker": {"GUNICORN_PRELOAD": "false", "DB_CREATE_SCHEMA": "true"},
+    "preload": {"GUNICORN_PRELOAD": "true", "DB_CREATE_SCHEMA": "false"},
+}
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def process_tree(pid):
+    """Returns pid and the pids of its children"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="utf-8") as children:
+            return [pid] + [int(child) for child in children.read().split()]
+    except OSError:
+        return [pid]
+
+
+def cpu_seconds(pids):
+    """Returns the user and system CPU time the processes used"""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", encoding="utf-8") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except OSError:
+            pass
+    return total / CLOCK_TICKS
+
+
+def pss_mb(pids):
+    """Returns the proportional set size of the processes, shared pages split between them"""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as smaps:
+                total += next(int(line.split()[1]) for line in smaps if line.startswith("Pss:"))
+        except (OSError, StopIteration):
+            pass
+    return round(total / 1024, 1)
+
+
+def wait_for_health(port, since, timeout=120):
+    """Polls /health and returns the milliseconds from since to its first 200"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if HttpDriver(port).request("GET", "/health")[0] == 200:
+                return round((time.perf_counter() - since) * 1000)
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError("gunicorn did not answer /health")
+
+
+def wait_until_idle(pid, since, quiet=1.0):
+    """Waits for the processes of gunicorn to stop using CPU, returns when that began and the CPU used"""
+    last, last_change = cpu_seconds(process_tree(pid)), time.perf_counter()
+    while time.perf_counter() - last_change < quiet:
+        time.sleep(0.1)
+        used = cpu_seconds(process_tree(pid))
+        if used != last:
+            last, last_change = used, time.perf_counter()
+    return round((last_change - since) * 1000), round(last * 1000)
+
+
+def start(workers, settings, cgroup):
+    """Starts gunicorn on a free port and returns the process, the port and when it started"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = {**os.environ, **settings, "GUNICORN_WORKERS": str(workers), "GUNICORN_THREADS": "1",
+           "GUNICORN_LOG_LEVEL": "warning", "PROMETHEUS_MULTIPROC_DIR": tempfile.mkdtemp(prefix="cold-start-")}
+    started = time.perf_counter()
+    process = subprocess.Popen(  # pylint: disable=consider-using-with,subprocess-popen-preexec-fn
+        [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}"], env=env,
+        preexec_fn=join_cgroup(cgroup) if cgroup else None)
+    return process, port, started, env["PROMETHEUS_MULTIPROC_DIR"]
+
+
+def boot_once(workers, settings, cgroup):
+    """Boots gunicorn once in a startup mode and returns its measurements"""
+    process, port, started, metrics_dir = start(workers, settings, cgroup)
+    try:
+        result = {"first_response_ms": wait_for_health(port, started)}
+        result["settled_ms"], result["boot_cpu_ms"] = wait_until_idle(process.pid, started)
+        result["pss_mb"] = pss_mb(process_tree(process.pid))
+        workers = process_tree(process.pid)[1:]
+        killed = time.perf_counter()
+        for worker in workers:
+            os.kill(worker, signal.SIGKILL)
+        while set(workers) & set(process_tree(process.pid)):
+            time.sleep(0.005)
+        result["respawn_ms"] = wait_for_health(port, killed)
+        return result
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def import_ms(settings, repeat):
+    """Returns the median milliseconds a fresh interpreter takes to import and set up the service"""
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import service; service.create_app()"], env={**os.environ, **settings},
+                       check=True, capture_output=True)
+        times.append((time.perf_counter() - start_time) * 1000)
+    return round(statistics.median(times))
+
+
+def main():
+    """Runs the benchmark and prints a JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cpus", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--db-latency-ms", type=float, default=0)
+    options = parser.parse_args()
+
+    if options.db_latency_ms:
+        proxy = LatencyProxy(os.environ["DATABASE_URI"], options.db_latency_ms / 1000)
+        os.environ["DATABASE_URI"] = proxy.proxied_url()
+
+    cgroup = cpu_limited_cgroup(options.cpus)
+    report = {"cpus": options.cpus if cgroup else None, "workers": options.workers,
+              "db_latency_ms": options.db_latency_ms, "modes": {}}
+    try:
+        for name, settings in MODES.items():
+            runs = [boot_once(options.workers, settings, cgroup) for _ in range(options.repeat)]
+            result = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            result["import_ms"] = import_ms(settings, options.repeat)
+            report["modes"][name] = result
+    finally:
+        if cgroup:
+            os.rmdir(cgroup)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
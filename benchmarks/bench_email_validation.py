@@ -0,0 +1,49 @@
+"""
+Email Validation Benchmark
+
+Measures CustomerModel.serialize() over loaded customers as it is now, a
+plain projection of the columns, against the way it used to be, matching
+the email against the uncompiled pattern on every call.
+
+Usage: python -m benchmarks.bench_email_validation [--rows 100000] [--repeat 5]
+"""
+import argparse
+import json
+import re
+
+from benchmarks.common import ensure_seeded, summarize, time_calls
+from service.models import CustomerModel, EMAIL_PATTERN, DataValidationError
+
+
+def legacy_serialize(customer):
+    """serialize() as it was, validating the email of every Customer it read"""
+    if not re.match(EMAIL_PATTERN.pattern, customer.email):
+        raise DataValidationError("Invalid email address format")
+    return customer.serialize(include_addresses=False)
+
+
+def main():
+    """Runs the benchmark and prints a JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args()
+
+    ensure_seeded(options.rows)
+    customers = CustomerModel.query.order_by(CustomerModel.customer_id).all()
+    cases = {
+        "validate_on_read": lambda: [legacy_serialize(customer) for customer in customers],
+        "projection": lambda: [customer.serialize(include_addresses=False) for customer in customers],
+    }
+
+    report = {"rows": len(customers), "cases": {}}
+    for name, run in cases.items():
+        run()  # warm up
+        report["cases"][name] = summarize(time_calls(run, [()] * options.repeat))
+    report["speedup"] = round(
+        report["cases"]["validate_on_read"]["p50_ms"] / report["cases"]["projection"]["p50_ms"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Group Commit Benchmark
+
+Sends single Customer creates, POST /api/customers, from --clients
+keep-alive connections for --seconds to one gunicorn worker of --threads
+threads, first committing every create on its own and then with each
+--window-ms of group commit, where the creates of the threads of the
+worker share their transactions. Reports the creates per second, their
+latency and the mean number of creates per commit of every mode.
+
+The worker gets a connection per thread, so that committing on its own no
+create waits for the pool. --db-latency-ms and --cpus work as in
+benchmarks.bench_serving.
+
+Usage: python -m benchmarks.bench_group_commit [--clients 200] [--seconds 10] [--threads 32] [--window-ms 2 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_serving import LatencyProxy, cpu_limited_cgroup, join_cgroup
+from benchmarks.common import summarize
+from benchmarks.suite import HttpDriver, start_gunicorn
+from service.models import AddressModel, CustomerModel, db
+
+
+def customer(mode, client, count):
+    """Returns the body of a new Customer with an email of its own"""
+    return {
+        "first_name": "Ada", "last_name": "Lovelace", "nickname": f"ada{client}", "password": "secret",
+        "email": f"ada.{mode}.{client}.{count}@example.com", "gender": "FEMALE", "birthday": "1990-12-10",
+        "is_active": True,
+    }
+
+
+def drive(port, mode, clients, seconds):
+    """Creates Customers from clients connections for seconds and returns the results"""
+    latencies = [[] for _ in range(clients)]
+    errors = []
+    barrier = threading.Barrier(clients)
+    deadline = []
+
+    def client(index):
+        driver = HttpDriver(port)
+        if barrier.wait() == 0:
+            deadline.append(time.perf_counter() + seconds)
+        barrier.wait()
+        count = 0
+        while time.perf_counter() < deadline[0]:
+            start = time.perf_counter()
+            code, _ = driver.request("POST", "/api/customers", customer(mode, index, count))
+            latencies[index].append(time.perf_counter() - start)
+            count += 1
+            if code != 201:
+                errors.append(f"POST /api/customers answered {code}")
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    samples = [latency for client_samples in latencies for latency in client_samples]
+    for error in errors[:3]:
+        print(f"  {error}", file=sys.stderr)
+    return {"creates_per_second": round(len(samples) / seconds, 1), **summarize(samples), "errors": len(errors)}
+
+
+def run_mode(mode, window_ms, cgroup, options):
+    """Starts one gunicorn worker committing with a window, warms it up and drives it"""
+    metrics_dir = tempfile.mkdtemp(prefix="bench-group-commit-metrics-")
+    settings = {"CUSTOMER_GROUP_COMMIT_MS": str(window_ms), "CUSTOMER_GROUP_COMMIT_MAX": str(options.max_batch),
+                "DB_POOL_SIZE": str(options.threads), "DB_MAX_OVERFLOW": "0", "DB_CREATE_SCHEMA": "false"}
+    process, port = start_gunicorn(1, options.threads, metrics_dir,
+                                   preexec_fn=join_cgroup(cgroup) if cgroup else None, settings=settings)
+    try:
+        drive(port, f"{mode}-warmup", options.clients, 2)
+        before = json.loads(HttpDriver(port).request("GET", "/stats")[1])["customer_group_commit"]
+        result = drive(port, mode, options.clients, options.seconds)
+        after = json.loads(HttpDriver(port).request("GET", "/stats")[1])["customer_group_commit"]
+        batches = after["batches"] - before["batches"]
+        result["creates_per_commit"] = round((after["writes"] - before["writes"]) / batches, 2) if batches else 1.0
+        return result
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def main():
+    """Runs the benchmark and prints a JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--window-ms", type=float, nargs="+", default=[2, 5])
+    parser.add_argument("--max-batch", type=int, default=50)
+    parser.add_argument("--cpus", type=float, default=0, help="CPUs of the worker, 0 for no limit")
+    parser.add_argument("--db-latency-ms", type=float, default=0)
+    options = parser.parse_args()
+
+    db.session.query(AddressModel).delete()
+    db.session.query(CustomerModel).delete()
+    db.session.commit()
+    db.session.remove()
+    if options.db_latency_ms:
+        proxy = LatencyProxy(os.environ["DATABASE_URI"], options.db_latency_ms / 1000)
+        os.environ["DATABASE_URI"] = proxy.proxied_url()
+
+    modes = {"per_request": 0, **{f"group_{window:g}ms": window for window in options.window_ms}}
+    cgroup = cpu_limited_cgroup(options.cpus) if options.cpus else None
+    report = {"clients": options.clients, "threads": options.threads,
+              "cpus": options.cpus if cgroup else None, "db_latency_ms": options.db_latency_ms, "modes": {}}
+    try:
+        for mode, window_ms in modes.items():
+            report["modes"][mode] = run_mode(mode, window_ms, cgroup, options)
+    finally:
+        if cgroup:
+            os.rmdir(cgroup)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
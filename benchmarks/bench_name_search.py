@@ -0,0 +1,80 @@
+"""
+Name Search Benchmark
+
+Measures the p50/p99 latency of the name lookups behind
+GET /customers?firstname=...&lastname=...[&match=prefix] on a seeded table,
+fetching one page the way the route does: in customer_id order for exact
+matches and in name order for prefix matches.
+
+Usage: python -m benchmarks.bench_name_search [--rows 1000000] [--samples 500]
+"""
+import argparse
+import json
+import random
+
+from sqlalchemy import event
+
+from benchmarks.common import FIRST_NAMES, LAST_NAMES, ensure_seeded, summarize, time_calls
+from service.models import CustomerModel, db
+
+PAGE_SIZE = 100
+
+
+def legacy_find_by_name(firstname, lastname):
+    """The query find_by_name used to build, with Python `and` between the clauses"""
+    customer = CustomerModel
+    return customer.query.filter(customer.first_name == firstname and customer.last_name == lastname)
+
+
+def explain(run, first, last):
+    """Returns the PostgreSQL plan of the last statement run() sends, or None on other databases"""
+    if db.engine.dialect.name != "postgresql":
+        return None
+    statements = []
+
+    def record(conn, cursor, statement, parameters, *args):  # pylint: disable=unused-argument
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        run(first, last)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    statement, parameters = statements[-1]
+    rows = db.session.connection().exec_driver_sql("EXPLAIN " + statement, parameters).fetchall()
+    return "\n".join(row[0] for row in rows)
+
+
+def main():
+    """Runs the benchmark and prints a JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--samples", type=int, default=500)
+    options = parser.parse_args()
+
+    ensure_seeded(options.rows)
+    rng = random.Random(7)
+    names = [(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)) for _ in range(options.samples)]
+    by_id, by_name = CustomerModel.paginate, CustomerModel.paginate_by_name
+    cases = {
+        "legacy_and": (by_id, legacy_find_by_name),
+        "exact": (by_id, CustomerModel.find_by_name),
+        "prefix_both": (by_name, lambda first, last: CustomerModel.find_by_name_prefix(first[:2], last[:3])),
+        "prefix_last": (by_name, lambda first, last: CustomerModel.find_by_name_prefix(lastname=last[:3])),
+    }
+
+    report = {"rows": options.rows, "page_size": PAGE_SIZE, "cases": {}}
+    for name, (paginate, build) in cases.items():
+        def run(first, last, paginate=paginate, build=build):
+            return paginate(PAGE_SIZE, query=build(first, last))
+        time_calls(run, names[:20])  # warm up the connection and caches
+        report["cases"][name] = summarize(time_calls(run, names))
+        plan = explain(run, *names[0])
+        if plan:
+            print(f"-- {name}\n{plan}\n")
+        db.session.remove()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
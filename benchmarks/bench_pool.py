@@ -0,0 +1,94 @@
+"""
+Connection Pool Load Test
+
+Drives GET /api/customers?limit=20 from many threads of one process, the
+way a threaded gunicorn worker serves requests, and reports the throughput
+and pool checkout waits of each pool configuration. Every configuration
+runs in a fresh process because the engine reads the pool settings from
+the environment when the service is imported.
+
+--db-latency-ms adds a sleep before every statement while the connection
+is held, to stand in for the network round trip to a remote database.
+
+Usage: python -m benchmarks.bench_pool [--threads 16] [--seconds 10] [--db-latency-ms 0]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+POOL_CONFIGS = {
+    "fixed_2": {"DB_POOL_SIZE": "2", "DB_MAX_OVERFLOW": "0"},
+    "size_5_overflow_10": {"DB_POOL_SIZE": "5", "DB_MAX_OVERFLOW": "10"},
+    "size_16": {"DB_POOL_SIZE": "16", "DB_MAX_OVERFLOW": "0"},
+}
+
+
+def run_load(threads, seconds, db_latency):
+    """Runs the load in this process and returns its report"""
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import event
+    from benchmarks.common import ensure_seeded, summarize
+    from service import app
+    from service.models import db
+    from service.utils.pool import checkout_waits, pool_stats
+
+    ensure_seeded(10000)
+    if db_latency:
+        event.listen(db.engine, "before_cursor_execute", lambda *args: time.sleep(db_latency))
+    db.session.remove()
+    checkout_waits.reset()
+
+    latencies = [[] for _ in range(threads)]
+    deadline = time.perf_counter() + seconds
+
+    def worker(samples):
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = client.get("/api/customers?limit=20")
+            samples.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"GET /api/customers answered {response.status_code}")
+
+    workers = [threading.Thread(target=worker, args=(samples,)) for samples in latencies]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    samples = [latency for thread_samples in latencies for latency in thread_samples]
+    return {
+        "requests_per_second": round(len(samples) / seconds, 1),
+        "latency": summarize(samples),
+        "pool": pool_stats(db.engine.pool),
+    }
+
+
+def main():
+    """Runs every pool configuration in a child process and prints a JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--db-latency-ms", type=float, default=0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        print(json.dumps(run_load(options.threads, options.seconds, options.db_latency_ms / 1000)))
+        return
+
+    report = {"threads": options.threads, "seconds": options.seconds,
+              "db_latency_ms": options.db_latency_ms, "configs": {}}
+    for name, settings in POOL_CONFIGS.items():
+        command = [sys.executable, "-m", "benchmarks.bench_pool", "--child", "--threads", str(options.threads),
+                   "--seconds", str(options.seconds), "--db-latency-ms", str(options.db_latency_ms)]
+        result = subprocess.run(command, env={**os.environ, **settings}, capture_output=True, text=True, check=True)
+        report["configs"][name] = json.loads(result.stdout.strip().splitlines()[-1])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
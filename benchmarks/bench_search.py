@@ -0,0 +1,66 @@
+"""
+Customer Search Benchmark
+
+Measures the p50/p99 latency of GET /customers?q=... on a seeded table,
+fetching one page the way the route does, against a plain ILIKE '%q%' scan
+of the same text. On PostgreSQL the search uses pg_trgm when it is
+installed, otherwise both databases search in process; the report says
+which, and shows the PostgreSQL plan of the search.
+
+Usage: python -m benchmarks.bench_search [--rows 1000000] [--samples 200]
+"""
+import argparse
+import json
+import random
+
+from benchmarks.common import FIRST_NAMES, LAST_NAMES, ensure_seeded, summarize, time_calls
+from service.models import CustomerModel, db
+
+PAGE_SIZE = 100
+
+
+def like_scan(text):
+    """The page a substring match of the search text gives, without any index"""
+    query = CustomerModel.query.filter(CustomerModel.search_document().ilike(f"%{text}%"))
+    return CustomerModel.paginate(PAGE_SIZE, query=query, rows=True)
+
+
+def search(text):
+    """The page GET /customers?q= answers"""
+    return CustomerModel.paginate_search(text, PAGE_SIZE, rows=True)
+
+
+def explain(text):
+    """Returns the PostgreSQL plan of a pg_trgm search, or None without it"""
+    if CustomerModel.search_backend != "trigram":
+        return None
+    document = CustomerModel.search_document()
+    query = CustomerModel.query.filter(document.op("%>")(text)) \
+        .order_by(document.op("<->>")(text), CustomerModel.customer_id).limit(PAGE_SIZE + 1)
+    statement = query.statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+    rows = db.session.execute(db.text(f"EXPLAIN {statement}")).fetchall()
+    return "\n".join(row[0] for row in rows)
+
+
+def main():
+    """Runs the benchmark and prints a JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--samples", type=int, default=200)
+    options = parser.parse_args()
+
+    ensure_seeded(options.rows)
+    rng = random.Random(7)
+    names = [rng.choice(FIRST_NAMES + LAST_NAMES) for _ in range(options.samples)]
+    texts = [name[:rng.randint(3, len(name))] for name in names]
+
+    report = {"rows": options.rows, "page_size": PAGE_SIZE, "backend": CustomerModel.search_backend, "cases": {}}
+    for name, run in {"like_scan": like_scan, "search": search}.items():
+        time_calls(run, [(text,) for text in texts[:5]])  # warm up the connection, caches and in-process index
+        report["cases"][name] = summarize(time_calls(run, [(text,) for text in texts]))
+    report["plan"] = explain(texts[0])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Serialization Benchmark
+
+Measures turning a page of customers into the JSON body of
+GET /customers, the way the route used to (model objects, serialize(),
+flask-restx marshalling and json.dumps) against the compiled serializer
+over row tuples, with orjson when it is installed and with json.
+
+Usage: python -m benchmarks.bench_serialize [--sizes 1000 10000 100000] [--repeat 5]
+"""
+import argparse
+import json
+from unittest.mock import patch
+
+from benchmarks.common import ensure_seeded, summarize, time_calls
+from service import api
+from service.models import CustomerModel
+from service.routes import customer_model
+from service.utils import serializers
+
+serialize_customer = serializers.compile_model(customer_model, skip_none=True)
+
+
+def marshalled(size):
+    """The body as the route built it with marshal_list_with"""
+    customers = CustomerModel.query.order_by(CustomerModel.customer_id).limit(size).all()
+    return json.dumps(api.marshal([customer.serialize() for customer in customers], customer_model, skip_none=True))
+
+
+def compiled(size):
+    """The body as the route builds it with the compiled serializer"""
+    rows = CustomerModel.query.with_entities(*CustomerModel.__table__.columns) \
+        .order_by(CustomerModel.customer_id).limit(size).all()
+    return serializers.dumps([serialize_customer(row) for row in rows])
+
+
+def compiled_json(size):
+    """The compiled serializer without orjson"""
+    with patch.object(serializers, "orjson", None):
+        return compiled(size)
+
+
+def main():
+    """Runs the benchmark and prints a JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args()
+
+    ensure_seeded(max(options.sizes))
+    cases = {"marshal": marshalled, "compiled": compiled, "compiled_json": compiled_json}
+    if json.loads(marshalled(10)) != json.loads(compiled(10)):
+        raise SystemExit("The compiled serializer does not match marshalling")
+
+    report = {"json_backend": serializers.json_backend(), "sizes": {}}
+    for size in options.sizes:
+        results = {}
+        for name, run in cases.items():
+            run(size)  # warm up the connection and caches
+            results[name] = summarize(time_calls(run, [(size,)] * options.repeat))
+        results["speedup"] = round(results["marshal"]["p50_ms"] / results["compiled"]["p50_ms"], 2)
+        report["sizes"][size] = results
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
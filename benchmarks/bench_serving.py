@@ -0,0 +1,213 @@
+"""
+Serving Mode Benchmark
+
+Serves the API from one gunicorn worker held to --cpus CPUs, the size of a
+pod, sync and threaded, and drives it over HTTP
+from --concurrency keep-alive connections for --seconds, half single
+Customer reads and half pages of 20. Reports the requests per second and
+latency of every mode.
+
+--db-latency-ms puts a proxy between the worker and the database that holds
+back every reply of the database that long, to stand in for the round
+trip to a database on another host; the waits the serving modes differ in.
+
+The worker is held to --cpus with a cgroup of its own, which takes root
+and a writable cpu controller (cgroup v1 or v2). Without one the modes run
+unlimited and the report says so.
+
+Usage: python -m benchmarks.bench_serving [--cpus 0.2] [--concurrency 16] [--seconds 10] [--db-latency-ms 0]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy.engine import make_url
+
+from benchmarks.common import ensure_seeded, seeded_ids, summarize
+from benchmarks.suite import HttpDriver, start_gunicorn
+from service.models import db
+from service.routes import encode_cursor
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+CFS_PERIOD_US = 100000
+
+# name: GUNICORN_THREADS; the threaded worker gets a thread for every
+# connection of its pool, DB_POOL_SIZE + DB_MAX_OVERFLOW
+MODES = {
+    "sync": 1,
+    "threads": 15,
+}
+
+
+def cpu_limited_cgroup(cpus):
+    """Creates a cgroup allowed cpus CPUs and returns its directory, or None if that is not allowed here"""
+    name = f"bench-serving-{os.getpid()}"
+    quota = int(cpus * CFS_PERIOD_US)
+    try:
+        if os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):  # cgroup v2
+            path = os.path.join(CGROUP_ROOT, name)
+            os.mkdir(path)
+            with open(os.path.join(path, "cpu.max"), "w", encoding="utf-8") as limit:
+                limit.write(f"{quota} {CFS_PERIOD_US}")
+        else:
+            path = os.path.join(CGROUP_ROOT, "cpu", name)
+            os.mkdir(path)
+            with open(os.path.join(path, "cpu.cfs_period_us"), "w", encoding="utf-8") as period:
+                period.write(str(CFS_PERIOD_US))
+            with open(os.path.join(path, "cpu.cfs_quota_us"), "w", encoding="utf-8") as limit:
+                limit.write(str(quota))
+    except OSError as error:
+        print(f"Cannot limit the CPU of the server, running it unlimited: {error}", file=sys.stderr)
+        return None
+    return path
+
+
+def join_cgroup(path):
+    """Returns a function moving the process calling it into the cgroup at path"""
+    def join():
+        with open(os.path.join(path, "cgroup.procs"), "w", encoding="utf-8") as procs:
+            procs.write(str(os.getpid()))
+    return join
+
+
+class LatencyProxy:
+    """Forwards TCP connections from 127.0.0.1 to the database of a url, delaying its replies"""
+
+    def __init__(self, url, latency):
+        self.url = make_url(url)
+        self.latency = latency
+        self.port = None
+        self._ready = threading.Event()
+        threading.Thread(target=asyncio.run, args=(self._serve(),), daemon=True).start()
+        self._ready.wait()
+
+    def proxied_url(self):
+        """Returns the url reaching the database through the proxy"""
+        query = {key: value for key, value in self.url.query.items() if key != "host"}
+        return str(self.url.set(host="127.0.0.1", port=self.port, query=query))
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._connect, "127.0.0.1", 0)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        await server.serve_forever()
+
+    async def _connect(self, client_reader, client_writer):
+        socket_dir = self.url.query.get("host")
+        if socket_dir:
+            db_reader, db_writer = await asyncio.open_unix_connection(
+                os.path.join(socket_dir, f".s.PGSQL.{self.url.port or 5432}"))
+        else:
+            db_reader, db_writer = await asyncio.open_connection(self.url.host, self.url.port or 5432)
+        await asyncio.gather(self._pipe(client_reader, db_writer, 0),
+                             self._pipe(db_reader, client_writer, self.latency), return_exceptions=True)
+
+    @staticmethod
+    async def _pipe(reader, writer, delay):
+        """Copies reader to writer, each chunk delay seconds after it arrived"""
+        chunks = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                due, chunk = await chunks.get()
+                await asyncio.sleep(due - time.monotonic())
+                if not chunk:
+                    writer.close()
+                    return
+                writer.write(chunk)
+                await writer.drain()
+
+        delivery = asyncio.ensure_future(deliver())
+        while True:
+            chunk = await reader.read(65536)
+            chunks.put_nowait((time.monotonic() + delay, chunk))
+            if not chunk:
+                break
+        await delivery
+
+
+def drive(port, customer_ids, concurrency, seconds):
+    """Sends requests from concurrency connections for seconds and returns the results"""
+    latencies = [[] for _ in range(concurrency)]
+    errors = []
+    deadline = time.perf_counter() + seconds
+
+    def worker(thread):
+        driver = HttpDriver(port)
+        rng = random.Random(thread)
+        while time.perf_counter() < deadline:
+            if rng.random() < 0.5:
+                path = f"/api/customers/{rng.choice(customer_ids)}"
+            else:
+                path = f"/api/customers?limit=20&cursor={encode_cursor(rng.choice(customer_ids))}"
+            start = time.perf_counter()
+            code, _ = driver.request("GET", path)
+            latencies[thread].append(time.perf_counter() - start)
+            if code != 200:
+                errors.append(f"GET {path} answered {code}")
+
+    threads = [threading.Thread(target=worker, args=(thread,)) for thread in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    samples = [latency for thread_samples in latencies for latency in thread_samples]
+    for error in errors[:3]:
+        print(f"  {error}", file=sys.stderr)
+    return {"requests_per_second": round(len(samples) / seconds, 1), **summarize(samples), "errors": len(errors)}
+
+
+def run_mode(threads, cgroup, options, customer_ids):
+    """Starts one gunicorn worker of threads threads, warms it up and drives it"""
+    metrics_dir = tempfile.mkdtemp(prefix="bench-serving-metrics-")
+    preexec_fn = join_cgroup(cgroup) if cgroup else None
+    process, port = start_gunicorn(1, threads, metrics_dir, preexec_fn=preexec_fn)
+    try:
+        drive(port, customer_ids, options.concurrency, 2)
+        return drive(port, customer_ids, options.concurrency, options.seconds)
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def main():
+    """Runs the benchmark and prints a JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cpus", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--db-latency-ms", type=float, default=0)
+    options = parser.parse_args()
+
+    ensure_seeded(options.rows)
+    customer_ids, _ = seeded_ids()
+    db.session.remove()
+    if options.db_latency_ms:
+        if db.engine.dialect.name != "postgresql":
+            parser.error("--db-latency-ms needs a PostgreSQL DATABASE_URI")
+        proxy = LatencyProxy(os.environ["DATABASE_URI"], options.db_latency_ms / 1000)
+        os.environ["DATABASE_URI"] = proxy.proxied_url()
+
+    cgroup = cpu_limited_cgroup(options.cpus)
+    report = {"cpus": options.cpus if cgroup else None, "concurrency": options.concurrency,
+              "seconds": options.seconds, "rows": options.rows, "db_latency_ms": options.db_latency_ms, "modes": {}}
+    try:
+        for name, threads in MODES.items():
+            report["modes"][name] = run_mode(threads, cgroup, options, customer_ids)
+    finally:
+        if cgroup:
+            os.rmdir(cgroup)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
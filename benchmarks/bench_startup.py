@@ -0,0 +1,92 @@
+"""
+Startup Profile
+
+Starts fresh interpreters the way a pod starts the service and reports,
+as medians over --repeat runs, the milliseconds from starting the
+interpreter to:
+
+    interpreter_ms    running the first line of the script
+    import_ms         importing the service package
+    create_app_ms     create_app(): logging, metrics and the database session
+    first_request_ms  answering GET /api/customers, on the first connection
+
+and, from python -X importtime, the self time of importing each top level
+package and of the slowest modules: the startup profile to read before
+adding an import to the service.
+
+Usage: python -m benchmarks.bench_startup [--repeat 5] [--top 15]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+CHILD = """
+import json, os, time
+started = float(os.environ["STARTUP_STARTED"])
+phases = {"interpreter_ms": time.time()}
+import service
+phases["import_ms"] = time.time()
+app = service.create_app()
+phases["create_app_ms"] = time.time()
+code = app.test_client().get("/api/customers?limit=1").status_code
+phases["first_request_ms"] = time.time()
+assert code == 200, code
+print(json.dumps({name: (at - started) * 1000 for name, at in phases.items()}))
+"""
+
+
+def parse_importtime(report):
+    """Returns {module: (self, cumulative)} in microseconds from the output of python -X importtime"""
+    modules = {}
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def time_phases():
+    """Starts the service in a fresh interpreter and returns when each phase ended"""
+    env = {**os.environ, "STARTUP_STARTED": repr(time.time())}
+    result = subprocess.run([sys.executable, "-c", CHILD], env=env, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout)
+
+
+def import_profile():
+    """Imports the service in a fresh interpreter under python -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import service"],
+                            check=True, capture_output=True, text=True)
+    return parse_importtime(result.stderr)
+
+
+def main():
+    """Runs the benchmark and prints a JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    options = parser.parse_args()
+
+    runs = [time_phases() for _ in range(options.repeat)]
+    report = {name: round(statistics.median(run[name] for run in runs)) for name in runs[0]}
+
+    profiles = [import_profile() for _ in range(options.repeat)]
+    modules = {name: statistics.median(profile[name][0] for profile in profiles if name in profile)
+               for name in profiles[0]}
+    packages = defaultdict(float)
+    for name, self_us in modules.items():
+        packages[name.split(".")[0]] += self_us
+    report["import_self_ms"] = {name: round(self_us / 1000, 1) for name, self_us in
+                                sorted(packages.items(), key=lambda item: -item[1])[:options.top]}
+    report["slowest_modules_ms"] = {name: round(self_us / 1000, 1) for name, self_us in
+                                    sorted(modules.items(), key=lambda item: -item[1])[:options.top]}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark Helpers
+
+Seeding and latency statistics shared by the benchmark scripts.
+
+The scripts use the database in DATABASE_URI and replace whatever customers
+are in it, so never point them at a database whose data you want to keep.
+"""
+import math
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func
+from service import create_app
+from service.models import CustomerModel, AddressModel, Gender, db
+
+app = create_app()
+
+FIRST_NAMES = [
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+    "Wei", "Fang", "Priya", "Arjun", "Sofia", "Mateo", "Yuki", "Haruto", "Amara", "Kwame",
+]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+    "Wang", "Li", "Zhang", "Liu", "Chen", "Patel", "Kumar", "Singh", "Tanaka", "Suzuki",
+]
+SEED_BATCH_SIZE = 10000
+
+
+def percentile(samples, pct):
+    """Returns the nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies):
+    """Summarizes latencies in seconds as milliseconds"""
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+    }
+
+
+def time_calls(func_, args_list):
+    """Calls func_ once per argument tuple and returns each latency in seconds"""
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func_(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def customer_row(number, rng):
+    """Builds the column values of the n-th synthetic customer"""
+    first_name = rng.choice(FIRST_NAMES) + rng.choice(["", "a", "e", "o", "ie"])
+    last_name = rng.choice(LAST_NAMES) + rng.choice(["", "son", "er", "ez", "ski"])
+    return {
+        "password": "benchmark",
+        "first_name": first_name,
+        "last_name": last_name,
+        "nickname": f"{first_name}{number % 997}",
+        "email": f"user{number}@example.com",
+        "gender": rng.choice(list(Gender)),
+        "birthday": date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55)),
+        "is_active": True,
+    }
+
+
+def ensure_seeded(rows, addresses_per_customer=0, seed=42):
+    """Seeds `rows` customers unless the database already holds exactly that many
+
+    Customers are written with batched core INSERTs straight through the
+    model tables, which is far faster than going through the API.
+    """
+    if CustomerModel.query.count() == rows and \
+            AddressModel.query.count() == rows * addresses_per_customer:
+        print(f"Reusing {rows} seeded customers", file=sys.stderr)
+        return
+    print(f"Seeding {rows} customers with {addresses_per_customer} addresses each ...", file=sys.stderr)
+    db.session.query(AddressModel).delete()
+    db.session.query(CustomerModel).delete()
+    db.session.commit()
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for first in range(0, rows, SEED_BATCH_SIZE):
+        batch = [customer_row(number, rng) for number in range(first, min(first + SEED_BATCH_SIZE, rows))]
+        db.session.execute(CustomerModel.__table__.insert(), batch)
+        if addresses_per_customer:
+            low = db.session.query(func.min(CustomerModel.customer_id)).filter(
+                CustomerModel.email == batch[0]["email"]).scalar()
+            db.session.execute(AddressModel.__table__.insert(), [
+                {"customer_id": customer_id, "address": f"{number} Benchmark Street"}
+                for customer_id in range(low, low + len(batch))
+                for number in range(addresses_per_customer)
+            ])
+        db.session.commit()
+    analyze()
+    print(f"Seeded in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+def seeded_ids():
+    """Returns the seeded customer_ids and the (customer_id, address_id) of the seeded addresses"""
+    customer_ids = [row[0] for row in db.session.query(CustomerModel.customer_id).order_by(CustomerModel.customer_id)]
+    address_ids = [tuple(row) for row in
+                   db.session.query(AddressModel.customer_id, AddressModel.address_id).order_by(AddressModel.address_id)]
+    return customer_ids, address_ids
+
+
+def remove_extra_rows(customer_ids, address_ids):
+    """Deletes the customers and addresses added after seeded_ids() was taken"""
+    if address_ids:
+        db.session.query(AddressModel).filter(AddressModel.address_id > address_ids[-1][1]).delete()
+    if customer_ids:
+        db.session.query(AddressModel).filter(AddressModel.customer_id > customer_ids[-1]).delete()
+        db.session.query(CustomerModel).filter(CustomerModel.customer_id > customer_ids[-1]).delete()
+    db.session.commit()
+
+
+def analyze():
+    """Refreshes the planner statistics after a bulk load"""
+    if db.engine.dialect.name == "postgresql":
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("ANALYZE customer")
+            conn.exec_driver_sql("ANALYZE address")
@@ -30,6 +30,18 @@ from behave import given
 from compare import expect
 
 
+def list_customers(rest_endpoint):
+    """ Returns the Customers of every page, following the Link header of each """
+    customers = []
+    url = rest_endpoint
+    while url:
+        resp = requests.get(url)
+        expect(resp.status_code).to_equal(200)
+        customers.extend(resp.json())
+        url = resp.links.get('next', {}).get('url')
+    return customers
+
+
 @given('the server is started')
 def step_impl(context):
     context.base_url = os.getenv(
@@ -44,9 +56,7 @@ def step_impl(context):
     """ Delete all Customers and load new ones """
     # List all of the customers and delete them one by one
     rest_endpoint = f"{context.BASE_URL}/api/customers"
-    context.resp = requests.get(rest_endpoint)
-    expect(context.resp.status_code).to_equal(200)
-    for customer in context.resp.json():
+    for customer in list_customers(rest_endpoint):
         context.resp = requests.delete(f"{rest_endpoint}/{customer['customer_id']}")
         expect(context.resp.status_code).to_equal(204)
 
@@ -70,10 +80,8 @@ def step_impl(context):
     """ Append addresses to newly created customers """
     # List all of the customers and get their id
     rest_endpoint = f"{context.BASE_URL}/api/customers"
-    context.resp = requests.get(rest_endpoint)
-    expect(context.resp.status_code).to_equal(200)
     customer_ids = []
-    for customer in context.resp.json():
+    for customer in list_customers(rest_endpoint):
         customer_ids.append(customer['customer_id'])
     
     rest_endpoint = rest_endpoint + f"/{customer_ids[0]}/addresses"
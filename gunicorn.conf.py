@@ -0,0 +1,115 @@
+"""
+Gunicorn Configuration
+
+Gunicorn reads ./gunicorn.conf.py by itself. It lives outside of the service
+package so that loading it does not import the app in the master process.
+
+Serves service:create_app() in sync workers, threaded ones with more than
+one thread.
+
+Unless GUNICORN_WORKERS and GUNICORN_THREADS say otherwise, the workers and
+threads are sized from the CPU and memory limits of the cgroup of the
+container: 2 * CPUs + 1 requests at once, in as many workers as
+GUNICORN_WORKER_MEMORY_MB each fits in the memory limit, and threads for
+the rest.
+
+With GUNICORN_PRELOAD, on by default, the master imports the app once and
+the workers are forked from it, sharing its memory until they write to it.
+Each worker then drops the database connections it inherited.
+
+Gives the worker processes a shared PROMETHEUS_MULTIPROC_DIR so that
+/metrics reports the requests of every worker, whichever answers it.
+"""
+import math
+import os
+import tempfile
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def read_cgroup(root, *names):
+    """ Returns the content of the first of the cgroup files under root that exists, or None """
+    for name in names:
+        try:
+            with open(os.path.join(root, name), encoding="utf-8") as limit:
+                return limit.read().split()
+        except OSError:
+            continue
+    return None
+
+
+def cpu_limit(root=CGROUP_ROOT):
+    """ Returns the CPUs the cgroup may use, or those of the machine without a quota """
+    available = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    limit = read_cgroup(root, "cpu.max")  # cgroup v2: "<quota> <period>" or "max <period>"
+    if limit is None:
+        quota = read_cgroup(root, "cpu/cpu.cfs_quota_us", "cpu,cpuacct/cpu.cfs_quota_us")
+        period = read_cgroup(root, "cpu/cpu.cfs_period_us", "cpu,cpuacct/cpu.cfs_period_us")
+        limit = quota + period if quota and period else None
+    if limit is None or limit[0] in ("max", "-1"):
+        return float(available)
+    return min(float(available), int(limit[0]) / int(limit[1]))
+
+
+def memory_limit(root=CGROUP_ROOT):
+    """ Returns the bytes of memory the cgroup may use, or None without a limit """
+    limit = read_cgroup(root, "memory.max", "memory/memory.limit_in_bytes")
+    if limit is None or limit[0] == "max":
+        return None
+    limit = int(limit[0])
+    # cgroup v1 reports no limit as the largest page aligned number
+    return None if limit >= 2 ** 60 else limit
+
+
+def size_workers(cpus, memory, worker_memory):
+    """ Returns the workers and threads per worker for the CPU and memory limits """
+    concurrency = max(1, int(2 * cpus + 1))
+    count = concurrency if memory is None else max(1, min(concurrency, memory // worker_memory))
+    return count, math.ceil(concurrency / count)
+
+
+sized_workers, sized_threads = size_workers(
+    cpu_limit(), memory_limit(), int(os.getenv("GUNICORN_WORKER_MEMORY_MB", "48")) * 1024 * 1024)
+
+wsgi_app = "service:create_app()"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:" + os.getenv("PORT", "8000"))
+workers = int(os.getenv("GUNICORN_WORKERS", str(sized_workers)))
+threads = int(os.getenv("GUNICORN_THREADS", str(sized_threads)))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("true", "1", "yes")
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# Set before the workers import prometheus_client, which reads it once, and
+# created before the preloaded app records its first database checkout
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "customers-metrics"))
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """ Empties the metrics directory left behind by a previous master, keeping this master's files """
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    for name in os.listdir(directory):
+        if not name.endswith(f"_{os.getpid()}.db"):
+            os.remove(os.path.join(directory, name))
+
+
+def when_ready(server):
+    """ Closes the database connections the preloaded app opened in the master """
+    if server.cfg.preload_app:
+        from service import routes  # pylint: disable=import-outside-toplevel
+
+        routes.dispose_pool()
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """ Leaves the database connections of the master to it, in case it still held any """
+    if server.cfg.preload_app:
+        from service import routes  # pylint: disable=import-outside-toplevel
+
+        routes.dispose_pool(close=False)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """ Drops the live gauges of a worker that exited """
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
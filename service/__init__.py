@@ -1,15 +1,16 @@
 """
 Package: service
 Package for the application models and service routes
-This module creates and configures the Flask app and sets up the logging
-and SQL database
+This module creates the Flask app and its routes, and create_app() sets up
+the logging and SQL database of it
 """
 import sys
+from importlib import import_module
 # import logging
 from flask import Flask
-from flask_restx import Api
+from flask.cli import AppGroup
 from service import config
-from .utils import log_handlers
+from .utils import compression, log_handlers, metrics, profiler
 
 # Create Flask application
 app = Flask(__name__)
@@ -19,33 +20,75 @@ app.config.from_object(config)
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
-api = Api(app,
-          version='1.0.0',
-          title='Customers REST API Service',
-          description='This is a customers service.',
-          default='customers',
-          default_label='Customers management',
-          doc='/apidocs',
-          prefix='/api'
-          )
+api = profiler.ProfilingApi(app,
+                            version='1.0.0',
+                            title='Customers REST API Service',
+                            description='This is a customers service.',
+                            default='customers',
+                            default_label='Customers management',
+                            doc='/apidocs',
+                            prefix='/api'
+                            )
 
 # Dependencies require we import the routes AFTER the Flask app is created
 # from service import routes, models
 from service import routes  # pylint: disable=wrong-import-position, wrong-import-order
-from .utils import error_handlers, cli_commands  # pylint: disable=wrong-import-position
+from .utils import error_handlers  # pylint: disable=wrong-import-position
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
 
-app.logger.info(70 * "*")
-app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+class LazyCommands(AppGroup):
+    """ The flask commands of the service, imported when the CLI first looks for one """
 
-try:
-    routes.init_db()  # make our SQLAlchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+    def get_command(self, ctx, cmd_name):
+        import_module("service.utils.cli_commands")
+        return super().get_command(ctx, cmd_name)
 
-app.logger.info("Service initialized!")
+    def list_commands(self, ctx):
+        import_module("service.utils.cli_commands")
+        return super().list_commands(ctx)
+
+
+# The web workers never run a command, so they do not import them
+app.cli = LazyCommands()
+
+
+def create_app(settings=None):
+    """
+    Sets up the app of the service and returns it
+
+    The routes are bound to the app of this package when it is imported, so
+    every call returns that app. settings update its config, and the first
+    call sets up logging, metrics and the database session. The tables are
+    created only with DB_CREATE_SCHEMA, so that a gunicorn worker forked
+    from a preloaded app, or started without one, boots without DDL.
+
+    Args:
+        settings (dict): config values overriding service/config.py
+    """
+    if settings:
+        app.config.update(settings)
+    if "customers" in app.extensions:
+        return app
+    app.extensions["customers"] = True
+
+    # Set up logging and metrics for production, compressing after them
+    log_handlers.init_logging(app, "gunicorn.error")
+    compression.init_compression(app)
+    profiler.init_profiler(app)
+    metrics.init_metrics(app)
+
+    app.logger.info(70 * "*")
+    app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
+
+    try:
+        routes.init_db()
+        if app.config["DB_CREATE_SCHEMA"]:
+            routes.create_schema()  # make our SQLAlchemy tables
+    except Exception as error:
+        app.logger.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
+
+    app.logger.info("Service initialized!")
+    return app
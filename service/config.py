@@ -4,6 +4,7 @@ Global Configuration for Application
 import os
 import json
 import logging
+from service.utils.pool import TimedQueuePool
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -19,7 +20,79 @@ if 'VCAP_SERVICES' in os.environ:
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-SQLALCHEMY_POOL_SIZE = 2
+
+# Connection pool of every process. pool_size + max_overflow should cover
+# the threads of a worker, and workers * that must fit max_connections.
+# Pre-ping and recycle drop connections that died, e.g. in a failover.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+
+# SQLite keeps the pool SQLAlchemy picks for it
+SQLALCHEMY_ENGINE_OPTIONS = {} if DATABASE_URI.startswith("sqlite") else {
+    "poolclass": TimedQueuePool,
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# create_app() creates the missing tables when DB_CREATE_SCHEMA is on, which
+# suits development and tests. Deployments turn it off and run
+# `flask upgrade-db` once per release, so that workers start without DDL.
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "true").lower() in ("true", "1", "yes")
+
+# Keyset pagination of the customer list endpoints
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Bulk creation of customers
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+
+# Streaming export of the customer table
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Response compression negotiated by Accept-Encoding: br needs the brotli
+# package, gzip is always there. Bodies under COMPRESS_MIN_SIZE bytes are
+# sent as they are, streamed ones are always compressed.
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+COMPRESS_MIMETYPES = set(os.getenv(
+    "COMPRESS_MIMETYPES",
+    "application/json,application/x-ndjson,text/html,text/css,text/plain,application/javascript"
+).split(","))
+
+# Background jobs run by `flask run-worker`: a running job whose worker has
+# not committed a chunk for JOB_LEASE_SECONDS is taken over by another worker
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "1000"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Read-through cache of single Customers, off unless CUSTOMER_CACHE_URL is
+# set: redis://... shares it between every process, memory:// keeps it in
+# the process and is safe only with one worker and no job worker
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", "10000"))
+CUSTOMER_CACHE_TTL = float(os.getenv("CUSTOMER_CACHE_TTL", "60"))
+CUSTOMER_CACHE_URL = os.getenv("CUSTOMER_CACHE_URL", "")
+
+# Group commit of single Customer creates: the creates of concurrent requests
+# of a worker wait up to CUSTOMER_GROUP_COMMIT_MS (0 turns it off) to share
+# one transaction of at most CUSTOMER_GROUP_COMMIT_MAX Customers
+CUSTOMER_GROUP_COMMIT_MS = float(os.getenv("CUSTOMER_GROUP_COMMIT_MS", "0"))
+CUSTOMER_GROUP_COMMIT_MAX = int(os.getenv("CUSTOMER_GROUP_COMMIT_MAX", "50"))
+
+# SQL profiling: statements slower than SLOW_QUERY_MS (0 turns it off) are
+# logged; SQL_PROFILING or the SQL_PROFILE_HEADER request header log every
+# statement of a request and add a Server-Timing header to its response
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SQL_PROFILING = os.getenv("SQL_PROFILING", "false").lower() in ("true", "1", "yes")
+SQL_PROFILE_HEADER = os.getenv("SQL_PROFILE_HEADER", "X-SQL-Profile")
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
@@ -0,0 +1,208 @@
+"""
+Background Jobs
+
+Bulk operations too long for one request are queued as JobModels by
+POST /api/jobs and run by `flask run-worker`, a separate process with the
+same app and database, so no broker is needed.
+
+A job works through its input a chunk at a time. Every chunk is committed
+in the same transaction as the job checkpoint and progress, so a worker
+that dies leaves the job at its last chunk, and the next worker to claim
+it after JOB_LEASE_SECONDS carries on from there.
+
+Kinds of jobs and their params:
+
+    activate, deactivate  the selectors of CustomerModel.deserialize_selection()
+    import                {"customers": [...]}, created best effort
+    export                {"include": "addresses"} optional, the output is NDJSON
+"""
+import logging
+import os
+import socket
+import time
+from datetime import datetime
+
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import CustomerModel, DataValidationError, JobModel, db
+from service.utils.streaming import ndjson_chunks
+
+logger = logging.getLogger("flask.app")
+
+# The function running one chunk of every kind of job, by kind
+HANDLERS = {}
+
+
+def handler(kind):
+    """ Registers the function running one chunk of a kind of job """
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def validate_params(kind, params):
+    """ Raises DataValidationError when a job of this kind cannot run with these params """
+    if kind not in HANDLERS:
+        raise DataValidationError(f"Invalid job: kind must be one of {', '.join(sorted(HANDLERS))}")
+    if kind in ("activate", "deactivate"):
+        CustomerModel.deserialize_selection(params)
+    elif kind == "import":
+        if not isinstance(params, dict) or not isinstance(params.get("customers"), list):
+            raise DataValidationError("Invalid job: import needs a customers list")
+    elif not isinstance(params, dict) or params.get("include") not in (None, "addresses"):
+        raise DataValidationError("Invalid job: export takes an optional include of addresses")
+
+
+def submit(kind, params):
+    """ Queues a job and returns it """
+    validate_params(kind, params)
+    job = JobModel(kind=kind, params=params)
+    job.create()
+    return job
+
+
+######################################################################
+# Chunk handlers
+#
+# Each one does the work of the chunk after job.checkpoint without
+# committing, moves the checkpoint and progress along, and returns whether
+# the job is done and the ids of the Customers to drop from the cache.
+######################################################################
+def _set_active(job, chunk_size, is_active):
+    selection = CustomerModel.deserialize_selection(job.params)
+    if job.total is None:
+        job.total = CustomerModel.find_by_selection(**selection).count()
+        job.result = {"updated": 0}
+    query = CustomerModel.find_by_selection(**selection).with_entities(CustomerModel.customer_id)
+    if job.checkpoint is not None:
+        query = query.filter(CustomerModel.customer_id > job.checkpoint)
+    ids = [row.customer_id for row in query.order_by(CustomerModel.customer_id).limit(chunk_size)]
+    changed = CustomerModel.set_active_many(is_active, commit=False, customer_ids=ids) if ids else []
+    if ids:
+        job.checkpoint = ids[-1]
+    job.done += len(ids)
+    job.result = {"updated": job.result["updated"] + len(changed)}
+    return len(ids) < chunk_size, changed
+
+
+@handler("activate")
+def run_activate(job, chunk_size):
+    """ Activates the next chunk of the selected Customers """
+    return _set_active(job, chunk_size, True)
+
+
+@handler("deactivate")
+def run_deactivate(job, chunk_size):
+    """ Deactivates the next chunk of the selected Customers """
+    return _set_active(job, chunk_size, False)
+
+
+@handler("import")
+def run_import(job, chunk_size):
+    """ Creates the next chunk of Customers, skipping and reporting the invalid ones """
+    items = job.params["customers"]
+    start = job.checkpoint or 0
+    if job.total is None:
+        job.total = len(items)
+        job.result = {"created": 0, "failed": 0, "errors": []}
+    customers, errors = [], {}
+    for index, item in enumerate(items[start:start + chunk_size], start=start):
+        try:
+            customers.append((index, CustomerModel().deserialize(item)))
+        except DataValidationError as error:
+            errors[index] = str(error)
+    failed = CustomerModel.create_many([customer for _, customer in customers], chunk_size=chunk_size,
+                                       atomic=False, commit=False)
+    errors.update({customers[offset][0]: error for offset, error in failed.items()})
+    end = min(start + chunk_size, len(items))
+    result = job.result
+    job.result = {
+        "created": result["created"] + (end - start) - len(errors),
+        "failed": result["failed"] + len(errors),
+        "errors": result["errors"] + [{"index": index, "error": errors[index]} for index in sorted(errors)],
+    }
+    job.checkpoint = end
+    job.done = end
+    return end >= len(items), []
+
+
+@handler("export")
+def run_export(job, chunk_size):
+    """ Writes the next chunk of Customers to the output of the job as NDJSON """
+    from service.routes import serialize_customer, serialize_customer_with_addresses  # pylint: disable=import-outside-toplevel
+
+    include_addresses = job.params.get("include") == "addresses"
+    if job.total is None:
+        job.total = CustomerModel.query.count()
+    query = CustomerModel.query
+    if include_addresses:
+        query = CustomerModel.with_addresses(query)
+    if job.checkpoint is not None:
+        query = query.filter(CustomerModel.customer_id > job.checkpoint)
+    customers = query.order_by(CustomerModel.customer_id).limit(chunk_size).all()
+    if customers:
+        serialize = serialize_customer_with_addresses if include_addresses else serialize_customer
+        job.add_output(b"".join(ndjson_chunks(serialize(customer) for customer in customers)).decode("utf-8"))
+        job.checkpoint = customers[-1].customer_id
+    job.done += len(customers)
+    return len(customers) < chunk_size, []
+
+
+######################################################################
+# Worker
+######################################################################
+def worker_name():
+    """ Names this worker process in the jobs it claims """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_job(job, chunk_size):
+    """ Runs the chunks of a claimed job until it is done or fails """
+    logger.info("Running %s from checkpoint %s", job, job.checkpoint)
+    run_chunk = HANDLERS.get(job.kind)
+    while True:
+        try:
+            if run_chunk is None:
+                raise DataValidationError(f"Unknown job kind {job.kind}")
+            finished, changed = run_chunk(job, chunk_size)
+            job.heartbeat_at = datetime.utcnow()
+            if finished:
+                job.finish()
+            db.session.commit()
+        except StaleDataError:
+            # another worker took the job over after our lease expired, leave it the chunk
+            db.session.rollback()
+            logger.warning("%s was taken over by another worker", job)
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            db.session.rollback()
+            logger.exception("%s failed", job)
+            job.finish(error=str(error))
+            db.session.commit()
+            return
+        CustomerModel.invalidate_cache(*changed)
+        if finished:
+            logger.info("%s done after %d items", job, job.done)
+            return
+
+
+def run_worker(app, once=False, poll_seconds=None):
+    """
+    Claims and runs jobs until stopped, or until none is left with once
+
+    Returns:
+        int: the number of jobs run
+    """
+    name = worker_name()
+    poll_seconds = app.config["JOB_POLL_SECONDS"] if poll_seconds is None else poll_seconds
+    logger.info("Worker %s started", name)
+    count = 0
+    while True:
+        job = JobModel.claim(name, app.config["JOB_LEASE_SECONDS"], app.config["JOB_MAX_ATTEMPTS"])
+        if job is not None:
+            run_job(job, app.config["JOB_CHUNK_SIZE"])
+            count += 1
+        elif once:
+            return count
+        else:
+            time.sleep(poll_seconds)
@@ -3,21 +3,82 @@ Models for CustomerModel
 
 All of the models are stored in this module
 """
+import hashlib
 import logging
 from enum import Enum
-from datetime import date
+from datetime import date, datetime, timedelta
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, any_, bindparam, event, literal_column, or_, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.expression import ColumnElement
 import re
 
 
-from tomlkit import string
+from service.utils.cache import ReadThroughCache, backend_from_url
+from service.utils.group_commit import GroupCommit
+from service.utils.search import TrigramIndex
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# Serialized Customers by id, configured from the app config in init_db()
+customer_cache = ReadThroughCache()
+
+# Customer search on SQLite, which has no trigram index
+customer_search_index = TrigramIndex()
+
+# The trigram index of customer search, on the same expression as CustomerModel.search_document()
+SEARCH_INDEX_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_customer_search_trgm ON customer "
+    "USING gist ((first_name || ' ' || last_name || ' ' || nickname || ' ' || email) gist_trgm_ops)"
+)
+
+# The email addresses a Customer may be written with. Only writes check it,
+# reading a Customer back never does
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9_-]+(\.[a-zA-Z0-9_-]+){0,4}@[a-zA-Z0-9_-]+(\.[a-zA-Z0-9_-]+){0,4}$')
+
+
+class bytewise(ColumnElement):  # pylint: disable=invalid-name,abstract-method
+    """Compares a string expression byte by byte, the way the C collation does
+
+    On PostgreSQL this renders as `expr COLLATE "C"`, which lets one btree
+    index serve both LIKE 'prefix%' and ORDER BY. SQLite compares bytes
+    by default so the expression is left as is.
+    """
+    inherit_cache = True
+    _traverse_internals = [("clause", visitors.InternalTraversal.dp_clauseelement)]
+
+    def __init__(self, clause):
+        self.clause = clause
+        self.type = clause.type
+
+
+@compiles(bytewise)
+def _compile_bytewise(element, compiler, **kw):
+    return compiler.process(element.clause, **kw)
+
+
+@compiles(bytewise, "postgresql")
+def _compile_bytewise_postgresql(element, compiler, **kw):
+    return compiler.process(element.clause, **kw) + ' COLLATE "C"'
+
+
+def _like_escape(text: str) -> str:
+    """Lower cases text and escapes the LIKE wildcards in it"""
+    return text.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _like_prefix(prefix: str) -> str:
+    """Builds a lower case LIKE pattern matching strings that start with prefix"""
+    return _like_escape(prefix) + "%"
+
 
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
@@ -25,6 +86,14 @@ class DataValidationError(Exception):
     pass
 
 
+class BulkCreateError(DataValidationError):
+    """ Used when an atomic bulk create was rolled back, with the error of each rejected Customer by position """
+
+    def __init__(self, message, errors):
+        super().__init__(message)
+        self.errors = errors
+
+
 class Gender(Enum):
     """Enumeration of valid Customer Genders"""
 
@@ -41,26 +110,56 @@ class CustomerModel(db.Model):
 
     app = None
 
+    # "trigram" when search runs in PostgreSQL with pg_trgm, "like" when it
+    # is a bounded ILIKE scan on PostgreSQL without it, "memory" when it runs
+    # in customer_search_index on SQLite, set by init_db()
+    search_backend = "memory"
+
     # Table Schema
     customer_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     password = db.Column(db.String(63), nullable=False)
     first_name = db.Column(db.String(63), nullable=False)
     last_name = db.Column(db.String(63), nullable=False)
-    nickname = db.Column(db.String(63), nullable=False)
+    nickname = db.Column(db.String(63), nullable=False, index=True)
     email = db.Column(db.String(63), nullable=False)
     gender = db.Column(
         db.Enum(Gender), nullable=False, server_default=(Gender.UNKNOWN.name)
     )
-    birthday = db.Column(db.Date(), nullable=False, default=date.today())
+    birthday = db.Column(db.Date(), nullable=False, default=date.today(), index=True)
+    # month * 100 + day of the birthday, 1018 for October 18th, computed by
+    # the database so that birthdays can be looked up whatever the year
+    birthday_mmdd = db.Column(db.Integer, db.Computed(
+        db.cast(db.extract("month", birthday), db.Integer) * 100 + db.cast(db.extract("day", birthday), db.Integer)
+    ))
     is_active = db.Column(db.Boolean(), nullable=False, default=True)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
     addresses = db.relationship("AddressModel", cascade="all, delete-orphan")
 
+    # Every UPDATE bumps the version and checks the one it read, so a lost
+    # update raises StaleDataError instead of overwriting a newer row
+    __mapper_args__ = {"version_id_col": version}
+
+    # Indexes behind the query string filters of GET /customers
+    __table_args__ = (
+        db.Index("ix_customer_email_lower", db.func.lower(email), unique=True),
+        db.Index("ix_customer_last_name_first_name", last_name, first_name),
+        # serves the birthday month, day and window filters a page at a time
+        db.Index("ix_customer_birthday_mmdd", birthday_mmdd, customer_id),
+        # serves both the name prefix filter and the name ordering of its pages
+        db.Index(
+            "ix_customer_name_lower",
+            bytewise(db.func.lower(last_name)),
+            bytewise(db.func.lower(first_name)),
+            customer_id,
+        ),
+    )
+
     def __repr__(self):
         return "<CustomerModel %r customer_id=[%s]>" % (self.first_name, self.customer_id)
 
-    def _email_validator(self, email):
-        pattern = r'^[a-zA-Z0-9_-]+(\.[a-zA-Z0-9_-]+){0,4}@[a-zA-Z0-9_-]+(\.[a-zA-Z0-9_-]+){0,4}$'
-        if not re.match(pattern, email):
+    @staticmethod
+    def _email_validator(email):
+        if not EMAIL_PATTERN.match(email):
             raise DataValidationError(
                 "Invalid email address format"
             )
@@ -69,11 +168,226 @@ class CustomerModel(db.Model):
     def create(self):
         """
         Creates a CustomerModel to the database
+
+        With CUSTOMER_GROUP_COMMIT_MS set, it is committed together with the
+        Customers created at the same time by the other threads, see
+        create_group()
         """
         logger.info("Creating %s", self.first_name)
         self.customer_id = None  # customer_id must be none to generate next primary key
+        if customer_group_commit.enabled:
+            customer_group_commit.submit(self)
+            # committed by another session: the columns filled in by the database load through this one
+            db.session.add(self)
+            return
         db.session.add(self)
         db.session.commit()
+        self.invalidate_cache(self.customer_id)
+
+    @classmethod
+    def create_group(cls, customers):
+        """
+        Creates the Customers of concurrent requests in one transaction
+
+        The Customers are inserted together, and one by one if that fails,
+        so that a duplicate email fails only the Customer that has it. They
+        are detached once committed, for each request to carry on with its
+        own in its own session.
+
+        Returns:
+            list: the IntegrityError of every Customer not created, None for the others
+        """
+        logger.info("Creating a group of %d customers", len(customers))
+        try:
+            errors = cls._insert_chunk_or_skip(customers, 0)
+            created = [customer.customer_id for index, customer in enumerate(customers) if index not in errors]
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for customer in customers:
+            if customer in db.session:
+                db.session.expunge(customer)
+        cls.invalidate_cache(*created)
+        return [errors.get(index) for index in range(len(customers))]
+
+    @classmethod
+    def create_many(cls, customers, chunk_size: int = 1000, atomic: bool = True, commit: bool = True):
+        """
+        Creates many CustomerModels to the database in one transaction
+
+        The Customers are flushed `chunk_size` at a time so that each chunk goes
+        out as a batched multi-row INSERT, and everything is committed once.
+
+        Args:
+            customers (list): the CustomerModels to create
+            chunk_size (int): the number of Customers sent per INSERT batch
+            atomic (bool): roll everything back on the first database error
+                instead of skipping the Customers that fail
+            commit (bool): commit the Customers, otherwise it is left to the caller
+
+        Returns:
+            dict: the database error of every skipped Customer by its position
+
+        Raises:
+            BulkCreateError: in atomic mode, once everything was rolled back,
+                with the database error of every Customer that caused it
+        """
+        logger.info("Creating %d customers in chunks of %d", len(customers), chunk_size)
+        errors = {}
+        try:
+            for start in range(0, len(customers), chunk_size):
+                chunk = customers[start:start + chunk_size]
+                if atomic:
+                    cls._insert_chunk(chunk)
+                else:
+                    errors.update(cls._insert_chunk_or_skip(chunk, start))
+            if commit:
+                db.session.commit()
+        except IntegrityError as error:
+            db.session.rollback()
+            message = "Invalid CustomerModel: " + str(error.orig).strip()
+            if not atomic:
+                raise DataValidationError(message) from error
+            raise BulkCreateError(message, cls._find_rejected(customers, chunk_size) or {0: message}) from error
+        return {index: str(error.orig).strip() for index, error in errors.items()}
+
+    @classmethod
+    def _find_rejected(cls, customers, chunk_size):
+        """Inserts the Customers best effort to find those the database rejects, and rolls them all back"""
+        try:
+            if db.engine.dialect.name == "sqlite":
+                # pysqlite begins a transaction before an INSERT or UPDATE only, and
+                # releasing a savepoint taken outside of one commits it
+                db.session.execute(update(cls).where(cls.customer_id.is_(None)).values(version=cls.version))
+            errors = {}
+            for start in range(0, len(customers), chunk_size):
+                errors.update(cls._insert_chunk_or_skip(customers[start:start + chunk_size], start))
+        finally:
+            db.session.rollback()
+            for customer in customers:
+                customer.customer_id = None
+        return {index: str(error.orig).strip() for index, error in errors.items()}
+
+    @staticmethod
+    def deserialize_selection(data):
+        """
+        Deserializes the selectors of a set of Customers from a dictionary
+
+        Args:
+            data (dict): customer_ids, email_domain, birthday_from and birthday_to, all optional
+
+        Returns:
+            dict: the keyword arguments of find_by_selection() and set_active_many()
+        """
+        if not isinstance(data, dict):
+            raise DataValidationError("Invalid selection: body must be a JSON object")
+        unknown = set(data) - {"customer_ids", "email_domain", "birthday_from", "birthday_to"}
+        if unknown:
+            raise DataValidationError("Invalid selection: unknown " + ", ".join(sorted(unknown)))
+        selection = {"customer_ids": data.get("customer_ids"), "email_domain": data.get("email_domain")}
+        ids = selection["customer_ids"]
+        if ids is not None and (
+            not isinstance(ids, list) or not all(isinstance(id_, int) and not isinstance(id_, bool) for id_ in ids)
+        ):
+            raise DataValidationError("Invalid selection: customer_ids must be a list of integers")
+        if selection["email_domain"] is not None and not isinstance(selection["email_domain"], str):
+            raise DataValidationError("Invalid selection: email_domain must be a string")
+        for name in ("birthday_from", "birthday_to"):
+            try:
+                selection[name] = date.fromisoformat(data[name]) if data.get(name) is not None else None
+            except (TypeError, ValueError) as error:
+                raise DataValidationError(f"Invalid selection: {name} must be an ISO date") from error
+        if not any(value is not None for value in selection.values()):
+            raise DataValidationError("Invalid selection: give customer_ids, email_domain or a birthday range")
+        return selection
+
+    @classmethod
+    def _selection_criteria(cls, customer_ids=None, email_domain: str = None,
+                            birthday_from: date = None, birthday_to: date = None):
+        """Returns the filters selecting the Customers that match all of the given selectors"""
+        criteria = []
+        if customer_ids is not None:
+            if db.engine.dialect.name == "postgresql":
+                # one array parameter, customer_id = ANY(%(ids)s), however many ids there are
+                criteria.append(cls.customer_id == any_(bindparam("customer_ids", list(customer_ids), ARRAY(db.Integer))))
+            else:
+                criteria.append(cls.customer_id.in_(customer_ids))
+        if email_domain:
+            criteria.append(db.func.lower(cls.email).like("%@" + _like_escape(email_domain), escape="\\"))
+        if birthday_from:
+            criteria.append(cls.birthday >= birthday_from)
+        if birthday_to:
+            criteria.append(cls.birthday <= birthday_to)
+        if not criteria:
+            raise DataValidationError("Invalid selection: give customer_ids, email_domain or a birthday range")
+        return criteria
+
+    @classmethod
+    def find_by_selection(cls, **selection):
+        """Returns all Customers matching all of the selectors of set_active_many()"""
+        return cls.query.filter(*cls._selection_criteria(**selection))
+
+    @classmethod
+    def set_active_many(cls, is_active: bool, commit: bool = True, **selection):
+        """
+        Activates or deactivates every selected CustomerModel with one set-based UPDATE
+
+        The selectors are combined with AND and at least one is required.
+        Customers already in the wanted state are left alone.
+
+        Args:
+            is_active (bool): the state to put the Customers in
+            commit (bool): commit and drop the changed Customers from the cache,
+                otherwise both are left to the caller
+            customer_ids (list): only the Customers with these ids
+            email_domain (str): only the Customers with an email at this domain, ignoring case
+            birthday_from (date), birthday_to (date): only the Customers born in this range, inclusive
+
+        Returns:
+            list: the ids of the Customers that changed
+        """
+        criteria = cls._selection_criteria(**selection)
+        logger.info("Setting is_active=%s on the Customers matching %d criteria", is_active, len(criteria))
+        criteria.append(cls.is_active != is_active)
+
+        statement = update(cls).where(*criteria).values(is_active=is_active, version=cls.version + 1)
+        statement = statement.execution_options(synchronize_session=False)
+        if db.engine.dialect.full_returning:
+            changed = db.session.execute(statement.returning(cls.customer_id)).scalars().all()
+        else:
+            changed = db.session.execute(db.select(cls.customer_id).where(*criteria)).scalars().all()
+            db.session.execute(statement)
+        if commit:
+            db.session.commit()
+            cls.invalidate_cache(*changed)
+        return changed
+
+    @staticmethod
+    def _insert_chunk(chunk):
+        """Inserts one chunk of Customers without committing"""
+        for customer in chunk:
+            customer.customer_id = None  # customer_id must be none to generate next primary key
+        db.session.add_all(chunk)
+        db.session.flush()
+
+    @classmethod
+    def _insert_chunk_or_skip(cls, chunk, offset):
+        """Inserts one chunk inside a savepoint, retrying row by row if it fails"""
+        try:
+            with db.session.begin_nested():
+                cls._insert_chunk(chunk)
+            return {}
+        except IntegrityError:
+            pass
+        errors = {}
+        for index, customer in enumerate(chunk, start=offset):
+            try:
+                with db.session.begin_nested():
+                    cls._insert_chunk([customer])
+            except IntegrityError as error:
+                errors[index] = error
+        return errors
 
     def update(self):
         """
@@ -81,29 +395,46 @@ class CustomerModel(db.Model):
         """
         logger.info("Saving %s", self.first_name)
         db.session.commit()
+        self.invalidate_cache(self.customer_id)
 
     def delete(self):
         """ Removes a CustomerModel from the data store """
         logger.info("Deleting %s", self.first_name)
+        customer_id = self.customer_id
         db.session.delete(self)
         db.session.commit()
+        self.invalidate_cache(customer_id)
 
-    def serialize(self):
-        """ Serializes a CustomerModel into a dictionary """
+    @staticmethod
+    def invalidate_cache(*customer_ids):
+        """ Drops the cached representation of Customers after a committed write """
+        customer_cache.invalidate(*(f"customer:{customer_id}" for customer_id in customer_ids))
+        if customer_ids and CustomerModel.search_backend == "memory":
+            # the table fingerprint misses a write that keeps the counts, like
+            # a Customer deleted and another created with the same id
+            customer_search_index.clear()
+
+    def serialize(self, include_addresses=True):
+        """ Serializes a CustomerModel into a dictionary
+
+        Args:
+            include_addresses (bool): serialize the addresses too. Leave it off
+                when they are not needed so the relationship is never loaded
+        """
         customer = {
             "customer_id": self.customer_id,
             "first_name": self.first_name,
             "last_name": self.last_name,
             "nickname": self.nickname,
-            "email": self._email_validator(self.email),
+            "email": self.email,
             "gender": self.gender.name,
             "birthday": self.birthday.isoformat(),
             "password": self.password,
-            "addresses": [],
-            "is_active": self.is_active
+            "is_active": self.is_active,
+            "version": self.version,
         }
-        for address in self.addresses:
-            customer["addresses"].append(address.serialize())
+        if include_addresses:
+            customer["addresses"] = [address.serialize() for address in self.addresses]
         return customer
 
     def deserialize(self, data):
@@ -149,10 +480,57 @@ class CustomerModel(db.Model):
         """ Initializes the database session """
         logger.info("Initializing database")
         cls.app = app
-        # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
+        cache_url = app.config.get("CUSTOMER_CACHE_URL")
+        customer_cache.configure(
+            maxsize=app.config.get("CUSTOMER_CACHE_SIZE", 10000),
+            ttl=app.config.get("CUSTOMER_CACHE_TTL", 60.0),
+            backend=backend_from_url(cache_url),
+            enabled=bool(cache_url),
+        )
+        customer_group_commit.configure(
+            window=app.config.get("CUSTOMER_GROUP_COMMIT_MS", 0.0) / 1000,
+            max_size=app.config.get("CUSTOMER_GROUP_COMMIT_MAX", 50),
+        )
+        # This is where we initialize SQLAlchemy from the Flask app, only once:
+        # binding it again would leave its engine behind with open connections
+        if "sqlalchemy" not in app.extensions:
+            db.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        if db.engine.dialect.name != "postgresql":
+            cls.search_backend = "memory"
+        elif cls.has_trigram_search(db.engine):
+            cls.search_backend = "trigram"
+        else:
+            cls.search_backend = "like"
+            logger.warning("pg_trgm is not installed: customer search scans the customer table with ILIKE and "
+                           "does not rank, install it and run flask upgrade-db to index it")
+        logger.info("Customer search runs in %s", cls.search_backend)
+
+    @staticmethod
+    def has_trigram_search(bind):
+        """Tells whether the database has pg_trgm for customer search"""
+        if bind.dialect.name != "postgresql":
+            return False
+        with bind.connect() as conn:
+            return conn.exec_driver_sql("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first() is not None
+
+    @staticmethod
+    def create_search_index(conn):
+        """Creates pg_trgm and the trigram index of customer search on PostgreSQL
+
+        Returns whether the index exists. Without pg_trgm, or the right to
+        create it, customer search falls back to an ILIKE scan.
+        """
+        if conn.dialect.name != "postgresql":
+            return False
+        try:
+            with conn.begin_nested():
+                conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except DBAPIError as error:
+            logger.warning("Customer search cannot use pg_trgm: %s", str(error.orig).strip())
+            return False
+        conn.exec_driver_sql(SEARCH_INDEX_DDL)
+        return True
 
     @classmethod
     def all(cls):
@@ -160,12 +538,226 @@ class CustomerModel(db.Model):
         logger.info("Processing all CustomerModels")
         return cls.query.all()
 
+    @classmethod
+    def with_addresses(cls, query):
+        """Makes a Customer query load the addresses of all its rows at once
+
+        The addresses are fetched with one extra SELECT ... WHERE customer_id IN
+        per batch of Customers instead of one lazy SELECT per Customer.
+        """
+        return query.options(selectinload(cls.addresses))
+
+    @classmethod
+    def stream_all(cls, batch_size: int = 1000, with_addresses: bool = False):
+        """Returns all of the CustomerModels as a server-side cursor
+
+        Rows are fetched `batch_size` at a time so the whole table is
+        never held in memory at once.
+        """
+        logger.info("Processing stream of all CustomerModels")
+        query = cls.query
+        if with_addresses:
+            query = cls.with_addresses(query)
+        return query.order_by(cls.customer_id).yield_per(batch_size)
+
+    @classmethod
+    def project(cls, query, fields=None, rows: bool = False, keys=("customer_id",)):
+        """Makes a Customer query read only some of the columns
+
+        :param fields: the names of the fields wanted, all of them by default.
+            Names that are not columns, like addresses, are left to the caller
+        :param rows: return the columns as row tuples instead of CustomerModels
+            whose other columns are never loaded
+        :param keys: the columns read whatever the fields, the ones the caller
+            pages or tags by
+        """
+        if fields is None:
+            return query.with_entities(*cls.__table__.columns) if rows else query
+        names = [name for name in dict.fromkeys([*keys, *fields]) if name in cls.__table__.columns]
+        columns = [getattr(cls, name) for name in names]
+        return query.with_entities(*columns) if rows else query.options(load_only(*columns))
+
+    @classmethod
+    def paginate(cls, limit: int, after_id: int = None, query=None, with_addresses: bool = False, rows: bool = False,
+                 fields=None):
+        """Returns one page of Customers using keyset pagination
+
+        Rows are ordered by customer_id and only the ones after `after_id`
+        are read, so every page costs the same no matter how deep it is.
+        One extra row is fetched to tell if there is a next page.
+
+        :param limit: the maximum number of Customers in the page
+        :param after_id: the last customer_id of the previous page
+        :param query: the query to page through, all Customers by default
+        :param with_addresses: batch load the addresses of the page
+        :param rows: return the columns of the Customers as row tuples, which
+            skips building CustomerModels, instead of CustomerModels
+        :param fields: read only these fields, see project()
+
+        :return: the Customers of the page and whether more rows follow
+        :rtype: tuple(list, bool)
+
+        """
+        logger.info("Processing page of %d after customer_id %s ...", limit, after_id)
+        if query is None:
+            query = cls.query
+        if after_id is not None:
+            query = query.filter(cls.customer_id > after_id)
+        if with_addresses:
+            query = cls.with_addresses(query)
+        query = cls.project(query, fields, rows)
+        customers = query.order_by(cls.customer_id).limit(limit + 1).all()
+        return customers[:limit], len(customers) > limit
+
+    @classmethod
+    def paginate_by_name(cls, limit: int, after: list = None, query=None, with_addresses: bool = False,
+                         rows: bool = False, fields=None):
+        """Returns one page of Customers in case insensitive name order
+
+        Works like paginate() but seeks on (last name, first name, customer_id)
+        so that a name prefix search walks ix_customer_name_lower in order and
+        stops after one page, however many Customers match. The position of
+        the page is made of the lower cased names the database returned, which
+        on SQLite only lower cases ASCII, so it always matches the order.
+        Row tuples also carry these as last_name_key and first_name_key.
+
+        :param after: the position returned with the previous page
+
+        :return: the Customers of the page and the position of the next
+            page, None when no more rows follow
+        :rtype: tuple(list, list)
+
+        """
+        logger.info("Processing page of %d by name after %s ...", limit, after)
+        if query is None:
+            query = cls.query
+        keys = (bytewise(db.func.lower(cls.last_name)), bytewise(db.func.lower(cls.first_name)), cls.customer_id)
+        if after is not None:
+            query = query.filter(tuple_(*keys) > tuple_(*after))
+        if with_addresses:
+            query = cls.with_addresses(query)
+        query = cls.project(query, fields, rows, keys=("last_name", "first_name", "customer_id"))
+        query = query.add_columns(db.func.lower(cls.last_name).label("last_name_key"),
+                                  db.func.lower(cls.first_name).label("first_name_key"))
+        results = query.order_by(*keys).limit(limit + 1).all()
+        customers = results[:limit] if rows else [result[0] for result in results[:limit]]
+        if len(results) <= limit:
+            return customers, None
+        last = results[limit - 1]
+        return customers, [last.last_name_key, last.first_name_key, customers[-1].customer_id]
+
+    @classmethod
+    def search_document(cls):
+        """Returns the text customer search matches, the expression of ix_customer_search_trgm"""
+        space = literal_column("' '")
+        return cls.first_name + space + cls.last_name + space + cls.nickname + space + cls.email
+
+    @classmethod
+    def paginate_search(cls, text: str, limit: int, offset: int = 0, with_addresses: bool = False,
+                        rows: bool = False, fields=None):
+        """Returns one page of the Customers matching a search, best match first
+
+        Names, nickname and email are matched by the word similarity of their
+        trigrams, so partial and misspelt words are found too. On PostgreSQL
+        with pg_trgm the ranking walks ix_customer_search_trgm, and on SQLite
+        customer_search_index does it in process. On PostgreSQL without
+        pg_trgm the Customers holding every word of text are listed in id
+        order instead, so that the scan stops at the end of the page.
+
+        :param text: what to search for
+        :param offset: the number of matches on the previous pages
+
+        :return: the Customers of the page and whether more rows follow
+        :rtype: tuple(list, bool)
+
+        """
+        logger.info("Processing search of %r at %d ...", text, offset)
+        if cls.search_backend == "trigram":
+            document = cls.search_document()
+            query = cls.query.filter(document.op("%>")(text))
+            order = (document.op("<->>")(text), cls.customer_id)
+        elif cls.search_backend == "like":
+            document = cls.search_document()
+            query = cls.query.filter(*(document.ilike("%" + _like_escape(word) + "%", escape="\\")
+                                       for word in text.split()))
+            order = (cls.customer_id,)
+        else:
+            ids = cls._search_in_process(text)[offset:offset + limit + 1]
+            query = cls.query.filter(cls.customer_id.in_(ids))
+            offset, order = 0, ()
+        if with_addresses:
+            query = cls.with_addresses(query)
+        customers = cls.project(query, fields, rows).order_by(*order).offset(offset).limit(limit + 1).all()
+        if cls.search_backend == "memory":
+            position = {customer_id: index for index, customer_id in enumerate(ids)}
+            customers.sort(key=lambda customer: position[customer.customer_id])
+        return customers[:limit], len(customers) > limit
+
+    @classmethod
+    def _search_in_process(cls, text):
+        fingerprint = db.session.query(db.func.count(cls.customer_id), db.func.max(cls.customer_id),
+                                       db.func.sum(cls.version)).one()
+
+        def load():
+            return db.session.query(cls.customer_id, cls.search_document()).yield_per(10000)
+
+        customer_search_index.refresh(tuple(fingerprint), load)
+        return customer_search_index.search(text)
+
+    @staticmethod
+    def make_etag(customer_id, version, fields=None):
+        """Returns the strong ETag of a version of a Customer, or of the projection on fields, without quotes"""
+        if fields is not None:
+            return f"{customer_id}-{version}-{'.'.join(sorted(fields))}"
+        return f"{customer_id}-{version}"
+
+    def etag(self):
+        """Returns the strong ETag of this Customer, without quotes"""
+        return self.make_etag(self.customer_id, self.version)
+
     @classmethod
     def find(cls, by_id):
         """ Finds a CustomerModel by it's customer_id """
         logger.info("Processing lookup for customer_id %s ...", by_id)
         return cls.query.get(by_id)
 
+    @classmethod
+    def find_serialized(cls, customer_id: int, fields=None):
+        """Returns the serialized Customer with the id, without its addresses
+
+        The result is read through customer_cache, so a repeated lookup does
+        not reach the database until the Customer is written or the entry
+        expires. Returns None when there is no such Customer.
+
+        With fields, a cached Customer is still used, but a miss reads only
+        those columns and the version, as a dictionary of the raw column
+        values, and caches nothing.
+        """
+        if fields is not None and customer_cache.peek(f"customer:{customer_id}") is None:
+            query = cls.project(cls.query.filter(cls.customer_id == customer_id), fields, rows=True,
+                                keys=("customer_id", "version"))
+            row = query.first()
+            return None if row is None else dict(row._mapping)
+
+        def load():
+            customer = cls.find(customer_id)
+            return None if customer is None else customer.serialize(include_addresses=False)
+
+        customer = customer_cache.get_or_load(f"customer:{customer_id}", load)
+        return None if customer is None else dict(customer)
+
+    @classmethod
+    def find_version(cls, customer_id: int):
+        """Returns the version of the Customer with the id, or None
+
+        Uses the cached Customer when there is one, and otherwise reads only
+        the version column through the primary key index.
+        """
+        customer = customer_cache.peek(f"customer:{customer_id}")
+        if customer is not None:
+            return customer["version"]
+        return db.session.query(cls.version).filter(cls.customer_id == customer_id).scalar()
+
     @classmethod
     def find_or_404(cls, customer_id: int):
         """Find a Customer by it's id
@@ -181,22 +773,59 @@ class CustomerModel(db.Model):
         return cls.query.get_or_404(customer_id)
 
     @classmethod
-    def find_by_nickname(cls, nickname: string):
+    def find_by_nickname(cls, nickname: str):
         """Find customers by it's nickname"""
         logger.info("Processing lookup for nickname %s ...", nickname)
         return cls.query.filter(CustomerModel.nickname == nickname)
 
     @classmethod
     def find_by_email(cls, email):
-        """Returns all Customers with the given Email"""
+        """Returns all Customers with the given Email, ignoring case"""
         logger.info("Processing email query for %s  ...", email)
-        return cls.query.filter(cls.email == email)
+        return cls.query.filter(db.func.lower(cls.email) == email.lower())
+
+    @classmethod
+    def find_invalid_emails(cls, batch_size=1000):
+        """Yields the (customer_id, email) of the stored Customers whose email is invalid
+
+        Emails are only checked when written, so this finds the rows written
+        before the check or straight into the database. It reads the table
+        a batch at a time in customer_id order.
+        """
+        last_id = None
+        while True:
+            query = cls.query.with_entities(cls.customer_id, cls.email)
+            if last_id is not None:
+                query = query.filter(cls.customer_id > last_id)
+            rows = query.order_by(cls.customer_id).limit(batch_size).all()
+            for customer_id, email in rows:
+                if not EMAIL_PATTERN.match(email):
+                    yield customer_id, email
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1].customer_id
 
     @classmethod
     def find_by_name(cls, firstname, lastname):
         """Returns all Customers by given name(first name and last name)"""
         logger.info("Processing name query for %s %s  ...", firstname, lastname)
-        return cls.query.filter(cls.first_name == firstname and cls.last_name == lastname)
+        return cls.query.filter(cls.last_name == lastname, cls.first_name == firstname)
+
+    @classmethod
+    def find_by_name_prefix(cls, firstname=None, lastname=None):
+        """Returns all Customers whose names start with the given prefixes, ignoring case
+
+        Either prefix may be left out. The expressions match the
+        ix_customer_name_lower index so the search is an index range scan,
+        best paged with paginate_by_name().
+        """
+        logger.info("Processing name prefix query for %s %s  ...", firstname, lastname)
+        query = cls.query
+        if lastname:
+            query = query.filter(bytewise(db.func.lower(cls.last_name)).like(_like_prefix(lastname), escape="\\"))
+        if firstname:
+            query = query.filter(bytewise(db.func.lower(cls.first_name)).like(_like_prefix(firstname), escape="\\"))
+        return query
 
     @classmethod
     def find_by_birthday(cls, birthday):
@@ -204,6 +833,48 @@ class CustomerModel(db.Model):
         logger.info("Processing birthday query for %s  ...", birthday)
         return cls.query.filter(cls.birthday == birthday)
 
+    @staticmethod
+    def month_day(month: int, day: int) -> int:
+        """Returns the birthday_mmdd of a day of the year, raising DataValidationError for no such day"""
+        try:
+            date(2000, month, day)  # a leap year, so February 29th is a day too
+        except (TypeError, ValueError) as error:
+            raise DataValidationError(f"Invalid day of the year: {month}-{day}") from error
+        return month * 100 + day
+
+    @classmethod
+    def find_by_birthday_month_day(cls, month: int, day: int = None):
+        """Returns all Customers born in a month, or on a day of a month, of any year"""
+        logger.info("Processing birthday query for month %s day %s ...", month, day)
+        if day is not None:
+            return cls.query.filter(cls.birthday_mmdd == cls.month_day(month, day))
+        first = cls.month_day(month, 1)
+        return cls.query.filter(cls.birthday_mmdd.between(first, first + 30))
+
+    @classmethod
+    def find_by_birthday_window(cls, start, end):
+        """Returns all Customers whose birthday falls between two days of the year, both included
+
+        :param start: the (month, day) the window opens on
+        :param end: the (month, day) the window closes on. When it comes before
+            start the window wraps past December 31st into the next year
+
+        """
+        logger.info("Processing birthday window query from %s to %s ...", start, end)
+        first, last = cls.month_day(*start), cls.month_day(*end)
+        if first <= last:
+            return cls.query.filter(cls.birthday_mmdd.between(first, last))
+        return cls.query.filter(or_(cls.birthday_mmdd >= first, cls.birthday_mmdd <= last))
+
+
+# Single Customer creates committed together, configured from the app config in init_db()
+customer_group_commit = GroupCommit(CustomerModel.create_group)
+
+
+@event.listens_for(CustomerModel.__table__, "after_create")
+def _create_search_index(target, connection, **kw):  # pylint: disable=unused-argument
+    CustomerModel.create_search_index(connection)
+
 
 class AddressModel(db.Model):
     """
@@ -214,9 +885,12 @@ class AddressModel(db.Model):
     app = None
 
     # Table Schema
-    customer_id = db.Column(db.Integer, db.ForeignKey("customer.customer_id"), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customer.customer_id"), nullable=False, index=True)
     address_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     address = db.Column(db.String(255), nullable=False)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return "<AddressModel %r customer_id=[%s] address_id=[%s]>" % (self.address, self.customer_id, self.address_id)
@@ -229,6 +903,7 @@ class AddressModel(db.Model):
         self.address_id = None  # address_id must be none to generate next primary key
         db.session.add(self)
         db.session.commit()
+        CustomerModel.invalidate_cache(self.customer_id)
 
     def update(self):
         """
@@ -238,17 +913,32 @@ class AddressModel(db.Model):
         if not self.address_id:
             raise DataValidationError("Update called with empty ID field")
         db.session.commit()
+        CustomerModel.invalidate_cache(self.customer_id)
 
     def delete(self):
         """ Removes a AddressModel from the data store """
         logger.info("Deleting %s %s", self.customer_id, self.address_id)
+        customer_id = self.customer_id
         db.session.delete(self)
         db.session.commit()
+        CustomerModel.invalidate_cache(customer_id)
 
     def serialize(self):
         """ Serializes a AddressModel into a dictionary """
         return {"customer_id": self.customer_id, "address_id": self.address_id, "address": self.address}
 
+    def etag(self):
+        """Returns the strong ETag of this AddressModel, without quotes"""
+        return f"{self.address_id}-{self.version}"
+
+    @staticmethod
+    def collection_etag(addresses):
+        """Returns a strong ETag that changes whenever an address is added, removed or updated"""
+        digest = hashlib.blake2b(digest_size=16)
+        for address in sorted(addresses, key=lambda address: address.address_id):
+            digest.update(f"{address.address_id}-{address.version};".encode("ascii"))
+        return digest.hexdigest()
+
     def deserialize(self, data):
         """
         Deserializes a AddressModel from a dictionary
@@ -279,10 +969,11 @@ class AddressModel(db.Model):
         """ Initializes the database session """
         logger.info("Initializing database")
         cls.app = app
-        # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
+        # This is where we initialize SQLAlchemy from the Flask app, only once:
+        # binding it again would leave its engine behind with open connections
+        if "sqlalchemy" not in app.extensions:
+            db.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
 
     @classmethod
     def all(cls):
@@ -293,7 +984,7 @@ class AddressModel(db.Model):
     @classmethod
     def find_by_customer_id(cls, customer_id):
         logger.info("Processing customer_id query for %s ...", customer_id)
-        return cls.query.filter(cls.customer_id == customer_id)
+        return cls.query.filter(cls.customer_id == customer_id).order_by(cls.address_id)
 
     @classmethod
     def find_by_customer_and_address_id(cls, customer_id, address_id):
@@ -304,6 +995,73 @@ class AddressModel(db.Model):
         logger.info("Processing customer_id and address_id query for %s %s ...", customer_id, address_id)
         return cls.query.filter(cls.customer_id == customer_id).filter(cls.address_id == address_id)
 
+    @classmethod
+    def find_for_customer(cls, customer_id, address_id):
+        """Looks up a Customer and one of its AddressModels in a single statement
+
+        Args:
+            customer_id (int), address_id(int): the ids of the Customer and of its AddressModel
+        Returns:
+            (bool, AddressModel): whether the Customer exists, and its AddressModel or None
+        """
+        logger.info("Processing customer_id and address_id lookup for %s %s ...", customer_id, address_id)
+        row = (
+            db.session.query(CustomerModel.customer_id, cls)
+            .select_from(CustomerModel)
+            .outerjoin(cls, and_(cls.customer_id == CustomerModel.customer_id, cls.address_id == address_id))
+            .filter(CustomerModel.customer_id == customer_id)
+            .first()
+        )
+        return (row is not None, row[1] if row is not None else None)
+
+    @classmethod
+    def update_for_customer(cls, customer_id, address_id, address, versions=None):
+        """Sets the address of an AddressModel of a Customer and bumps its version
+
+        On databases with UPDATE ... RETURNING this is a single statement.
+        With versions, only an AddressModel at one of these versions is updated.
+
+        Returns:
+            AddressModel: the updated AddressModel, or None when none matched
+        """
+        logger.info("Processing address update for %s %s ...", customer_id, address_id)
+        criteria = [cls.customer_id == customer_id, cls.address_id == address_id]
+        if versions is not None:
+            criteria.append(cls.version.in_(versions))
+        if db.engine.dialect.full_returning:
+            statement = (
+                update(cls).where(*criteria)
+                .values(address=address, version=cls.version + 1)
+                .returning(cls.customer_id, cls.address_id, cls.address, cls.version)
+                .execution_options(synchronize_session=False)
+            )
+            row = db.session.execute(statement).first()
+            found = cls(**row._mapping) if row is not None else None
+        else:
+            found = cls.query.filter(*criteria).first()
+            if found is not None:
+                found.address = address
+                db.session.flush()
+                db.session.expunge(found)  # keeps its values past the commit, like the RETURNING row
+        db.session.commit()
+        if found is not None:
+            CustomerModel.invalidate_cache(customer_id)
+        return found
+
+    @classmethod
+    def delete_for_customer(cls, customer_id, address_id):
+        """Deletes an AddressModel of a Customer with a single statement
+
+        Returns:
+            bool: whether an AddressModel was deleted
+        """
+        logger.info("Deleting %s %s", customer_id, address_id)
+        deleted = cls.query.filter(cls.customer_id == customer_id, cls.address_id == address_id).delete()
+        db.session.commit()
+        if deleted:
+            CustomerModel.invalidate_cache(customer_id)
+        return deleted > 0
+
     @classmethod
     def update_address_by_address_and_customer_id(cls, address_id, customer_id, new_address):
         """Update an Address information under address_id
@@ -313,13 +1071,11 @@ class AddressModel(db.Model):
         """
         logger.info("Processing address update for %s ...",  address_id)
 
-        address_found = AddressModel.find_by_customer_and_address_id(address_id, customer_id)
-        if address_found.count() == 0:
+        address_model = AddressModel.find_by_customer_and_address_id(address_id, customer_id).first()
+        if address_model is None:
             raise DataValidationError("the address_id dosen't exist")
-        else:
-            address_model = address_found[0]
-            address_model.address = new_address
-            address_model.update()
+        address_model.address = new_address
+        address_model.update()
 
     @classmethod
     def find_or_404(cls, address_id: int):
@@ -334,3 +1090,143 @@ class AddressModel(db.Model):
         """
         logger.info("Processing lookup or 404 for id %s ...", address_id)
         return cls.query.get_or_404(address_id)
+
+
+class JobStatus(Enum):
+    """Enumeration of the states of a Job"""
+
+    QUEUED = 0
+    RUNNING = 1
+    SUCCEEDED = 2
+    FAILED = 3
+
+
+class JobModel(db.Model):
+    """
+    Class that represents a long running Job, run a chunk at a time by a worker
+
+    `checkpoint` is the position after which the next chunk starts. It is
+    committed together with the work of every chunk, so a Job whose worker
+    died resumes where it left off once its lease has expired.
+    """
+    __tablename__ = "job"
+
+    app = None
+
+    # Table Schema
+    job_id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.Enum(JobStatus), nullable=False, default=JobStatus.QUEUED, index=True)
+    params = db.Column(db.JSON, nullable=False)
+    checkpoint = db.Column(db.Integer)
+    done = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    # a worker that lost its lease fails to commit its chunk instead of doing it twice
+    __mapper_args__ = {"version_id_col": version}
+
+    def __repr__(self):
+        return f"<JobModel {self.kind} job_id=[{self.job_id}] status=[{self.status}]>"
+
+    def create(self):
+        """ Queues a JobModel """
+        logger.info("Queueing %s job", self.kind)
+        self.job_id = None
+        db.session.add(self)
+        db.session.commit()
+
+    def serialize(self):
+        """ Serializes a JobModel into a dictionary, without its params and result """
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status.name,
+            "done": self.done,
+            "total": self.total,
+            "error": self.error,
+            "attempts": self.attempts,
+            "created_at": _isoformat(self.created_at),
+            "started_at": _isoformat(self.started_at),
+            "finished_at": _isoformat(self.finished_at),
+        }
+
+    def finish(self, error: str = None):
+        """ Marks the JobModel succeeded, or failed with the error, without committing """
+        self.status = JobStatus.FAILED if error else JobStatus.SUCCEEDED
+        self.error = error
+        self.finished_at = datetime.utcnow()
+
+    def add_output(self, data: str):
+        """ Appends a chunk of output after the current checkpoint, without committing """
+        db.session.add(JobOutputModel(job_id=self.job_id, seq=self.done, data=data))
+
+    def outputs(self, batch_size: int = 100):
+        """ Returns the chunks of output of the JobModel in order """
+        return JobOutputModel.query.filter_by(job_id=self.job_id).order_by(JobOutputModel.seq).yield_per(batch_size)
+
+    @classmethod
+    def find(cls, job_id: int):
+        """ Finds a JobModel by its job_id """
+        logger.info("Processing lookup for job_id %s ...", job_id)
+        return cls.query.get(job_id)
+
+    @classmethod
+    def claim(cls, worker: str, lease_seconds: float, max_attempts: int):
+        """
+        Takes the oldest queued JobModel, or a running one whose worker stopped
+        renewing its lease, for the worker
+
+        Returns:
+            JobModel: the claimed JobModel, or None when there is nothing to run
+        """
+        while True:
+            now = datetime.utcnow()
+            job = (
+                cls.query
+                .filter(or_(cls.status == JobStatus.QUEUED,
+                            and_(cls.status == JobStatus.RUNNING,
+                                 cls.heartbeat_at < now - timedelta(seconds=lease_seconds))))
+                .order_by(cls.job_id)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if job is None:
+                db.session.commit()
+                return None
+            job.attempts += 1
+            if job.attempts > max_attempts:
+                logger.warning("Giving up %s after %d attempts", job, max_attempts)
+                job.finish(error=f"Gave up after {max_attempts} attempts")
+                db.session.commit()
+                continue
+            job.status = JobStatus.RUNNING
+            job.worker = worker
+            job.started_at = job.started_at or now
+            job.heartbeat_at = now
+            db.session.commit()
+            return job
+
+
+class JobOutputModel(db.Model):
+    """
+    Class that represents a chunk of the output of a JobModel
+    """
+    __tablename__ = "job_output"
+
+    job_id = db.Column(db.Integer, db.ForeignKey("job.job_id", ondelete="CASCADE"), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+
+
+def _isoformat(moment):
+    """Formats an optional datetime"""
+    return moment.isoformat() if moment is not None else None
@@ -4,13 +4,24 @@ My Service
 Describe what your service does here
 """
 
-from flask import jsonify, request, abort
-from .utils import status  # HTTP Status Codes
+import base64
+import binascii
+import json
+from functools import lru_cache
+from urllib.parse import urlencode
+from flask import Response, jsonify, request, abort, stream_with_context
+from werkzeug.http import quote_etag
+from . import jobs
+from .utils import metrics, profiler, status  # HTTP Status Codes
+from .utils.pool import pool_stats
+from .utils.serializers import compile_model, dumps
+from .utils.streaming import ndjson_chunks
 
 # For this example we'll use SQLAlchemy, a popular ORM that supports a
 # variety of backends including SQLite, MySQL, and PostgreSQL
-from service.models import CustomerModel, AddressModel, Gender
-from flask_restx import Resource, reqparse, fields
+from service.models import (CustomerModel, AddressModel, Gender, DataValidationError, BulkCreateError, JobModel, JobStatus,
+                            customer_cache, customer_group_commit, db)
+from flask_restx import Resource, reqparse, fields, inputs
 
 # Import Flask application
 from . import app, api
@@ -23,6 +34,215 @@ def abort_when_customer_not_exist(customer_id):
     if customer is None:
         abort(status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found.")
 
+
+def encode_cursor(position):
+    """ Encodes the position of the last customer of a page into an opaque cursor """
+    payload = json.dumps({"after": position}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def valid_position(position, by_name=False):
+    """ Tells whether a decoded position is a customer_id, or a paginate_by_name() position when by_name """
+    if not by_name:
+        return isinstance(position, int)
+    return (isinstance(position, list) and len(position) == 3
+            and isinstance(position[0], str) and isinstance(position[1], str) and isinstance(position[2], int))
+
+
+def decode_cursor(cursor, by_name=False):
+    """ Decodes a cursor made by encode_cursor() back into a position """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded))["after"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError) as error:
+        raise DataValidationError("Invalid cursor: " + cursor) from error
+    if not valid_position(position, by_name):
+        raise DataValidationError("Invalid cursor: " + cursor)
+    return position
+
+
+def is_name_prefix_search(args):
+    """ Tells whether the list query string asks for a name prefix search """
+    return args["match"] == "prefix" and bool(args["firstname"] or args["lastname"])
+
+
+def customer_list_query(args):
+    """ Returns the Customer query selected by the list query string """
+    if args["nickname"]:
+        app.logger.info("Request for customer with nickname: %s", args["nickname"])
+        return CustomerModel.find_by_nickname(nickname=args["nickname"])
+    if args["email"]:
+        app.logger.info("Request for customer with email: %s", args["email"])
+        return CustomerModel.find_by_email(email=args["email"])
+    if args["birthday"]:
+        app.logger.info("Request for customer with birthday: %s", args["birthday"])
+        return CustomerModel.find_by_birthday(args["birthday"])
+    if args["birthday_window"]:
+        app.logger.info("Request for customer with birthday window: %s", args["birthday_window"])
+        return CustomerModel.find_by_birthday_window(*args["birthday_window"])
+    if args["birthday_month"]:
+        app.logger.info("Request for customer with birthday month: %s day: %s", args["birthday_month"],
+                        args["birthday_day"])
+        return CustomerModel.find_by_birthday_month_day(args["birthday_month"], args["birthday_day"])
+    if args["birthday_day"]:
+        raise DataValidationError("Invalid query: birthday_day needs birthday_month")
+    if is_name_prefix_search(args):
+        app.logger.info("Request for customer with name prefix: %s %s", args["firstname"], args["lastname"])
+        return CustomerModel.find_by_name_prefix(args["firstname"], args["lastname"])
+    if args["firstname"] and args["lastname"]:
+        app.logger.info("Request for customer with name: %s %s", args["firstname"], args["lastname"])
+        return CustomerModel.find_by_name(args["firstname"], args["lastname"])
+    app.logger.info("Request for customer list")
+    return CustomerModel.query
+
+
+def read_bulk_payload():
+    """ Reads a JSON array or a newline delimited JSON body into a list of items """
+    if request.mimetype == "application/x-ndjson":
+        items = []
+        for line in request.get_data().splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as error:
+                items.append(DataValidationError("Invalid JSON: " + str(error)))
+        return items
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise DataValidationError("Invalid request: body must be a JSON array or newline delimited JSON")
+    return items
+
+
+def deserialize_bulk(items):
+    """ Deserializes bulk items into Customers, collecting the errors by position """
+    customers = {}
+    errors = {}
+    for index, item in enumerate(items):
+        try:
+            if isinstance(item, Exception):
+                raise item
+            customers[index] = CustomerModel().deserialize(item)
+        except DataValidationError as error:
+            errors[index] = str(error)
+    return customers, errors
+
+
+def bulk_results(count, customers, errors, rolled_back):
+    """ Returns the outcome of every bulk item: its id, its own error, or that its batch was rolled back """
+    results = []
+    for index in range(count):
+        if index in errors:
+            results.append({"index": index, "error": errors[index]})
+        elif rolled_back:
+            results.append({"index": index, "error": "not created: batch rolled back"})
+        else:
+            results.append({"index": index, "customer_id": customers[index].customer_id})
+    return results
+
+
+def read_bulk_selection():
+    """ Reads the selectors of a bulk status change from the JSON body """
+    selection = CustomerModel.deserialize_selection(request.get_json(silent=True))
+    if selection["customer_ids"] is not None and len(selection["customer_ids"]) > app.config["BULK_MAX_ITEMS"]:
+        abort(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+              f"At most {app.config['BULK_MAX_ITEMS']} customer_ids can be given in one request.")
+    return selection
+
+
+def bulk_set_active(is_active):
+    """ Changes the status of the selected Customers, answering with a count or a stream of their ids """
+    changed = CustomerModel.set_active_many(is_active, **read_bulk_selection())
+    app.logger.info("Set is_active=%s on %d customers", is_active, len(changed))
+    if request.accept_mimetypes.best == "application/x-ndjson":
+        body = ndjson_chunks({"customer_id": customer_id} for customer_id in changed)
+        return Response(body, mimetype="application/x-ndjson")
+    return {"updated": len(changed)}, status.HTTP_200_OK
+
+
+def etag_header(tag):
+    """ Returns the headers carrying a strong ETag """
+    return {"ETag": quote_etag(tag)}
+
+
+def etag_version(tag):
+    """ Returns the id and version an ETag names, whatever the fields of a projection, or None """
+    parts = tag.split("-")
+    if len(parts) < 2 or not (parts[0].isdigit() and parts[1].isdigit()):
+        return None
+    return int(parts[0]), int(parts[1])
+
+
+def check_if_match(tag):
+    """ Aborts with 412 when the request has an If-Match header naming neither tag nor a projection of it """
+    if request.if_match and not request.if_match.star_tag and \
+            etag_version(tag) not in {etag_version(other) for other in request.if_match}:
+        abort(status.HTTP_412_PRECONDITION_FAILED,
+              f"The resource has changed, its current ETag is {quote_etag(tag)}.")
+
+
+def if_match_versions(resource_id):
+    """ Returns the versions accepted by the If-Match header for ETags of resource_id, None for any version """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = []
+    for tag in request.if_match:
+        named = etag_version(tag)
+        if named is not None and named[0] == resource_id:
+            versions.append(named[1])
+    return versions
+
+
+def find_address_or_404(customer_id, address_id):
+    """ Returns an Address of a Customer, or aborts with 404 naming whichever is missing """
+    customer_exists, address = AddressModel.find_for_customer(customer_id, address_id)
+    if not customer_exists:
+        abort(status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found.")
+    if address is None:
+        abort(status.HTTP_404_NOT_FOUND, "Address with id '{}' was not found.".format(address_id))
+    return address
+
+
+def customer_page(args, include_addresses):
+    """ Returns one page of the Customers selected by the list query string
+
+    Name prefix searches are paged in name order so that each page is a short
+    walk of the name index, and q searches by rank, with the number of matches
+    already returned as their position; every other list is paged in
+    customer_id order.
+    Without their addresses the Customers come back as row tuples, and only
+    the columns named by fields are read.
+    """
+    if args["q"]:
+        offset = decode_cursor(args["cursor"]) or 0
+        if offset < 0:
+            raise DataValidationError("Invalid cursor: " + args["cursor"])
+        customers, has_more = CustomerModel.paginate_search(args["q"], args["limit"], offset=offset,
+                                                            with_addresses=include_addresses,
+                                                            rows=not include_addresses, fields=args["fields"])
+        return customers, offset + len(customers) if has_more else None
+    query = customer_list_query(args)
+    if is_name_prefix_search(args):
+        after = decode_cursor(args["cursor"], by_name=True)
+        return CustomerModel.paginate_by_name(args["limit"], after=after, query=query,
+                                              with_addresses=include_addresses,
+                                              rows=not include_addresses, fields=args["fields"])
+    after_id = decode_cursor(args["cursor"])
+    customers, has_more = CustomerModel.paginate(args["limit"], after_id=after_id, query=query,
+                                                 with_addresses=include_addresses, rows=not include_addresses,
+                                                 fields=args["fields"])
+    return customers, customers[-1].customer_id if has_more else None
+
+
+def next_page_link(position, limit):
+    """ Builds a Link header pointing to the page after position """
+    args = request.args.to_dict()
+    args["cursor"] = encode_cursor(position)
+    args["limit"] = limit
+    return f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+
 ############################################################
 # Health Endpoint
 ############################################################
@@ -33,6 +253,20 @@ def health():
     """ Health Status """
     return jsonify(dict(status="OK")), status.HTTP_200_OK
 
+
+@app.route("/stats")
+def stats():
+    """ Runtime statistics of the service caches, group commit and database connection pool """
+    return jsonify(dict(customer_cache=customer_cache.stats(), customer_group_commit=customer_group_commit.stats(),
+                        db_pool=pool_stats(db.engine.pool))), status.HTTP_200_OK
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """ Request and database metrics in the Prometheus text format """
+    body, content_type = metrics.render()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
 ######################################################################
 # GET INDEX
 # Configure the Root route before OpenAPI
@@ -94,8 +328,150 @@ address_model = api.inherit(
     }
 )
 
+customer_addresses_model = api.inherit(
+    'CustomerWithAddresses',
+    customer_model,
+    {
+        'addresses': fields.List(fields.Nested(address_model),
+                                 description='The addresses of the Customer, only with include=addresses'),
+    }
+)
+
+
+@lru_cache(maxsize=256)
+def customer_serializer(fields=None, include_addresses=False):
+    """ Returns the compiled serializer of a Customer, limited to the fields when given
+
+    Compiled once per set of fields, these give the same dictionaries as
+    marshalling serialize() with the models, less the fields not asked for.
+    """
+    model = customer_addresses_model if include_addresses else customer_model
+    if fields is not None:
+        model = {key: field for key, field in model.resolved.items() if key in fields}
+    return compile_model(model, skip_none=True)
+
+
+serialize_customer = customer_serializer()
+serialize_customer_with_addresses = customer_serializer(include_addresses=True)
+
+
+def month_day_range(value):
+    """ The query string type of a window of days of the year, MM-DD/MM-DD """
+    try:
+        start, end = (tuple(int(part) for part in bound.split("-")) for bound in value.split("/"))
+        CustomerModel.month_day(*start)
+        CustomerModel.month_day(*end)
+    except (DataValidationError, TypeError, ValueError) as error:
+        raise ValueError(f"Invalid birthday window: {value}") from error
+    return start, end
+
+
+month_day_range.__schema__ = {"type": "string", "pattern": "^[0-9]{2}-[0-9]{2}/[0-9]{2}-[0-9]{2}$"}
+
+
+def field_list(model):
+    """ Returns the query string type of a comma separated list of the fields of model """
+    choices = model.resolved
+
+    def parse(value):
+        names = tuple(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+        unknown = [name for name in names if name not in choices]
+        if not names or unknown:
+            raise ValueError(f"Invalid fields: {', '.join(unknown) or value!r}, choose from {', '.join(choices)}")
+        return names
+    parse.__schema__ = {"type": "string"}
+    return parse
+
+
+bulk_result_model = api.model('BulkResult', {
+    'index': fields.Integer(description='The position of the Customer in the request body'),
+    'customer_id': fields.Integer(description='The id of the created Customer'),
+    'error': fields.String(description='Why the Customer was not created'),
+})
+
+bulk_model = api.model('BulkCreated', {
+    'created': fields.Integer(description='The number of Customers created'),
+    'failed': fields.Integer(description='The number of Customers not created'),
+    'results': fields.List(fields.Nested(bulk_result_model, skip_none=True),
+                           description='The outcome of every Customer, in order'),
+})
+
+bulk_selection_model = api.model('BulkSelection', {
+    'customer_ids': fields.List(fields.Integer, description='Only the Customers with these ids'),
+    'email_domain': fields.String(description='Only the Customers with an email at this domain, ignoring case'),
+    'birthday_from': fields.Date(description='Only the Customers born on or after this day'),
+    'birthday_to': fields.Date(description='Only the Customers born on or before this day'),
+})
+
+bulk_status_model = api.model('BulkStatusChanged', {
+    'updated': fields.Integer(description='The number of Customers whose status changed'),
+})
+
+create_job_model = api.model('Job', {
+    'kind': fields.String(required=True, enum=['activate', 'deactivate', 'import', 'export'],
+                          description='What the Job does'),
+    'params': fields.Raw(required=True, description='The selectors, Customers or include of the Job'),
+})
+
+job_model = api.model('JobStatus', {
+    'job_id': fields.Integer(readOnly=True, description='The unique id assigned internally by service'),
+    'kind': fields.String(description='What the Job does'),
+    'status': fields.String(enum=[job_status.name for job_status in JobStatus], description='Where the Job is at'),
+    'done': fields.Integer(description='The number of items processed so far'),
+    'total': fields.Integer(description='The number of items to process, once the Job has started'),
+    'error': fields.String(description='Why the Job failed'),
+    'attempts': fields.Integer(description='How many times a worker took the Job'),
+    'created_at': fields.DateTime(dt_format='iso8601'),
+    'started_at': fields.DateTime(dt_format='iso8601'),
+    'finished_at': fields.DateTime(dt_format='iso8601'),
+})
+
 # query string arguments
-customer_args = reqparse.RequestParser()
+bulk_args = reqparse.RequestParser()
+bulk_args.add_argument('mode', type=str, location='args', required=False, default='atomic',
+                       choices=['atomic', 'best-effort'],
+                       help='atomic creates all the Customers or none, best-effort skips the bad ones')
+
+include_args = reqparse.RequestParser()
+include_args.add_argument('include', type=str, location='args', required=False, choices=['addresses'],
+                          help='Embed the addresses of every Customer')
+
+fields_args = reqparse.RequestParser()
+fields_args.add_argument('fields', type=field_list(customer_model), location='args', required=False,
+                         help='Comma separated fields of the Customer to return, all of them by default; '
+                              'only their columns are read')
+
+customer_args = include_args.copy()
+customer_args.add_argument('fields', type=field_list(customer_addresses_model), location='args', required=False,
+                           help='Comma separated fields of the Customers to return, all of them by default; '
+                                'only their columns are read, and addresses implies include=addresses')
+customer_args.add_argument('q', type=str, location='args', required=False,
+                           help='Search Customers by partial or misspelt names, nickname or email, best match first')
+customer_args.add_argument('nickname', type=str, location='args', required=False,
+                           help='List Customers by nickname')
+customer_args.add_argument('email', type=str, location='args', required=False,
+                           help='List Customers by email')
+customer_args.add_argument('birthday', type=str, location='args', required=False,
+                           help='List Customers by birthday')
+customer_args.add_argument('birthday_month', type=inputs.int_range(1, 12), location='args', required=False,
+                           help='List Customers born in this month of any year')
+customer_args.add_argument('birthday_day', type=inputs.int_range(1, 31), location='args', required=False,
+                           help='List Customers born on this day of birthday_month of any year')
+customer_args.add_argument('birthday_window', type=month_day_range, location='args', required=False,
+                           help='List Customers whose birthday falls in MM-DD/MM-DD, both included; '
+                                'wraps past December 31st when the end comes first')
+customer_args.add_argument('firstname', type=str, location='args', required=False,
+                           help='List Customers by first name (needs lastname unless match=prefix)')
+customer_args.add_argument('lastname', type=str, location='args', required=False,
+                           help='List Customers by last name (needs firstname unless match=prefix)')
+customer_args.add_argument('match', type=str, location='args', required=False, default='exact',
+                           choices=['exact', 'prefix'],
+                           help='prefix matches names starting with firstname/lastname, ignoring case')
+customer_args.add_argument('limit', type=inputs.int_range(1, app.config["MAX_PAGE_SIZE"]), location='args',
+                           required=False, default=app.config["DEFAULT_PAGE_SIZE"],
+                           help='The maximum number of Customers in a page')
+customer_args.add_argument('cursor', type=str, location='args', required=False,
+                           help='The opaque cursor from the Link header of the previous page')
 
 
 ######################################################################
@@ -116,18 +492,27 @@ class CustomerResource(Resource):
     # RETRIEVE A CUSTOMER
     # ------------------------------------------------------------------
     @api.doc('get_customers')
+    @api.expect(fields_args, validate=True)
     @api.response(404, 'Customer not found')
-    @api.marshal_with(customer_model)
+    @api.response(200, 'Success', customer_model)
     def get(self, customer_id):
         """
         Retrieve a single Customer
         This endpoint will return a Customer based on his/her id
         """
         app.logger.info("Request to Retrieve a customer with id [%s]", customer_id)
-        customer = CustomerModel.find(customer_id)
+        fields = fields_args.parse_args()["fields"]
+        if request.if_none_match:
+            version = CustomerModel.find_version(customer_id)
+            tag = CustomerModel.make_etag(customer_id, version, fields)
+            if version is not None and request.if_none_match.contains(tag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=etag_header(tag))
+        customer = CustomerModel.find_serialized(customer_id, fields=fields)
         if not customer:
             abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
-        return customer.serialize(), status.HTTP_200_OK
+        body = dumps(customer_serializer(fields)(customer))
+        return Response(body, status=status.HTTP_200_OK, mimetype="application/json",
+                        headers=etag_header(CustomerModel.make_etag(customer_id, customer["version"], fields)))
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING CUSTOMER
@@ -146,12 +531,13 @@ class CustomerResource(Resource):
         customer = CustomerModel.find(customer_id)
         if not customer:
             abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
+        check_if_match(customer.etag())
         app.logger.debug('Payload = %s', api.payload)
         data = api.payload
         customer.deserialize(data)
         customer.customer_id = customer_id
         customer.update()
-        return customer.serialize(), status.HTTP_200_OK
+        return customer.serialize(include_addresses=False), status.HTTP_200_OK, etag_header(customer.etag())
 
     # ------------------------------------------------------------------
     # DELETE A CUSTOMER
@@ -198,79 +584,161 @@ class CustomerCollection(Resource):
         customer.create()
         app.logger.info('Customer with new id [%s] created!', customer.customer_id)
         location_url = api.url_for(CustomerResource, customer_id=customer.customer_id, _external=True)
-        return customer.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
+        headers = {'Location': location_url, **etag_header(customer.etag())}
+        return customer.serialize(include_addresses=False), status.HTTP_201_CREATED, headers
 
     # ------------------------------------------------------------------
     # LIST ALL CUSTOMERS
     # ------------------------------------------------------------------
     @api.doc('list_customers')
     @api.expect(customer_args, validate=True)
-    @api.marshal_list_with(customer_model)
+    @api.response(200, 'Success', [customer_addresses_model])
     def get(self):
+        """
+        Returns a page of Customers
+        Customers are ordered by customer_id, by name for match=prefix, or best
+        match first for q, and paged with the limit and cursor query parameters. A Link header with
+        rel="next" points to the next page.
+        """
+        args = customer_args.parse_args()
+        fields = args["fields"]
+        include_addresses = args["include"] == "addresses" or "addresses" in (fields or ())
+        if fields is not None and include_addresses and "addresses" not in fields:
+            fields += ("addresses",)
+
+        with profiler.timed("serialize"):
+            customers, next_position = customer_page(args, include_addresses)
+        with profiler.timed("marshal"):
+            serialize = customer_serializer(fields, include_addresses)
+            body = dumps([serialize(customer) for customer in customers])
+        app.logger.info("Returning %d customers", len(customers))
+        headers = {}
+        if next_position is not None:
+            headers["Link"] = next_page_link(next_position, args["limit"])
+        return Response(body, status=status.HTTP_200_OK, mimetype="application/json", headers=headers)
+
+
+######################################################################
+#  PATH: /customers/bulk
+######################################################################
+@api.route(f'{BASE_URL}/bulk')
+class CustomerBulk(Resource):
+    """
+    CustomerBulk class
 
-        def list_all_customers():
-            """Returns all of the Customers"""
-            app.logger.info("Request for customer list")
-            customers = []
-            customers = CustomerModel.all()
-
-            results = [customer.serialize() for customer in customers]
-            app.logger.info("Returning %d customers", len(results))
-            return results, status.HTTP_200_OK
-
-        def list_all_customers_by_nickname(nickname):
-            """
-            Retrieve a Customer list by nickname
-            """
-            app.logger.info("Request for customer with nickname: %s", nickname)
-            customers = CustomerModel.find_by_nickname(nickname=nickname)
-            results = [customer.serialize() for customer in customers]
-            return results, status.HTTP_200_OK
-
-        def list_all_customers_by_email(email):
-            """
-            Retrieve a Customer list by email
-            """
-            app.logger.info("Request for customer with email: %s", email)
-            customers = CustomerModel.find_by_email(email=email)
-            results = [customer.serialize() for customer in customers]
-            return results, status.HTTP_200_OK
-
-        def list_all_customers_by_name(firstname, lastname):
-            """
-            Retrieve a Customer list by name
-            """
-            app.logger.info("Request for customer with name: %s %s", firstname, lastname)
-            customers = CustomerModel.find_by_name(firstname, lastname)
-            results = [customer.serialize() for customer in customers]
-            return results, status.HTTP_200_OK
-
-        def list_all_customers_by_birthday(birthday):
-            """
-            Retrieve a Customer list by birthday
-            """
-            app.logger.info("Request for customer with birthday: %s %s", birthday)
-            customers = CustomerModel.find_by_birthday(birthday)
-            results = [customer.serialize() for customer in customers]
-            return results, status.HTTP_200_OK
-
-        args = request.args
-        nickname = args.get("nickname")
-        email = args.get("email")
-        firstname = args.get('firstname')
-        lastname = args.get('lastname')
-        birthday = args.get('birthday')
-
-        if args.get('nickname'):
-            return list_all_customers_by_nickname(nickname=nickname)
-        elif args.get('email'):
-            return list_all_customers_by_email(email=email)
-        elif args.get('birthday'):
-            return list_all_customers_by_birthday(birthday=birthday)
-        elif firstname and lastname:
-            return list_all_customers_by_name(firstname, lastname)
+    Creates many Customers in one request
+    POST /customers/bulk - Creates the Customers of a JSON array or NDJSON body
+    """
+    @api.doc('create_customers_in_bulk')
+    @api.expect(bulk_args, [create_model], validate=False)
+    @api.response(400, 'Some of the posted data was not valid, nothing was created')
+    @api.response(207, 'Some of the Customers were created', bulk_model)
+    @api.response(413, 'Too many Customers in one request')
+    @api.marshal_with(bulk_model, code=201, skip_none=True)
+    def post(self):
+        """
+        Creates many Customers
+        This endpoint accepts a JSON array or newline delimited JSON of Customers and inserts
+        them in batches. In atomic mode nothing is created unless every Customer is valid.
+        """
+        atomic = bulk_args.parse_args()["mode"] == "atomic"
+        items = read_bulk_payload()
+        app.logger.info("Request to create %d customers in bulk", len(items))
+        if len(items) > app.config["BULK_MAX_ITEMS"]:
+            abort(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                  f"At most {app.config['BULK_MAX_ITEMS']} Customers can be created in one request.")
+
+        customers, errors = deserialize_bulk(items)
+        if not (atomic and errors):
+            positions = list(customers)
+            try:
+                failed = CustomerModel.create_many([customers[index] for index in positions],
+                                                   chunk_size=app.config["BULK_CHUNK_SIZE"], atomic=atomic)
+            except BulkCreateError as error:
+                failed = error.errors
+            errors.update({positions[offset]: error for offset, error in failed.items()})
+
+        rolled_back = atomic and bool(errors)
+        results = bulk_results(len(items), customers, errors, rolled_back)
+        created = sum("customer_id" in result for result in results)
+        app.logger.info("Created %d customers in bulk, %d failed", created, len(items) - created)
+        if not errors:
+            code = status.HTTP_201_CREATED
+        elif rolled_back:
+            code = status.HTTP_400_BAD_REQUEST
         else:
-            return list_all_customers()
+            code = status.HTTP_207_MULTI_STATUS
+        return {"created": created, "failed": len(items) - created, "results": results}, code
+
+
+######################################################################
+#  PATH: /customers/bulk/activate
+######################################################################
+@api.route(f"{BASE_URL}/bulk/activate", methods=["PUT"])
+class BulkActivateResource(Resource):
+    """ Activates many Customers with one UPDATE """
+    @api.doc('activate_customers_in_bulk')
+    @api.expect(bulk_selection_model, validate=False)
+    @api.produces(['application/json', 'application/x-ndjson'])
+    @api.response(200, 'The status of the Customers was changed', bulk_status_model)
+    @api.response(400, 'The selection was not valid')
+    @api.response(413, 'Too many customer_ids in one request')
+    def put(self):
+        """
+        Activate many Customers
+        This endpoint activates the Customers matching all of the given selectors. It answers
+        with their count, or streams their ids when the client accepts application/x-ndjson
+        """
+        return bulk_set_active(True)
+
+
+######################################################################
+#  PATH: /customers/bulk/deactivate
+######################################################################
+@api.route(f"{BASE_URL}/bulk/deactivate", methods=["PUT"])
+class BulkDeactivateResource(Resource):
+    """ Deactivates many Customers with one UPDATE """
+    @api.doc('deactivate_customers_in_bulk')
+    @api.expect(bulk_selection_model, validate=False)
+    @api.produces(['application/json', 'application/x-ndjson'])
+    @api.response(200, 'The status of the Customers was changed', bulk_status_model)
+    @api.response(400, 'The selection was not valid')
+    @api.response(413, 'Too many customer_ids in one request')
+    def put(self):
+        """
+        Deactivate many Customers
+        This endpoint deactivates the Customers matching all of the given selectors. It answers
+        with their count, or streams their ids when the client accepts application/x-ndjson
+        """
+        return bulk_set_active(False)
+
+
+######################################################################
+#  PATH: /customers/export
+######################################################################
+@api.route(f'{BASE_URL}/export')
+class CustomerExport(Resource):
+    """
+    CustomerExport class
+
+    Streams the whole Customer table
+    GET /customers/export - Returns every Customer as newline delimited JSON
+    """
+    @api.doc('export_customers')
+    @api.expect(include_args, validate=True)
+    @api.produces(['application/x-ndjson'])
+    def get(self):
+        """
+        Export all of the Customers
+        This endpoint streams one Customer per line, compressed when the client accepts it
+        """
+        app.logger.info("Request to export all customers")
+        include_addresses = include_args.parse_args()["include"] == "addresses"
+        customers = CustomerModel.stream_all(batch_size=app.config["EXPORT_BATCH_SIZE"],
+                                             with_addresses=include_addresses)
+        serialize = serialize_customer_with_addresses if include_addresses else serialize_customer
+        body = ndjson_chunks(serialize(customer) for customer in customers)
+        return Response(stream_with_context(body), mimetype="application/x-ndjson")
 
 
 ######################################################################
@@ -301,15 +769,12 @@ class AddressResource(Resource):
         This endpoint will create an Address based the data in the body that is posted
         """
         app.logger.info("Get an Address of a Customer ")
-        abort_when_customer_not_exist(customer_id=customer_id)
-        found = AddressModel.find_by_customer_and_address_id(customer_id=customer_id, address_id=address_id)
-
-        if found.count() == 0:
-            abort(status.HTTP_404_NOT_FOUND, "Address with id '{}' was not found.".format(address_id))
-        address = found[0]
+        address = find_address_or_404(customer_id, address_id)
+        if request.if_none_match.contains(address.etag()):
+            return None, status.HTTP_304_NOT_MODIFIED, etag_header(address.etag())
 
         app.logger.info("Address [%s] with customer id [%s]] retrieve complete.", address_id, customer_id)
-        return address.serialize(), status.HTTP_200_OK
+        return address.serialize(), status.HTTP_200_OK, etag_header(address.etag())
 
     # ------------------------------------------------------------------
     # DELETE AN ADDRESS OF A CUSTOMER
@@ -322,13 +787,10 @@ class AddressResource(Resource):
         This endpoint will delete an Address based on the data in the body that is posted
         """
         app.logger.info("Delete an Address of a Customer")
-        abort_when_customer_not_exist(customer_id=customer_id)
-        found = AddressModel.find_by_customer_and_address_id(customer_id=customer_id, address_id=address_id)
-
-        if found.count() == 1:
-            address = found[0]
-            address.delete()
+        if AddressModel.delete_for_customer(customer_id, address_id):
             app.logger.info("Address [%s] with customer id [%s]] delete complete.", address_id, customer_id)
+        else:
+            abort_when_customer_not_exist(customer_id=customer_id)
         return "", status.HTTP_204_NO_CONTENT
 
     # ------------------------------------------------------------------
@@ -347,25 +809,18 @@ class AddressResource(Resource):
         """
         app.logger.info("Update an Address of a Customer")
         # check_content_type("application/json")
-        abort_when_customer_not_exist(customer_id=customer_id)
-        address = AddressModel()
-        address.deserialize(request.get_json())
-        address.update()
-
-        found = AddressModel.find_by_customer_and_address_id(customer_id, address_id)
-
-        if found.count() == 0:
-            abort(status.HTTP_404_NOT_FOUND, "Address with id '{}' was not found.".format(address_id))
-
         app.logger.debug('Payload = %s', api.payload)
-        data = api.payload
-        address = found[0]
-        address.deserialize(data)
-        address.address_id = address_id
-        address.update()
+        data = AddressModel().deserialize(api.payload)
+        address = AddressModel.update_for_customer(customer_id, address_id, data.address,
+                                                   versions=if_match_versions(address_id))
+        if address is None:
+            # nothing matched: the Customer or the Address is missing, or If-Match names an older version
+            current = find_address_or_404(customer_id, address_id)
+            abort(status.HTTP_412_PRECONDITION_FAILED,
+                  f"The resource has changed, its current ETag is {quote_etag(current.etag())}.")
 
         app.logger.info("Address with ID [%s] updated.", address.address_id)
-        return address.serialize(), status.HTTP_200_OK
+        return address.serialize(), status.HTTP_200_OK, etag_header(address.etag())
 
 
 @api.route(f'{BASE_URL}/<int:customer_id>/addresses', strict_slashes=False)
@@ -398,7 +853,7 @@ class AddressCollection(Resource):
         app.logger.info("Address with address_id [%s] is created!", address.address_id)
         location_url = api.url_for(AddressResource, customer_id=customer_id, address_id=address.address_id, _external=True)
 
-        return address.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+        return address.serialize(), status.HTTP_201_CREATED, {"Location": location_url, **etag_header(address.etag())}
 
     # ------------------------------------------------------------------
     # LIST ALL ADDRESSES
@@ -412,12 +867,15 @@ class AddressCollection(Resource):
         """
         app.logger.info("Request for addresses with customer id: %s", customer_id)
         abort_when_customer_not_exist(customer_id=customer_id)
-        addresses = AddressModel.find_by_customer_id(customer_id=customer_id)
+        addresses = AddressModel.find_by_customer_id(customer_id=customer_id).all()
+        tag = AddressModel.collection_etag(addresses)
+        if request.if_none_match.contains(tag):
+            return None, status.HTTP_304_NOT_MODIFIED, etag_header(tag)
 
         app.logger.info("Addresses under customer ID [%s] returned.", customer_id)
         results = [address.serialize() for address in addresses]
 
-        return results, status.HTTP_200_OK
+        return results, status.HTTP_200_OK, etag_header(tag)
 
 
 ######################################################################
@@ -470,6 +928,79 @@ class DeactivateResource(Resource):
         return customer.serialize(), status.HTTP_200_OK
 
 
+######################################################################
+#  PATH: /jobs
+######################################################################
+@api.route('/jobs', strict_slashes=False)
+class JobCollection(Resource):
+    """ Queues background Jobs """
+    @api.doc('create_job')
+    @api.expect(create_job_model)
+    @api.response(400, 'The posted Job was not valid')
+    @api.marshal_with(job_model, code=202)
+    def post(self):
+        """
+        Queue a Job
+        This endpoint queues a long running bulk operation for `flask run-worker` and answers
+        at once with the Job to poll
+        """
+        data = api.payload
+        if not isinstance(data, dict):
+            raise DataValidationError("Invalid job: body must be a JSON object")
+        job = jobs.submit(data.get("kind"), data.get("params"))
+        app.logger.info("Job [%s] queued", job.job_id)
+        location_url = api.url_for(JobResource, job_id=job.job_id, _external=True)
+        return job.serialize(), status.HTTP_202_ACCEPTED, {"Location": location_url}
+
+
+######################################################################
+#  PATH: /jobs/{job_id}
+######################################################################
+@api.route('/jobs/<int:job_id>')
+@api.param('job_id', 'The job identifier')
+class JobResource(Resource):
+    """ The status and progress of a Job """
+    @api.doc('get_job')
+    @api.response(404, 'Job not found')
+    @api.marshal_with(job_model)
+    def get(self, job_id):
+        """
+        Retrieve a Job
+        This endpoint returns the status and progress of a Job
+        """
+        job = JobModel.find(job_id)
+        if job is None:
+            abort(status.HTTP_404_NOT_FOUND, f"Job with id '{job_id}' was not found.")
+        return job.serialize(), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /jobs/{job_id}/result
+######################################################################
+@api.route('/jobs/<int:job_id>/result')
+@api.param('job_id', 'The job identifier')
+class JobResultResource(Resource):
+    """ The result of a finished Job """
+    @api.doc('get_job_result')
+    @api.produces(['application/json', 'application/x-ndjson'])
+    @api.response(404, 'Job not found')
+    @api.response(409, 'Job not finished')
+    def get(self, job_id):
+        """
+        Retrieve the result of a Job
+        This endpoint returns the counts and errors of a Job, or streams the Customers of an export
+        """
+        job = JobModel.find(job_id)
+        if job is None:
+            abort(status.HTTP_404_NOT_FOUND, f"Job with id '{job_id}' was not found.")
+        if job.status != JobStatus.SUCCEEDED:
+            abort(status.HTTP_409_CONFLICT, f"Job with id '{job_id}' is {job.status.name}, not SUCCEEDED.")
+        if job.kind != "export":
+            return job.result, status.HTTP_200_OK
+        body = (output.data.encode("utf-8") for output in job.outputs())
+        return Response(stream_with_context(body), mimetype="application/x-ndjson")
+
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
@@ -478,3 +1009,19 @@ def init_db():
     global app
     CustomerModel.init_db(app)
     AddressModel.init_db(app)
+
+
+def create_schema():
+    """ Creates the tables and indexes missing from the database """
+    db.create_all()
+
+
+def dispose_pool(close=True):
+    """
+    Empties the connection pool of the process
+
+    A worker forked from a preloaded app passes close=False, which forgets
+    the connections it inherited without closing them under its parent.
+    """
+    with app.app_context():
+        db.engine.dispose(close=close)
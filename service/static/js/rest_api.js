@@ -35,6 +35,50 @@ $(function () {
         $("#customer_is_active").val("");
     }
 
+    // Renders a list of Customers into the search results table
+    // and returns the first one
+    function render_search_results_table(res) {
+        $("#search_results").empty();
+        let table = '<table class="table table-striped" cellpadding="10">'
+        table += '<thead><tr>'
+        table += '<th class="col-md-1">ID</th>'
+        table += '<th class="col-md-2">First Name</th>'
+        table += '<th class="col-md-2">Last Name</th>'
+        table += '<th class="col-md-2">Nickname</th>'
+        table += '<th class="col-md-3">Password</th>'
+        table += '<th class="col-md-1">Gender</th>'
+        table += '<th class="col-md-2">Email</th>'
+        table += '<th class="col-md-2">Birthday</th>'
+        table += '<th class="col-md-2">IS Active</th>'
+        table += '</tr></thead><tbody>'
+        let firstCustomer = "";
+        for(let i = 0; i < res.length; i++) {
+            let customer = res[i];
+            table +=  `<tr id="row_${i}"><td>${customer.customer_id}</td><td>${customer.first_name}</td><td>${customer.last_name}</td><td>${customer.nickname}</td>
+                <td>${customer.password}</td><td>${customer.gender}</td><td>${customer.email}</td><td>${customer.birthday}</td><td>${customer.is_active}</td></tr>`;
+            if (i == 0) {
+                firstCustomer = customer;
+            }
+        }
+        table += '</tbody></table>';
+        $("#search_results").append(table);
+        return firstCustomer;
+    }
+
+    // Lists the Customers of every page, following the Link header of each
+    function list_all_pages(url, customers) {
+        return $.ajax({
+            type: "GET",
+            url: url,
+            contentType: "application/json",
+            data: ''
+        }).then(function(res, textStatus, xhr) {
+            customers = customers.concat(res)
+            let next = /<([^>]*)>;\s*rel="next"/.exec(xhr.getResponseHeader("Link") || "")
+            return next ? list_all_pages(next[1], customers) : customers
+        })
+    }
+
     // Updates the flash message area
     function flash_message(message) {
         $("#flash_message").empty();
@@ -205,6 +249,8 @@ $(function () {
 
     $("#search-btn").click(function () {
 
+        cancel_typeahead();
+
         let first_name = $("#customer_first_name").val();
         let last_name = $("#customer_last_name").val();
         let nickname = $("#customer_nickname").val();
@@ -221,6 +267,9 @@ $(function () {
                 queryString += 'firstname=' + first_name
                 queryString += '&lastname=' + last_name
             }
+        } else if (first_name || last_name) {
+            // a partial name is searched for instead of listing everybody
+            queryString += 'q=' + encodeURIComponent((first_name + ' ' + last_name).trim())
         }
         if (nickname) {
             if (queryString.length > 0) {
@@ -246,39 +295,11 @@ $(function () {
 
         $("#flash_message").empty();
         
-        let ajax = $.ajax({
-            type: "GET",
-            url: `${BASE_URL}?${queryString}`,
-            contentType: "application/json",
-            data: ''
-        })
-        
+        let ajax = list_all_pages(`${BASE_URL}?${queryString}`, [])
+
         ajax.done(function(res){
             //alert(res.toSource())
-            $("#search_results").empty();
-            let table = '<table class="table table-striped" cellpadding="10">'
-            table += '<thead><tr>'
-            table += '<th class="col-md-1">ID</th>'
-            table += '<th class="col-md-2">First Name</th>'
-            table += '<th class="col-md-2">Last Name</th>'
-            table += '<th class="col-md-2">Nickname</th>'
-            table += '<th class="col-md-3">Password</th>'
-            table += '<th class="col-md-1">Gender</th>'
-            table += '<th class="col-md-2">Email</th>'
-            table += '<th class="col-md-2">Birthday</th>'
-            table += '<th class="col-md-2">IS Active</th>'
-            table += '</tr></thead><tbody>'
-            let firstCustomer = "";
-            for(let i = 0; i < res.length; i++) {
-                let customer = res[i];
-                table +=  `<tr id="row_${i}"><td>${customer.customer_id}</td><td>${customer.first_name}</td><td>${customer.last_name}</td><td>${customer.nickname}</td>
-                    <td>${customer.password}</td><td>${customer.gender}</td><td>${customer.email}</td><td>${customer.birthday}</td><td>${customer.is_active}</td></tr>`;
-                if (i == 0) {
-                    firstCustomer = customer;
-                }
-            }
-            table += '</tbody></table>';
-            $("#search_results").append(table);
+            let firstCustomer = render_search_results_table(res)
 
             // copy the first result to the form
             if (firstCustomer != "") {
@@ -293,6 +314,45 @@ $(function () {
 
     });
 
+    // ****************************************
+    // Type-ahead search by name prefix
+    // ****************************************
+
+    let typeahead_timer = null;
+    let typeahead_ajax = null;
+
+    // Drops a pending type-ahead so it cannot overwrite newer results
+    function cancel_typeahead() {
+        clearTimeout(typeahead_timer);
+        if (typeahead_ajax) {
+            typeahead_ajax.abort();
+            typeahead_ajax = null;
+        }
+    }
+
+    $("#customer_first_name, #customer_last_name").on("input", function () {
+        cancel_typeahead();
+        typeahead_timer = setTimeout(function () {
+            let first_name = $("#customer_first_name").val();
+            let last_name = $("#customer_last_name").val();
+            if (first_name.length + last_name.length < 2) {
+                return;
+            }
+            let params = $.param({firstname: first_name, lastname: last_name, match: "prefix", limit: 10});
+
+            typeahead_ajax = $.ajax({
+                type: "GET",
+                url: `${BASE_URL}?${params}`,
+                contentType: "application/json",
+                data: ''
+            })
+
+            typeahead_ajax.done(function(res){
+                render_search_results_table(res)
+            });
+        }, 250);
+    });
+
     // ****************************************
     // Activate a Customer
     // ****************************************
@@ -0,0 +1,293 @@
+"""
+Read-through cache
+
+A small cache with a time to live in front of a loader, keeping its
+entries either in the process or in a store shared by every process.
+
+Without a backend the entries live in an in-process LRU tier bounded by
+`maxsize`. Only the process itself can invalidate them, so it suits a
+single process only: with several workers, or a job worker, a write made
+in one process would leave the others serving the old entry for up to
+`ttl` seconds. With a shared backend such as Redis nothing is kept in the
+process: every process reads and invalidates the same entries, and a write
+made anywhere is seen everywhere on the next read. A disabled cache calls
+the loader every time.
+
+Invalidating a key also gives it a new generation. A read that missed
+notes the generation of its key before calling the loader and stores what
+it loaded only if the generation is still the same, so a row read before
+a write committed cannot be cached after that write invalidated it.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class MemoryBackend:
+    """ A dict based stand-in for a shared cache store such as Redis """
+
+    def __init__(self):
+        self._data = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unexpired(store, key):
+        value, expires = store.get(key, (None, 0))
+        if value is not None and expires < time.monotonic():
+            del store[key]
+            return None
+        return value
+
+    def get(self, key):
+        """ Returns the value stored under key, or None """
+        with self._lock:
+            return self._unexpired(self._data, key)
+
+    def set(self, key, value, ttl):
+        """ Stores value under key for ttl seconds """
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+
+    def generation(self, key):
+        """ Returns the generation of key, None when it was not invalidated within its ttl """
+        with self._lock:
+            return self._unexpired(self._generations, key)
+
+    def set_if_generation(self, key, value, ttl, generation):
+        """ Stores value under key for ttl seconds unless key changed generation, and tells whether it did """
+        with self._lock:
+            if self._unexpired(self._generations, key) != generation:
+                return False
+            self._data[key] = (value, time.monotonic() + ttl)
+            return True
+
+    def delete(self, *keys, ttl=60.0):
+        """ Removes the keys and gives each a new generation for ttl seconds """
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._generations[key] = (uuid.uuid4().hex, time.monotonic() + ttl)
+
+    def clear(self):
+        """ Removes every key """
+        with self._lock:
+            self._data.clear()
+            self._generations.clear()
+
+
+class RedisBackend:
+    """ A shared cache store on Redis, holding the values as JSON """
+
+    # Sets KEYS[1] to ARGV[1] for ARGV[2] seconds while KEYS[2], the generation, is still ARGV[3]
+    SET_IF_GENERATION = """
+        if (redis.call('GET', KEYS[2]) or '') ~= ARGV[3] then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+        return 1
+    """
+
+    def __init__(self, url, prefix="customers:"):
+        import redis  # pylint: disable=import-outside-toplevel
+
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._set_if_generation = self._client.register_script(self.SET_IF_GENERATION)
+
+    def get(self, key):
+        """ Returns the value stored under key, or None """
+        value = self._client.get(self._prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl):
+        """ Stores value under key for ttl seconds """
+        self._client.set(self._prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def generation(self, key):
+        """ Returns the generation of key, None when it was not invalidated within its ttl """
+        generation = self._client.get(self._prefix + "generation:" + key)
+        return None if generation is None else generation.decode()
+
+    def set_if_generation(self, key, value, ttl, generation):
+        """ Stores value under key for ttl seconds unless key changed generation, and tells whether it did """
+        keys = [self._prefix + key, self._prefix + "generation:" + key]
+        return bool(self._set_if_generation(keys=keys, args=[json.dumps(value), max(1, int(ttl)), generation or ""]))
+
+    def delete(self, *keys, ttl=60.0):
+        """ Removes the keys and gives each a new generation for ttl seconds """
+        if not keys:
+            return
+        with self._client.pipeline() as pipeline:
+            pipeline.delete(*(self._prefix + key for key in keys))
+            for key in keys:
+                pipeline.set(self._prefix + "generation:" + key, uuid.uuid4().hex, ex=max(1, int(ttl)))
+            pipeline.execute()
+
+    def clear(self):
+        """ Removes every key under the prefix """
+        for key in self._client.scan_iter(match=self._prefix + "*"):
+            self._client.delete(key)
+
+
+def backend_from_url(url):
+    """ Returns the shared backend for a cache url, or None for the in-process tier of memory:// or no url """
+    if not url or url == "memory://":
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError("Unsupported cache url: " + url)
+
+
+class ReadThroughCache:
+    """ A cache with a time to live in front of a loader function, in process or on a shared backend """
+
+    def __init__(self, maxsize=10000, ttl=60.0, backend=None, enabled=True):
+        self._entries = OrderedDict()
+        # the generation of the keys invalidated last, at most maxsize of them;
+        # the epoch changes when one is forgotten, failing every read under way
+        self._generations = OrderedDict()
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.enabled = enabled
+        self.counters = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0,
+                         "stale_fills": 0}
+
+    def configure(self, maxsize=None, ttl=None, backend=None, enabled=True):
+        """ Changes the bounds and the shared backend, or turns the cache off, emptying the local tier """
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self.backend = backend
+            self.enabled = enabled
+            self._entries.clear()
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the value cached under key, calling loader() on a miss
+
+        A loader result of None is returned without being cached so that a
+        missing row is looked up again on the next call, and neither is a
+        result the key was invalidated while loading.
+        """
+        if not self.enabled:
+            return loader()
+        if self.backend is None:
+            value = self._get_local(key)
+        else:
+            value = self.backend.get(key)
+            if value is not None:
+                with self._lock:
+                    self.counters["shared_hits"] += 1
+        if value is not None:
+            return value
+        with self._lock:
+            self.counters["misses"] += 1
+        generation = self._generation(key)
+        value = loader()
+        if value is not None:
+            self._fill(key, value, generation)
+        return value
+
+    def peek(self, key):
+        """ Returns the value cached under key, or None, without loading it """
+        if not self.enabled:
+            return None
+        if self.backend is None:
+            return self._get_local(key)
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        """ Stores value under key, in the process or on the shared backend """
+        if not self.enabled:
+            return
+        if self.backend is None:
+            self._set_local(key, value)
+        else:
+            self.backend.set(key, value, self.ttl)
+
+    def invalidate(self, *keys):
+        """ Removes the keys and gives each a new generation, on the shared backend too """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generations[key] = object()
+                self._generations.move_to_end(key)
+            while len(self._generations) > self.maxsize:
+                self._generations.popitem(last=False)
+                self._epoch += 1
+            self.counters["invalidations"] += len(keys)
+        if self.backend is not None:
+            self.backend.delete(*keys, ttl=self.ttl)
+
+    def clear(self):
+        """ Removes every entry and resets the counters """
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+            for name in self.counters:
+                self.counters[name] = 0
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        """ Returns the counters together with the current size and bounds """
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(enabled=self.enabled, size=len(self._entries), maxsize=self.maxsize, ttl=self.ttl,
+                         backend=type(self.backend).__name__ if self.backend is not None else None)
+        return stats
+
+    def _generation(self, key):
+        """ Returns the generation of key, to hand to _fill once its value is loaded """
+        if self.backend is not None:
+            return self.backend.generation(key)
+        with self._lock:
+            return self._epoch, self._generations.get(key)
+
+    def _fill(self, key, value, generation):
+        """ Caches a loaded value unless key was invalidated since its generation was taken """
+        if self.backend is not None:
+            filled = self.backend.set_if_generation(key, value, self.ttl, generation)
+        else:
+            with self._lock:
+                filled = (self._epoch, self._generations.get(key)) == generation
+                if filled:
+                    self._store_local(key, value)
+        if not filled:
+            with self._lock:
+                self.counters["stale_fills"] += 1
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.counters["expirations"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return value
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._store_local(key, value)
+
+    def _store_local(self, key, value):
+        """ Stores value under key in the local tier, holding the lock """
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
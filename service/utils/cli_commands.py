@@ -1,8 +1,11 @@
 """
 Flask CLI Command Extensions
 """
-from service import app
-from service.models import db
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from service import app, jobs
+from service.models import CustomerModel, db
 
 
 ######################################################################
@@ -18,3 +21,144 @@ def create_db():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to bring an existing database up to the models
+# Usage: flask upgrade-db
+######################################################################
+@app.cli.command("upgrade-db")
+def upgrade_db():
+    """
+    Creates the tables, columns and indexes missing from an existing
+    database without touching its data. Safe to run more than once.
+    """
+    db.create_all()
+    for column in missing_columns():
+        click.echo(f"Adding column {column.name} to {column.table.name}")
+        definition = CreateColumn(column).compile(dialect=db.engine.dialect)
+        with db.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {column.table.name} ADD COLUMN {definition}"))
+    failed = False
+    for index in missing_indexes():
+        click.echo(f"Creating index {index.name} on {index.table.name}")
+        try:
+            index.create(bind=db.engine)
+        except Exception as error:  # pylint: disable=broad-except
+            click.echo(f"  failed: {error}", err=True)
+            failed = True
+    if db.engine.dialect.name == "postgresql":
+        with db.engine.begin() as conn:
+            if CustomerModel.create_search_index(conn):
+                click.echo("Customer search index is present")
+            else:
+                click.echo("pg_trgm is not available, customer search runs in process")
+    if failed:
+        raise click.ClickException("Some indexes could not be created")
+
+
+######################################################################
+# Command to run the background jobs
+# Usage: flask run-worker [--once]
+######################################################################
+@app.cli.command("run-worker")
+@click.option("--once", is_flag=True, help="Exit once no job is left instead of waiting for more")
+def run_worker(once):
+    """
+    Runs the queued background jobs, resuming the ones left behind by a
+    worker that stopped. Run as many workers as needed.
+    """
+    count = jobs.run_worker(app, once=once)
+    click.echo(f"Ran {count} jobs")
+
+
+######################################################################
+# Command to find stored emails that would not be accepted today
+# Usage: flask check-emails
+######################################################################
+@app.cli.command("check-emails")
+def check_emails():
+    """
+    Lists the Customers whose stored email is invalid. Emails are only
+    validated when written, so run this after loading data directly.
+    """
+    count = 0
+    for customer_id, email in CustomerModel.find_invalid_emails():
+        click.echo(f"invalid: {customer_id} {email!r}")
+        count += 1
+    if count:
+        raise click.ClickException(f"{count} Customers have an invalid email")
+    click.echo("All emails are valid")
+
+
+######################################################################
+# Command to report missing and unused indexes
+# Usage: flask index-report
+######################################################################
+@app.cli.command("index-report")
+def index_report():
+    """
+    Reports the indexes declared by the models that are missing from the
+    database and, on PostgreSQL, the indexes that have never been scanned.
+    """
+    for column in missing_columns():
+        click.echo(f"missing column: {column.name} on {column.table.name}")
+    missing = missing_indexes()
+    for index in missing:
+        click.echo(f"missing: {index.name} on {index.table.name}")
+    if db.engine.dialect.name != "postgresql":
+        click.echo("unused: not available on " + db.engine.dialect.name)
+    else:
+        for table, name, size in unused_indexes():
+            click.echo(f"unused: {name} on {table} ({size})")
+    if not missing:
+        click.echo("All declared indexes are present")
+
+
+def missing_columns():
+    """Returns the columns of the models that do not exist in the database"""
+    missing = []
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(column for column in table.columns if column.name not in existing)
+    return missing
+
+
+def missing_indexes():
+    """Returns the indexes of the models that do not exist in the database"""
+    missing = []
+    with db.engine.connect() as conn:
+        for table in db.metadata.sorted_tables:
+            if not db.engine.dialect.has_table(conn, table.name):
+                continue
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if not index_exists(conn, index):
+                    missing.append(index)
+    return missing
+
+
+def index_exists(conn, index):
+    """Looks an index up by name, expression indexes included"""
+    if conn.dialect.name == "postgresql":
+        query = text("SELECT 1 FROM pg_indexes WHERE tablename = :table AND indexname = :index")
+    elif conn.dialect.name == "sqlite":
+        query = text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = :table AND name = :index")
+    else:
+        return index.name in {found["name"] for found in inspect(conn).get_indexes(index.table.name)}
+    return conn.execute(query, {"table": index.table.name, "index": index.name}).first() is not None
+
+
+def unused_indexes():
+    """Returns (table, index, size) of the PostgreSQL indexes never scanned"""
+    tables = [table.name for table in db.metadata.sorted_tables]
+    query = text(
+        "SELECT s.relname, s.indexrelname, pg_size_pretty(pg_relation_size(s.indexrelid)) "
+        "FROM pg_stat_user_indexes s JOIN pg_index i ON i.indexrelid = s.indexrelid "
+        "WHERE s.idx_scan = 0 AND NOT i.indisunique AND s.relname = ANY(:tables) "
+        "ORDER BY s.relname, s.indexrelname"
+    )
+    with db.engine.connect() as conn:
+        return conn.execute(query, {"tables": tables}).fetchall()
@@ -0,0 +1,107 @@
+"""
+Response Compression
+
+Compresses the responses of the app with the best encoding the client
+accepts: br when the optional brotli package is installed, gzip otherwise.
+Bodies smaller than COMPRESS_MIN_SIZE go out as they are, since compressing
+them costs more than it saves. Streamed responses, like the exports, are
+compressed a chunk at a time as they are sent.
+
+A compressed body is a different representation, so its strong ETag gets
+the encoding appended, e.g. "12-3-gzip". The suffix is stripped from the
+If-Match and If-None-Match headers of the next requests before the routes
+compare them, and put back on the ETag of a 304 answering such a request.
+"""
+import re
+import zlib
+
+from flask import current_app, g, request
+
+from .streaming import gzip_chunks
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# The encodings this process can produce, by order of preference
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+_SUFFIXED_TAG = re.compile(r'-(br|gzip)"')
+
+
+def init_compression(app):
+    """ Compresses the responses of the app """
+    app.before_request(_strip_etag_suffixes)
+    app.after_request(_compress_response)
+
+
+def brotli_chunks(chunks, quality: int = 4):
+    """Compresses a stream of byte chunks into a single brotli stream"""
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compresses a whole body with an encoding of ENCODINGS"""
+    if encoding == "br":
+        return brotli.compress(data, quality=current_app.config["COMPRESS_BROTLI_QUALITY"])
+    compressor = zlib.compressobj(current_app.config["COMPRESS_LEVEL"], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def negotiate():
+    """Returns the encoding of ENCODINGS the request accepts best, or None"""
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None or not request.accept_encodings[encoding]:
+        return None
+    return encoding
+
+
+def _strip_etag_suffixes():
+    g.etag_suffix = None
+    for header in ("HTTP_IF_MATCH", "HTTP_IF_NONE_MATCH"):
+        value = request.environ.get(header)
+        if value:
+            match = _SUFFIXED_TAG.search(value)
+            if match:
+                g.etag_suffix = "-" + match.group(1)
+                request.environ[header] = _SUFFIXED_TAG.sub('"', value)
+
+
+def _suffix_etag(response, suffix):
+    tag, weak = response.get_etag()
+    if tag and not weak:
+        response.set_etag(tag + suffix)
+
+
+def _compress_response(response):
+    if response.status_code == 304 and g.get("etag_suffix"):
+        _suffix_etag(response, g.etag_suffix)
+    if (response.status_code < 200 or response.status_code in (204, 304) or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in current_app.config["COMPRESS_MIMETYPES"]):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        if encoding == "br":
+            chunks = brotli_chunks(response.response, current_app.config["COMPRESS_BROTLI_QUALITY"])
+        else:
+            chunks = gzip_chunks(response.response, current_app.config["COMPRESS_LEVEL"])
+        response.response = chunks
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    _suffix_etag(response, "-" + encoding)
+    return response
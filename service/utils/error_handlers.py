@@ -17,7 +17,10 @@
 """
 Module: error_handlers
 """
-from service.models import DataValidationError
+from flask import request
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import DataValidationError, db
 from service import app, api
 from . import status
 
@@ -37,6 +40,38 @@ def request_validation_error(error):
     }, status.HTTP_400_BAD_REQUEST
 
 
+@api.errorhandler(IntegrityError)
+def database_conflict_error(error):
+    """Handles writes rejected by a database constraint such as a duplicate email"""
+    db.session.rollback()
+    message = str(error.orig).strip()
+    app.logger.warning(message)
+    return {
+        'status_code': status.HTTP_409_CONFLICT,
+        'error': 'Conflict',
+        'message': message
+    }, status.HTTP_409_CONFLICT
+
+
+@api.errorhandler(StaleDataError)
+def concurrent_update_error(error):
+    """Handles an update that lost the race against another write of the same row"""
+    db.session.rollback()
+    message = "The resource was modified by another request: " + str(error)
+    app.logger.warning(message)
+    if request.if_match:
+        return {
+            'status_code': status.HTTP_412_PRECONDITION_FAILED,
+            'error': 'Precondition Failed',
+            'message': message
+        }, status.HTTP_412_PRECONDITION_FAILED
+    return {
+        'status_code': status.HTTP_409_CONFLICT,
+        'error': 'Conflict',
+        'message': message
+    }, status.HTTP_409_CONFLICT
+
+
 # @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 # def bad_request(error):
 #     """Handles bad requests with 400_BAD_REQUEST"""
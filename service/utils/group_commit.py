@@ -0,0 +1,124 @@
+"""
+Group commit
+
+Coalesces the writes of concurrent requests of a worker into one call of
+a write function, which commits them in one transaction.
+
+A request submitting a write while no batch is being written leads: it
+waits up to `window` seconds for other requests to join, or until
+`max_size` have, and writes the batch while they wait. Requests arriving
+while a batch is being written have waited already, so they make up the
+next batch, written as soon as that one is done. The batches grow with
+the load, and a request arriving alone is held back by the window only.
+Every request gets back the error of its own write, or of its whole
+batch.
+
+The write function takes the list of submitted items and returns a list
+of the same length holding the error of each item, or None.
+"""
+import threading
+import time
+
+
+class _Entry:  # pylint: disable=too-few-public-methods
+    """ A submitted item waiting for its batch to be written """
+
+    __slots__ = ("item", "error", "done")
+
+    def __init__(self, item):
+        self.item = item
+        self.error = None
+        self.done = False
+
+
+class GroupCommit:
+    """ Batches the items submitted by concurrent threads into calls of write """
+
+    def __init__(self, write, window=0.0, max_size=50):
+        self._write = write
+        self._cond = threading.Condition()
+        self._pending = []
+        self._leading = False
+        self.window = window
+        self.max_size = max_size
+        self.counters = {"writes": 0, "batches": 0, "errors": 0, "largest_batch": 0}
+
+    def configure(self, window=None, max_size=None):
+        """ Changes the window in seconds, 0 turning batching off, and the batch size limit """
+        with self._cond:
+            if window is not None:
+                self.window = window
+            if max_size is not None:
+                self.max_size = max(1, max_size)
+
+    @property
+    def enabled(self):
+        """ Tells whether the submitted items are batched """
+        return self.window > 0
+
+    def submit(self, item):
+        """
+        Writes item in the next batch and returns once its batch is written
+
+        Raises the error the write function gave for item, or the one that
+        failed its batch as a whole.
+        """
+        entry = _Entry(item)
+        with self._cond:
+            self._pending.append(entry)
+            if len(self._pending) >= self.max_size:
+                self._cond.notify_all()
+            window = 0 if self._leading else self.window
+            while self._leading and not entry.done:
+                self._cond.wait()
+            leader = not entry.done
+            self._leading = self._leading or leader
+        if leader:
+            try:
+                while not entry.done:
+                    self._write_batch(self._collect(window))
+                    window = 0
+            finally:
+                with self._cond:
+                    self._leading = False
+                    self._cond.notify_all()
+        if entry.error is not None:
+            raise entry.error
+
+    def stats(self):
+        """ Returns the counters together with the window and the batch size limit """
+        with self._cond:
+            stats = dict(self.counters)
+            stats.update(window_ms=round(self.window * 1000, 3), max_size=self.max_size,
+                         mean_batch=round(stats["writes"] / stats["batches"], 2) if stats["batches"] else 0.0)
+        return stats
+
+    def _collect(self, window):
+        """ Waits out the window, or for a full batch, and takes the batch """
+        deadline = time.monotonic() + window
+        with self._cond:
+            while len(self._pending) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_size]
+            del self._pending[:self.max_size]
+        return batch
+
+    def _write_batch(self, batch):
+        """ Writes a batch and hands every entry its error, even when the writer is interrupted """
+        errors = [RuntimeError("The write of the batch was interrupted")] * len(batch)
+        try:
+            errors = self._write([entry.item for entry in batch])
+        except Exception as error:  # pylint: disable=broad-except
+            errors = [error] * len(batch)
+        finally:
+            with self._cond:
+                for entry, error in zip(batch, errors):
+                    entry.error, entry.done = error, True
+                self.counters["writes"] += len(batch)
+                self.counters["batches"] += 1
+                self.counters["errors"] += sum(error is not None for error in errors)
+                self.counters["largest_batch"] = max(self.counters["largest_batch"], len(batch))
+                self._cond.notify_all()
@@ -0,0 +1,105 @@
+"""
+Prometheus Metrics
+
+Counts and times every request by flask-restx resource and method, and the
+SQL statements each request sends to the database as timed by the profiler.
+Times the checkouts of the connection pool and gauges its connections in
+use and overflow, which TimedQueuePool updates.
+
+When PROMETHEUS_MULTIPROC_DIR is set, as gunicorn.conf.py does for
+every worker, the values live in files of that directory and /metrics adds
+up the files of every worker process, so any worker answers for all of them.
+"""
+import os
+import time
+
+from flask import current_app, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+LABELS = ("resource", "method")
+
+REQUESTS = Counter(
+    "http_requests_total", "Requests answered, by resource, method and status", LABELS + ("status",)
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time spent answering a request", LABELS,
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being answered", LABELS, multiprocess_mode="livesum"
+)
+DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements sent while answering a request", LABELS,
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+DB_TIME = Histogram(
+    "http_request_db_duration_seconds", "Time spent in SQL statements while answering a request", LABELS,
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time a checkout waited for a connection of the pool",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+# Summed over the workers, the connections the service holds
+DB_POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use", "Connections checked out of the pool", multiprocess_mode="livesum"
+)
+# The worker that spilled furthest beyond DB_POOL_SIZE
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections", "Connections open beyond the size of the pool", multiprocess_mode="max"
+)
+
+# Requests for these endpoints are not measured
+UNMEASURED_ENDPOINTS = {"prometheus_metrics", "static"}
+
+
+def init_metrics(app):
+    """ Measures every request of the app """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_leave_request)
+
+
+def render():
+    """ Returns the exposition of every metric and its content type """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def resource_name(app):
+    """ Returns the flask-restx resource class or the endpoint answering the request """
+    if request.endpoint is None:
+        return "unmatched"
+    view = app.view_functions.get(request.endpoint)
+    view_class = getattr(view, "view_class", None)
+    return view_class.__name__ if view_class is not None else request.endpoint
+
+
+def _start_request():
+    if request.endpoint in UNMEASURED_ENDPOINTS:
+        return
+    g.metrics_labels = (resource_name(current_app), request.method)
+    g.metrics_start = time.perf_counter()
+    IN_PROGRESS.labels(*g.metrics_labels).inc()
+
+
+def _finish_request(response):
+    if "metrics_start" in g:
+        labels = g.metrics_labels
+        REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - g.metrics_start)
+        REQUESTS.labels(*labels, str(response.status_code)).inc()
+        DB_QUERIES.labels(*labels).observe(g.get("db_queries", 0))
+        DB_TIME.labels(*labels).observe(g.get("db_time", 0.0))
+    return response
+
+
+def _leave_request(error=None):  # pylint: disable=unused-argument
+    if "metrics_start" in g:
+        IN_PROGRESS.labels(*g.metrics_labels).dec()
+        g.pop("metrics_start")
@@ -0,0 +1,93 @@
+"""
+Connection pool instrumentation
+
+TimedQueuePool is a QueuePool that records how long every checkout waited
+for a connection, which is the time a request spends queued behind the
+pool when all of its connections are in use. It reports the waits and the
+connections in use to /stats of its process, and to the Prometheus metrics
+that /metrics adds up over every worker.
+"""
+import threading
+import time
+from collections import deque
+
+from sqlalchemy.pool import QueuePool
+
+from service.utils.metrics import DB_POOL_CHECKOUT_WAIT, DB_POOL_IN_USE, DB_POOL_OVERFLOW
+
+
+class CheckoutWaits:
+    """ Counts pool checkouts and keeps their most recent wait times """
+
+    def __init__(self, window=1024):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """ Records the wait of one checkout """
+        with self._lock:
+            self._recent.append(seconds)
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def reset(self):
+        """ Forgets every recorded wait """
+        with self._lock:
+            self._recent.clear()
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def stats(self):
+        """ Returns the checkout count and wait times in milliseconds """
+        with self._lock:
+            recent = sorted(self._recent)
+            stats = {
+                "checkouts": self.count,
+                "wait_total_ms": round(self.total * 1000, 3),
+                "wait_max_ms": round(self.max * 1000, 3),
+            }
+        for name, pct in (("wait_p50_ms", 0.50), ("wait_p99_ms", 0.99)):
+            stats[name] = round(recent[int(pct * (len(recent) - 1))] * 1000, 3) if recent else 0.0
+        return stats
+
+
+checkout_waits = CheckoutWaits()
+
+
+class TimedQueuePool(QueuePool):
+    """ A QueuePool that records the wait of every checkout and gauges its connections """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            checkout_waits.record(wait)
+            DB_POOL_CHECKOUT_WAIT.observe(wait)
+            self._gauge()
+
+    def _do_return_conn(self, record):
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self._gauge()
+
+    def _gauge(self):
+        DB_POOL_IN_USE.set(self.checkedout())
+        DB_POOL_OVERFLOW.set(max(0, self.overflow()))
+
+
+def pool_stats(pool):
+    """ Returns the in-use and overflow gauges of a pool with its checkout waits """
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                     overflow=max(0, pool.overflow()))
+    stats.update(checkout_waits.stats())
+    return stats
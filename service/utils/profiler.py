@@ -0,0 +1,147 @@
+"""
+Request Profiler
+
+Times the SQL statements of every request. Statements slower than
+SLOW_QUERY_MS are always logged with the route that sent them.
+
+Profiling is opt-in, with SQL_PROFILING=true for every request or the
+SQL_PROFILE_HEADER request header (X-SQL-Profile: 1) for one. A profiled
+request logs each statement with its duration and row count, and answers
+with a Server-Timing header made of:
+
+    db         time spent executing SQL statements
+    serialize  time in the handler outside of SQL, where the ORM builds the
+               rows and serialize() turns them into dictionaries
+    marshal    time spent marshalling or encoding the handler result
+    total      time from the start of the request to its response
+"""
+import functools
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from flask_restx import Api
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def init_profiler(app):
+    """ Times the SQL statements of every request of the app """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def profiling():
+    """ Tells whether the current request is profiled """
+    return has_request_context() and g.get("sql_profile") is not None
+
+
+@contextmanager
+def timed(name):
+    """ Adds the time spent in the block, less its SQL, to the name timing of the request """
+    start, db_start = time.perf_counter(), g.get("db_time", 0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start - (g.get("db_time", 0.0) - db_start)
+        setattr(g, f"{name}_time", g.get(f"{name}_time", 0.0) + elapsed)
+
+
+class ProfilingApi(Api):
+    """ An Api whose marshalling decorators also time the handler and the marshalling """
+
+    def marshal_with(self, fields, *args, **kwargs):
+        """ Api.marshal_with, timed """
+        return _timed_marshalling(self.default_namespace.marshal_with(fields, *args, **kwargs))
+
+    def marshal_list_with(self, fields, **kwargs):
+        """ Api.marshal_list_with, timed """
+        return self.marshal_with(fields, True, **kwargs)
+
+
+def _timed_marshalling(marshal_decorator):
+    def decorator(func):
+        @functools.wraps(func)
+        def handler(*args, **kwargs):
+            start, db_start = time.perf_counter(), g.get("db_time", 0.0)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                g.serialize_time = elapsed - (g.get("db_time", 0.0) - db_start)
+                g.handler_time = elapsed
+
+        marshalled = marshal_decorator(handler)
+
+        @functools.wraps(marshalled)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            response = marshalled(*args, **kwargs)
+            g.marshal_time = time.perf_counter() - start - g.pop("handler_time", 0.0)
+            return response
+
+        return timed
+
+    return decorator
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_time = 0.0
+    g.pop("serialize_time", None)
+    g.pop("marshal_time", None)
+    header = current_app.config.get("SQL_PROFILE_HEADER")
+    enabled = current_app.config.get("SQL_PROFILING") or (header and request.headers.get(header) in ("1", "true"))
+    g.sql_profile = [] if enabled else None
+
+
+def _finish_request(response):
+    if g.get("sql_profile") is None:
+        return response
+    total = time.perf_counter() - g.request_start
+    timings = [f'db;dur={g.db_time * 1000:.2f};desc="{g.db_queries} queries"']
+    for name in ("serialize", "marshal"):
+        if f"{name}_time" in g:
+            timings.append(f"{name};dur={g.get(name + '_time') * 1000:.2f}")
+    timings.append(f"total;dur={total * 1000:.2f}")
+    response.headers["Server-Timing"] = ", ".join(timings)
+    current_app.logger.info("Profile of %s %s: %d statements, %s", request.method, request.path,
+                            g.db_queries, response.headers["Server-Timing"])
+    for number, (statement, duration, rows) in enumerate(g.sql_profile, start=1):
+        current_app.logger.info("  #%d %.2fms rows=%s %s", number, duration * 1000, rows, statement)
+    g.sql_profile = None
+    return response
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, *args):  # pylint: disable=unused-argument
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+    _record(conn, statement, cursor.rowcount)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    if context.connection is not None:
+        _record(context.connection, context.statement, None)
+
+
+def _record(conn, statement, rows):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if not has_request_context() or "db_time" not in g:
+        return
+    g.db_queries += 1
+    g.db_time += elapsed
+    if g.sql_profile is not None:
+        g.sql_profile.append((statement, elapsed, rows if rows is None or rows >= 0 else None))
+    threshold = current_app.config.get("SLOW_QUERY_MS", 0)
+    if threshold and elapsed * 1000 >= threshold:
+        route = request.url_rule.rule if request.url_rule else request.path
+        current_app.logger.warning("Slow query %.1fms in %s %s: %s", elapsed * 1000, request.method, route, statement)
@@ -0,0 +1,80 @@
+"""
+In-process Trigram Search
+
+Customer search runs in PostgreSQL with pg_trgm when it is installed.
+Everywhere else, SQLite included, TrigramIndex stands in: an inverted index
+from the trigrams of every searchable document to the ids holding them,
+built in memory and scored like pg_trgm's word similarity, so both rank
+the same way. It is rebuilt whenever the fingerprint of the table changes,
+which makes it fit for development and test sized tables only.
+"""
+import re
+import threading
+from collections import defaultdict
+
+# The word similarity a document needs to match, pg_trgm.word_similarity_threshold by default
+SIMILARITY_THRESHOLD = 0.6
+
+# pg_trgm splits text into words of letters and digits
+_WORD = re.compile(r"[^\W_]+")
+
+
+def trigrams(text):
+    """Returns the trigrams of the words of text the way pg_trgm makes them, ignoring case"""
+    grams = set()
+    for word in _WORD.findall(text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[start:start + 3] for start in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """ Inverted index of the trigrams of documents, by document id """
+
+    def __init__(self):
+        self._postings = defaultdict(set)
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def refresh(self, fingerprint, load):
+        """
+        Rebuilds the index from load() unless it was built for the same fingerprint
+
+        Args:
+            fingerprint: anything that changes whenever the documents do
+            load (function): returns the (id, text) of every document
+        """
+        with self._lock:
+            if fingerprint == self._fingerprint:
+                return
+            postings = defaultdict(set)
+            for doc_id, text in load():
+                for gram in trigrams(text):
+                    postings[gram].add(doc_id)
+            self._postings = postings
+            self._fingerprint = fingerprint
+
+    def search(self, query, threshold=SIMILARITY_THRESHOLD):
+        """
+        Returns the ids of the documents matching query, best match first
+
+        A document scores the share of the trigrams of query it holds, and
+        matches from threshold up. Ties go to the lowest id.
+        """
+        wanted = trigrams(query)
+        if not wanted:
+            return []
+        counts = defaultdict(int)
+        postings = self._postings
+        for gram in wanted:
+            for doc_id in postings.get(gram, ()):
+                counts[doc_id] += 1
+        needed = threshold * len(wanted)
+        ranked = sorted((-count, doc_id) for doc_id, count in counts.items() if count >= needed)
+        return [doc_id for _, doc_id in ranked]
+
+    def clear(self):
+        """ Empties the index so that the next refresh rebuilds it """
+        with self._lock:
+            self._postings = defaultdict(set)
+            self._fingerprint = None
@@ -0,0 +1,100 @@
+"""
+Fast Serializers
+
+Marshalling with flask-restx walks the fields of a model for every row and
+builds a second dictionary out of the one serialize() already built.
+compile_model() does the walk once: it turns a flask-restx model into a
+function that converts a model object, a row tuple or a dictionary
+straight into the dictionary that marshalling the serialized row gives.
+
+dumps() encodes with orjson when it is installed and falls back to the
+standard json module otherwise.
+"""
+import json
+from datetime import date, datetime
+from enum import Enum
+
+from flask_restx import fields
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def dumps(data) -> bytes:
+    """ Encodes data as compact JSON bytes """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def json_backend():
+    """ Names the library dumps() encodes with """
+    return "orjson" if orjson is not None else "json"
+
+
+def _string(value):
+    # serialize() turns enums into their name before String formats them
+    return value.name if isinstance(value, Enum) else str(value)
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return date.fromisoformat(value).isoformat()
+
+
+FORMATTERS = {
+    fields.String: _string,
+    fields.Integer: int,
+    fields.Boolean: bool,
+    fields.Date: _date,
+    fields.Raw: None,
+}
+
+
+def compile_model(model, skip_none=False):
+    """
+    Compiles a flask-restx model into a function returning the marshalled dictionary of a row
+
+    Args:
+        model: the flask-restx model, with String, Integer, Boolean, Date, Raw
+            and List of Nested fields only
+        skip_none (bool): leave out the keys whose value is None, like marshal_with(skip_none=True)
+
+    Returns:
+        function: converts an object, a row or a dictionary holding the serialized values
+    """
+    plan = [_compile_field(key, field) for key, field in getattr(model, "resolved", model).items()]
+
+    def serialize(row):
+        is_dict = isinstance(row, dict)
+        out = {}
+        for key, attribute, convert in plan:
+            value = row.get(attribute) if is_dict else getattr(row, attribute, None)
+            if value is not None and convert is not None:
+                value = convert(value)
+            if not skip_none or (value is not None and value != {}):
+                out[key] = value
+        return out
+
+    return serialize
+
+
+def _compile_field(key, field):
+    """ Returns the key, attribute and converter of one field of a model """
+    field = field() if isinstance(field, type) else field
+    attribute = field.attribute if field.attribute is not None else key
+    if not isinstance(attribute, str) or field.default is not None:
+        raise ValueError(f"Field {key} cannot be compiled")
+    if isinstance(field, fields.List):
+        if not isinstance(field.container, fields.Nested):
+            raise ValueError(f"Field {key} cannot be compiled")
+        item = compile_model(field.container.nested, skip_none=field.container.skip_none)
+        return key, attribute, lambda values: [item(value) for value in values]
+    if type(field) not in FORMATTERS:
+        raise ValueError(f"Field {key} of type {type(field).__name__} cannot be compiled")
+    return key, attribute, FORMATTERS[type(field)]
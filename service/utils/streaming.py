@@ -0,0 +1,38 @@
+"""
+Streaming Helpers
+
+This module contains generators used to stream large responses
+a chunk at a time instead of building them in memory
+"""
+import zlib
+
+from .serializers import dumps
+
+# Flush to the client once roughly this many bytes are buffered
+CHUNK_SIZE = 64 * 1024
+
+
+def ndjson_chunks(items, chunk_size: int = CHUNK_SIZE):
+    """Encodes dictionaries as newline delimited JSON chunks"""
+    buffer = []
+    size = 0
+    for item in items:
+        line = dumps(item) + b"\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def gzip_chunks(chunks, level: int = 6):
+    """Compresses a stream of byte chunks into a single gzip stream"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
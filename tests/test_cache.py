@@ -0,0 +1,142 @@
+"""
+Test cases for the read-through cache
+
+Test cases can be run with:
+    nosetests -v --with-spec --spec-color
+"""
+import unittest
+from unittest import mock
+
+from service.utils.cache import MemoryBackend, ReadThroughCache, backend_from_url
+
+
+######################################################################
+#  R E A D - T H R O U G H   C A C H E   T E S T   C A S E S
+######################################################################
+class TestReadThroughCache(unittest.TestCase):
+    """ Test Cases for ReadThroughCache """
+
+    def test_read_through(self):
+        """It should call the loader only on a miss"""
+        cache = ReadThroughCache()
+        loader = mock.Mock(return_value={"id": 1})
+        self.assertEqual(cache.get_or_load("a", loader), {"id": 1})
+        self.assertEqual(cache.get_or_load("a", loader), {"id": 1})
+        loader.assert_called_once()
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+    def test_does_not_cache_none(self):
+        """It should look a missing value up again"""
+        cache = ReadThroughCache()
+        loader = mock.Mock(return_value=None)
+        cache.get_or_load("a", loader)
+        cache.get_or_load("a", loader)
+        self.assertEqual(loader.call_count, 2)
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        cache = ReadThroughCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get_or_load("a", mock.Mock())
+        cache.set("c", 3)
+        self.assertEqual(cache.get_or_load("a", mock.Mock()), 1)
+        self.assertIsNone(cache.get_or_load("b", lambda: None))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_expires_entries(self):
+        """It should reload an entry older than the ttl"""
+        cache = ReadThroughCache(ttl=10)
+        with mock.patch("service.utils.cache.time.monotonic", return_value=100.0):
+            cache.set("a", 1)
+        with mock.patch("service.utils.cache.time.monotonic", return_value=111.0):
+            self.assertEqual(cache.get_or_load("a", lambda: 2), 2)
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_invalidate(self):
+        """It should drop invalidated keys from every tier"""
+        backend = MemoryBackend()
+        cache = ReadThroughCache(backend=backend)
+        cache.set("a", 1)
+        cache.invalidate("a")
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(cache.get_or_load("a", lambda: 2), 2)
+
+    def test_invalidate_across_processes(self):
+        """It should not serve an entry that another process sharing the backend invalidated"""
+        backend = MemoryBackend()
+        web, worker = ReadThroughCache(backend=backend), ReadThroughCache(backend=backend)
+        self.assertEqual(web.get_or_load("a", lambda: 1), 1)
+        self.assertEqual(worker.get_or_load("a", lambda: 2), 1)
+        worker.invalidate("a")
+        self.assertEqual(web.get_or_load("a", lambda: 3), 3)
+        self.assertEqual(worker.peek("a"), 3)
+        self.assertEqual(web.stats()["size"], 0)
+
+    def test_invalidate_while_loading(self):
+        """It should not cache a value loaded before the key was invalidated"""
+        cache = ReadThroughCache()
+
+        def stale_load():
+            cache.invalidate("a")  # a write commits while the old row is on its way
+            return "old"
+
+        self.assertEqual(cache.get_or_load("a", stale_load), "old")
+        self.assertEqual(cache.get_or_load("a", lambda: "new"), "new")
+        self.assertEqual(cache.get_or_load("a", mock.Mock()), "new")
+        self.assertEqual(cache.stats()["stale_fills"], 1)
+
+    def test_invalidate_while_loading_across_processes(self):
+        """It should not cache a value loaded before another process sharing the backend invalidated it"""
+        backend = MemoryBackend()
+        web, worker = ReadThroughCache(backend=backend), ReadThroughCache(backend=backend)
+
+        def stale_load():
+            worker.invalidate("a")
+            return "old"
+
+        self.assertEqual(web.get_or_load("a", stale_load), "old")
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(worker.get_or_load("a", lambda: "new"), "new")
+        self.assertEqual(web.get_or_load("a", mock.Mock()), "new")
+        self.assertEqual(web.stats()["stale_fills"], 1)
+
+    def test_forgotten_generations(self):
+        """It should not cache a value whose invalidation was forgotten while loading"""
+        cache = ReadThroughCache(maxsize=1)
+
+        def stale_load():
+            cache.invalidate("a")
+            cache.invalidate("b")
+            return "old"
+
+        cache.get_or_load("a", stale_load)
+        self.assertIsNone(cache.peek("a"))
+
+    def test_disabled(self):
+        """It should call the loader every time when turned off"""
+        cache = ReadThroughCache(enabled=False)
+        loader = mock.Mock(return_value=1)
+        cache.set("a", 2)
+        self.assertEqual(cache.get_or_load("a", loader), 1)
+        self.assertEqual(cache.get_or_load("a", loader), 1)
+        self.assertEqual(loader.call_count, 2)
+        self.assertIsNone(cache.peek("a"))
+
+    def test_shared_backend(self):
+        """It should reuse entries loaded by another cache on the same backend"""
+        backend = MemoryBackend()
+        ReadThroughCache(backend=backend).get_or_load("a", lambda: 1)
+        other = ReadThroughCache(backend=backend)
+        loader = mock.Mock()
+        self.assertEqual(other.get_or_load("a", loader), 1)
+        loader.assert_not_called()
+        self.assertEqual(other.stats()["shared_hits"], 1)
+
+    def test_backend_from_url(self):
+        """It should pick the shared backend from the cache url"""
+        self.assertIsNone(backend_from_url(""))
+        self.assertIsNone(backend_from_url("memory://"))
+        self.assertRaises(ValueError, backend_from_url, "ftp://cache")
@@ -0,0 +1,113 @@
+"""
+Test cases for the group commit of concurrent writes
+
+Test cases can be run with:
+    nosetests -v --with-spec --spec-color
+"""
+import threading
+import time
+import unittest
+
+from service.utils.group_commit import GroupCommit
+
+
+def submit_all(group, items):
+    """Submits every item from a thread of its own, all at once, and returns what each got back"""
+    results = [None] * len(items)
+    barrier = threading.Barrier(len(items))
+
+    def submit(index):
+        barrier.wait()
+        try:
+            group.submit(items[index])
+            results[index] = "ok"
+        except Exception as error:  # pylint: disable=broad-except
+            results[index] = error
+
+    threads = [threading.Thread(target=submit, args=(index,)) for index in range(len(items))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+######################################################################
+#  G R O U P   C O M M I T   T E S T   C A S E S
+######################################################################
+class TestGroupCommit(unittest.TestCase):
+    """ Test Cases for GroupCommit """
+
+    def setUp(self):
+        """This runs before each test"""
+        self.batches = []
+        self.group = GroupCommit(self.write, window=0.2, max_size=50)
+
+    def write(self, items):
+        """Records the batch and fails the negative items"""
+        self.batches.append(list(items))
+        return [ValueError(item) if item < 0 else None for item in items]
+
+    def test_disabled_by_default(self):
+        """It should batch only with a window"""
+        self.assertFalse(GroupCommit(self.write).enabled)
+        self.assertTrue(self.group.enabled)
+        self.group.configure(window=0)
+        self.assertFalse(self.group.enabled)
+
+    def test_batches_concurrent_writes(self):
+        """It should write the items submitted within the window together"""
+        results = submit_all(self.group, list(range(8)))
+        self.assertEqual(results, ["ok"] * 8)
+        self.assertEqual(len(self.batches), 1)
+        self.assertCountEqual(self.batches[0], range(8))
+        stats = self.group.stats()
+        self.assertEqual((stats["writes"], stats["batches"], stats["largest_batch"]), (8, 1, 8))
+        self.assertEqual(stats["mean_batch"], 8.0)
+
+    def test_max_size(self):
+        """It should write a full batch without waiting out the window"""
+        self.group.configure(window=5, max_size=3)
+        start = time.monotonic()
+        results = submit_all(self.group, list(range(3)))
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(results, ["ok"] * 3)
+        self.assertEqual([len(batch) for batch in self.batches], [3])
+
+    def test_splits_batches(self):
+        """It should write at most max_size items at once"""
+        self.group.configure(max_size=3)
+        results = submit_all(self.group, list(range(7)))
+        self.assertEqual(results, ["ok"] * 7)
+        self.assertLessEqual(max(len(batch) for batch in self.batches), 3)
+        self.assertCountEqual([item for batch in self.batches for item in batch], range(7))
+
+    def test_lone_write_waits_for_the_window(self):
+        """It should hold a write back by the window when no other joins it"""
+        self.group.configure(window=0.05)
+        start = time.monotonic()
+        self.group.submit(1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual(self.batches, [[1]])
+
+    def test_own_errors(self):
+        """It should raise the error of each item in the thread that submitted it only"""
+        results = submit_all(self.group, [1, -2, 3, -4])
+        self.assertEqual(results[0], "ok")
+        self.assertEqual(results[2], "ok")
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[1].args, (-2,))
+        self.assertEqual(results[3].args, (-4,))
+        self.assertEqual(self.group.stats()["errors"], 2)
+
+    def test_batch_error(self):
+        """It should raise the error that failed the batch in every thread of it"""
+        def fail(items):
+            raise RuntimeError("database is down")
+
+        group = GroupCommit(fail, window=0.2)
+        results = submit_all(group, [1, 2, 3])
+        for result in results:
+            self.assertIsInstance(result, RuntimeError)
+        group.configure(window=0.01)
+        self.assertRaises(RuntimeError, group.submit, 4)
@@ -3,12 +3,21 @@ Test cases for CustomersModel Model
 """
 # from audioop import add
 from werkzeug.exceptions import NotFound
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 import os
 import logging
+import threading
 import unittest
 from datetime import date
-from service.models import CustomerModel, AddressModel, Gender, DataValidationError, db
-from service import app
+from unittest import mock
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from service.models import (
+    CustomerModel, AddressModel, Gender, DataValidationError, BulkCreateError, SEARCH_INDEX_DDL, customer_cache,
+    customer_group_commit, db
+)
+from service import app, create_app
 from tests.factories import CustomerFactory
 from tests.factories import AddressFactory
 
@@ -30,6 +39,7 @@ class TestCustomersModel(unittest.TestCase):
         app.config["TESTING"] = True
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        create_app()
         app.logger.setLevel(logging.CRITICAL)
         CustomerModel.init_db(app)
 
@@ -43,6 +53,7 @@ class TestCustomersModel(unittest.TestCase):
         db.session.query(AddressModel).delete()
         db.session.query(CustomerModel).delete()  # clean up the last tests
         db.session.commit()
+        customer_cache.clear()
 
     def tearDown(self):
         """This runs after each test"""
@@ -139,6 +150,99 @@ class TestCustomersModel(unittest.TestCase):
         customers = CustomerModel.all()
         self.assertEqual(len(customers), 5)
 
+    def test_paginate_customers(self):
+        """It should return Customers one keyset page at a time"""
+        for _ in range(5):
+            CustomerFactory().create()
+        page, has_more = CustomerModel.paginate(2)
+        self.assertEqual(len(page), 2)
+        self.assertTrue(has_more)
+        page, has_more = CustomerModel.paginate(2, after_id=page[-1].customer_id)
+        self.assertEqual(len(page), 2)
+        self.assertTrue(has_more)
+        last_page, has_more = CustomerModel.paginate(2, after_id=page[-1].customer_id)
+        self.assertEqual(len(last_page), 1)
+        self.assertFalse(has_more)
+        self.assertGreater(last_page[0].customer_id, page[-1].customer_id)
+
+    def test_create_many_customers(self):
+        """It should Create many Customers in chunks"""
+        customers = CustomerFactory.create_batch(5)
+        errors = CustomerModel.create_many(customers, chunk_size=2)
+        self.assertEqual(errors, {})
+        self.assertEqual(len(CustomerModel.all()), 5)
+        for customer in customers:
+            self.assertIsNotNone(customer.customer_id)
+
+    def test_create_many_customers_best_effort(self):
+        """It should skip the Customers the database rejects when not atomic"""
+        customers = CustomerFactory.create_batch(5)
+        customers[3].first_name = None
+        errors = CustomerModel.create_many(customers, chunk_size=2, atomic=False)
+        self.assertEqual(list(errors), [3])
+        self.assertEqual(len(CustomerModel.all()), 4)
+
+    def test_create_many_customers_atomic(self):
+        """It should not Create any Customer when the database rejects one"""
+        customers = CustomerFactory.create_batch(5)
+        customers[3].first_name = None
+        with self.assertRaises(BulkCreateError) as context:
+            CustomerModel.create_many(customers, 2)
+        self.assertIsInstance(context.exception, DataValidationError)
+        self.assertEqual(list(context.exception.errors), [3])
+        self.assertEqual(CustomerModel.all(), [])
+
+    def test_create_group_commit(self):
+        """It should Create the Customers of concurrent threads together, failing only the duplicate email"""
+        customers = CustomerFactory.create_batch(4)
+        customers[3].email = customers[0].email.upper()
+        results = [None] * len(customers)
+        barrier = threading.Barrier(len(customers))
+
+        def create(index):
+            with app.app_context():
+                barrier.wait()
+                try:
+                    customers[index].create()
+                    results[index] = (customers[index].customer_id, customers[index].version)
+                except IntegrityError as error:
+                    results[index] = error
+                finally:
+                    db.session.remove()
+
+        batches = customer_group_commit.stats()["batches"]
+        customer_group_commit.configure(window=0.2)
+        try:
+            threads = [threading.Thread(target=create, args=(index,)) for index in range(len(customers))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            customer_group_commit.configure(window=0)
+        self.assertEqual(customer_group_commit.stats()["batches"], batches + 1)
+        failed = [index for index, result in enumerate(results) if isinstance(result, IntegrityError)]
+        self.assertEqual(len(failed), 1)
+        self.assertIn(failed[0], (0, 3))
+        created = [result for result in results if not isinstance(result, IntegrityError)]
+        self.assertEqual(len({customer_id for customer_id, _ in created}), 3)
+        self.assertEqual({version for _, version in created}, {1})
+        self.assertCountEqual([customer.customer_id for customer in CustomerModel.all()],
+                              [customer_id for customer_id, _ in created])
+
+    def test_set_active_many(self):
+        """It should Deactivate the selected Customers and bump their versions"""
+        customers = CustomerFactory.create_batch(3)
+        for customer in customers:
+            customer.create()
+        ids = [customers[0].customer_id, customers[1].customer_id]
+        self.assertCountEqual(CustomerModel.set_active_many(False, customer_ids=ids), ids)
+        self.assertEqual(CustomerModel.set_active_many(False, customer_ids=ids), [])
+        for customer in CustomerModel.all():
+            self.assertEqual(customer.is_active, customer.customer_id not in ids)
+            self.assertEqual(customer.version, 2 if customer.customer_id in ids else 1)
+        self.assertRaises(DataValidationError, CustomerModel.set_active_many, True)
+
     def test_delete_a_customer(self):
         """It should Delete a Customer"""
         customers = CustomerModel.all()
@@ -214,6 +318,39 @@ class TestCustomersModel(unittest.TestCase):
         self.assertIn("is_active", data)
         self.assertEqual(data["is_active"], customer.is_active)
 
+    def test_serialize_a_customer_without_addresses(self):
+        """It should serialize a Customer without touching its addresses"""
+        customer = CustomerFactory()
+        self.assertIn("addresses", customer.serialize())
+        self.assertNotIn("addresses", customer.serialize(include_addresses=False))
+
+    def test_paginate_customers_with_addresses(self):
+        """It should load the addresses of a page of Customers at once"""
+        for _ in range(3):
+            customer = CustomerFactory()
+            customer.addresses.append(AddressFactory(address_id=None))
+            customer.create()
+        db.session.expunge_all()
+        page, _ = CustomerModel.paginate(10, with_addresses=True)
+        self.assertEqual(len(page), 3)
+        for customer in page:
+            self.assertIn("addresses", customer.__dict__)
+            self.assertEqual(len(customer.addresses), 1)
+
+    def test_paginate_customer_fields(self):
+        """It should read only the requested columns of a page of Customers"""
+        for _ in range(3):
+            CustomerFactory().create()
+        db.session.expunge_all()
+        page, _ = CustomerModel.paginate(10, rows=True, fields=("email", "addresses"))
+        self.assertEqual(list(page[0]._fields), ["customer_id", "email"])
+        page, _ = CustomerModel.paginate_by_name(10, rows=True, fields=("email",))
+        self.assertEqual(list(page[0]._fields),
+                         ["last_name", "first_name", "customer_id", "email", "last_name_key", "first_name_key"])
+        page, _ = CustomerModel.paginate(10, fields=("email",))
+        self.assertNotIn("password", page[0].__dict__)
+        self.assertIn("email", page[0].__dict__)
+
     def test_deserialize_a_customer(self):
         """It should de-serialize a Customer"""
         test_customer = CustomerFactory()
@@ -282,6 +419,16 @@ class TestCustomersModel(unittest.TestCase):
         data["email"] = "this is not an email"
         self.assertRaises(DataValidationError, test_customer.deserialize, data)
 
+    def test_serialize_stored_bad_email(self):
+        """It should serialize and find a stored Customer whose email no longer validates"""
+        customers = CustomerFactory.create_batch(3)
+        customers[1].email = "legacy email@example"
+        for customer in customers:
+            customer.create()
+        self.assertEqual(customers[1].serialize()["email"], "legacy email@example")
+        invalid = list(CustomerModel.find_invalid_emails(batch_size=2))
+        self.assertEqual(invalid, [(customers[1].customer_id, "legacy email@example")])
+
     def test_deserialize_bad_gender(self):
         """ Deserialize a Customer with a bad gender attribute """
         test_customer = CustomerFactory()
@@ -300,6 +447,20 @@ class TestCustomersModel(unittest.TestCase):
         for customer in customer_list:
             self.assertEqual(customer.email, customers[0].email)
 
+    def test_find_by_email_ignores_case(self):
+        """It should find a customer by email whatever the case"""
+        customer = CustomerFactory(email="Fido.Lido@Example.com")
+        customer.create()
+        customer_list = CustomerModel.find_by_email("fido.lido@example.COM")
+        self.assertEqual([found.customer_id for found in customer_list], [customer.customer_id])
+
+    def test_create_a_customer_with_duplicate_email(self):
+        """It should not Create two customers with the same email"""
+        CustomerFactory(email="fido@gmail.com").create()
+        customer = CustomerFactory(email="FIDO@gmail.com")
+        self.assertRaises(IntegrityError, customer.create)
+        db.session.rollback()
+
     def test_find_by_non_existing_email(self):
         """It should return an empty customer list found by non-existing email"""
         customers = CustomerFactory.create_batch(3)
@@ -326,18 +487,174 @@ class TestCustomersModel(unittest.TestCase):
         customer_list = CustomerModel.find_by_nickname("not-exist")
         self.assertEqual(customer_list.count(), 0)
 
-    # def test_find_customer_by_name(self):
-    #     """It should return a customer list found by name"""
-    #     customers = CustomerFactory.create_batch(3)
-    #     for customer in customers:
-    #         customer.create()
-    #     firstname = customers[0].first_name
-    #     lastname = customers[0].last_name
-    #     customer_list = CustomerModel.find_by_name(firstname, lastname)
-    #     self.assertIsNot(customer_list.count(), 0)
-    #     for customer in customer_list:
-    #         self.assertEqual(customer.first_name, customers[0].first_name)
-    #         self.assertEqual(customer.last_name, customers[0].last_name)
+    def test_find_customer_by_name(self):
+        """It should return a customer list found by name"""
+        customers = CustomerFactory.create_batch(3)
+        for customer in customers:
+            customer.create()
+        firstname = customers[0].first_name
+        lastname = customers[0].last_name
+        customer_list = CustomerModel.find_by_name(firstname, lastname)
+        self.assertIsNot(customer_list.count(), 0)
+        for customer in customer_list:
+            self.assertEqual(customer.first_name, customers[0].first_name)
+            self.assertEqual(customer.last_name, customers[0].last_name)
+
+    def test_update_customer_bumps_version(self):
+        """It should bump the version of a Customer on every update"""
+        customer = CustomerFactory()
+        customer.create()
+        self.assertEqual(customer.version, 1)
+        self.assertEqual(customer.etag(), f"{customer.customer_id}-1")
+        customer.nickname = "changed"
+        customer.update()
+        self.assertEqual(customer.version, 2)
+        self.assertEqual(CustomerModel.find_version(customer.customer_id), 2)
+        self.assertIsNone(CustomerModel.find_version(0))
+
+    def test_update_stale_customer(self):
+        """It should refuse to overwrite a Customer changed since it was read"""
+        customer = CustomerFactory()
+        customer.create()
+        db.session.execute(
+            CustomerModel.__table__.update().values(version=CustomerModel.version + 1)
+            .where(CustomerModel.customer_id == customer.customer_id)
+        )
+        customer.nickname = "lost update"
+        self.assertRaises(StaleDataError, customer.update)
+        db.session.rollback()
+
+    def test_find_customer_by_name_matches_both_names(self):
+        """It should not return customers that only share the last name"""
+        CustomerFactory(first_name="Fido", last_name="Lido").create()
+        CustomerFactory(first_name="Kitty", last_name="Lido").create()
+        customer_list = CustomerModel.find_by_name("Fido", "Lido")
+        self.assertEqual([customer.first_name for customer in customer_list], ["Fido"])
+
+    def test_find_customer_by_name_prefix(self):
+        """It should return customers whose names start with a prefix, ignoring case"""
+        CustomerFactory(first_name="Fido", last_name="Lido").create()
+        CustomerFactory(first_name="Kitty", last_name="Lidocaine").create()
+        CustomerFactory(first_name="Fiona", last_name="Smith").create()
+        self.assertEqual(CustomerModel.find_by_name_prefix(lastname="lid").count(), 2)
+        self.assertEqual(CustomerModel.find_by_name_prefix(firstname="FI").count(), 2)
+        customer_list = CustomerModel.find_by_name_prefix(firstname="fi", lastname="LI")
+        self.assertEqual([customer.first_name for customer in customer_list], ["Fido"])
+        self.assertEqual(CustomerModel.find_by_name_prefix(lastname="li%").count(), 0)
+
+    def test_find_by_birthday_of_any_year(self):
+        """It should find Customers by the month and day of their birthday, whatever the year"""
+        leap = CustomerFactory(birthday=date(2000, 2, 29))
+        leap.create()
+        new_year = CustomerFactory(birthday=date(1999, 12, 31))
+        new_year.create()
+        self.assertEqual(leap.birthday_mmdd, 229)
+        self.assertEqual(CustomerModel.find_by_birthday_month_day(2, 29).all(), [leap])
+        self.assertEqual(CustomerModel.find_by_birthday_month_day(2).all(), [leap])
+        self.assertEqual(CustomerModel.find_by_birthday_window((12, 31), (2, 29)).count(), 2)
+        self.assertEqual(CustomerModel.find_by_birthday_window((1, 1), (2, 28)).count(), 0)
+        self.assertRaises(DataValidationError, CustomerModel.month_day, 4, 31)
+
+        leap.birthday = date(2000, 3, 1)
+        leap.update()
+        self.assertEqual(CustomerModel.find(leap.customer_id).birthday_mmdd, 301)
+
+    def test_search_index_expression(self):
+        """It should search on the very expression the trigram index is built on"""
+        document = CustomerModel.search_document().compile(dialect=postgresql.dialect())
+        self.assertIn(f"({str(document).replace('customer.', '')}) gist_trgm_ops", SEARCH_INDEX_DDL)
+        self.assertFalse(CustomerModel.create_search_index(mock.Mock(dialect=sqlite.dialect())))
+
+    def test_paginate_search(self):
+        """It should page through the Customers matching a search"""
+        if CustomerModel.search_backend == "like":
+            self.skipTest("PostgreSQL without pg_trgm does not rank")
+        for last_name in ["Lidocaine", "Smith", "Lido", "Lid"]:
+            CustomerFactory(first_name="Ann", last_name=last_name, nickname="ann",
+                            email=f"ann.{last_name}@example.com").create()
+        page, has_more = CustomerModel.paginate_search("lido", 1)
+        self.assertTrue(has_more)
+        self.assertEqual(page[0].last_name, "Lido")
+        page, has_more = CustomerModel.paginate_search("lido", 1, offset=1, rows=True)
+        self.assertTrue(has_more)
+        self.assertEqual(page[0].last_name, "Lidocaine")
+        page, has_more = CustomerModel.paginate_search("lido", 5, offset=2, fields=("last_name",))
+        self.assertFalse(has_more)
+        self.assertEqual([customer.last_name for customer in page], ["Lid"])
+
+    def test_search_uses_trigram_index(self):
+        """It should rank a search through ix_customer_search_trgm on PostgreSQL with pg_trgm"""
+        if CustomerModel.search_backend != "trigram":
+            self.skipTest("needs PostgreSQL with pg_trgm")
+        for first_name, last_name in [("Jon", "Smithers"), ("Mary", "Jones"), ("John", "Smith")]:
+            CustomerFactory(first_name=first_name, last_name=last_name, nickname="nick",
+                            email=f"{first_name}.{last_name}@example.com").create()
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            page, has_more = CustomerModel.paginate_search("smith", 1)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+        self.assertEqual([customer.last_name for customer in page], ["Smith"])
+        self.assertTrue(has_more)
+        statement, parameters = statements[-1]
+        self.assertIn("%>", statement)
+        connection = db.session.connection()
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        plan = "\n".join(connection.exec_driver_sql("EXPLAIN " + statement, parameters).scalars())
+        self.assertIn("ix_customer_search_trgm", plan)
+
+    def test_paginate_search_like(self):
+        """It should list the Customers holding every word of a search in id order on PostgreSQL without pg_trgm"""
+        if CustomerModel.search_backend != "like":
+            self.skipTest("needs PostgreSQL without pg_trgm")
+        for last_name in ["Lidocaine", "Smith", "Lido", "Lid"]:
+            CustomerFactory(first_name="Ann", last_name=last_name, nickname="ann_1",
+                            email=f"ann.{last_name}@example.com").create()
+        page, has_more = CustomerModel.paginate_search("LIDO", 1)
+        self.assertTrue(has_more)
+        self.assertEqual(page[0].last_name, "Lidocaine")
+        page, has_more = CustomerModel.paginate_search("lido", 5, offset=1, fields=("last_name",))
+        self.assertFalse(has_more)
+        self.assertEqual([customer.last_name for customer in page], ["Lido"])
+        page, _ = CustomerModel.paginate_search("ann smith", 5)
+        self.assertEqual([customer.last_name for customer in page], ["Smith"])
+        self.assertEqual(CustomerModel.paginate_search("ann%", 5), ([], False))
+        self.assertEqual(len(CustomerModel.paginate_search("ann_1", 5)[0]), 4)
+
+    def test_paginate_customers_by_name(self):
+        """It should page through customers in case insensitive name order"""
+        for first_name, last_name in [("Bo", "lido"), ("al", "Lido"), ("Al", "Lido"), ("Zed", "Abel")]:
+            CustomerFactory(first_name=first_name, last_name=last_name).create()
+        query = CustomerModel.find_by_name_prefix(lastname="lid")
+        page, after = CustomerModel.paginate_by_name(2, query=query)
+        self.assertEqual(after, ["lido", "al", page[1].customer_id])
+        self.assertEqual([customer.first_name.lower() for customer in page], ["al", "al"])
+        self.assertLess(page[0].customer_id, page[1].customer_id)
+        page, after = CustomerModel.paginate_by_name(2, after=after, query=query)
+        self.assertIsNone(after)
+        self.assertEqual([customer.first_name for customer in page], ["Bo"])
+        page, _ = CustomerModel.paginate_by_name(10)
+        self.assertEqual(page[0].last_name, "Abel")
+
+    def test_paginate_non_ascii_names(self):
+        """It should page through names the database lower cases differently than Python"""
+        for last_name in ["Ábel", "Émile", "émile", "Zeta", "Øster"]:
+            CustomerFactory(first_name="Zoe", last_name=last_name).create()
+        query = CustomerModel.find_by_name_prefix(firstname="zo")
+        ordered, _ = CustomerModel.paginate_by_name(10, query=query)
+        seen, after = [], None
+        while True:
+            page, after = CustomerModel.paginate_by_name(1, after=after, query=query, rows=True)
+            seen += [customer.customer_id for customer in page]
+            if after is None:
+                break
+        self.assertEqual(seen, [customer.customer_id for customer in ordered])
+        self.assertEqual(len(seen), 5)
 
     def test_find_customer_by_non_existing_name(self):
         """It should return an empty customer list found by name"""
@@ -384,6 +701,7 @@ class TestAddressModel(unittest.TestCase):
         app.config["TESTING"] = True
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        create_app()
         app.logger.setLevel(logging.CRITICAL)
         CustomerModel.init_db(app)
         AddressModel.init_db(app)
@@ -398,6 +716,7 @@ class TestAddressModel(unittest.TestCase):
         db.session.query(AddressModel).delete()
         db.session.query(CustomerModel).delete()  # clean up the last tests
         db.session.commit()
+        customer_cache.clear()
 
     def tearDown(self):
         """This runs after each test"""
@@ -669,6 +988,29 @@ class TestAddressModel(unittest.TestCase):
         found.delete()
         self.assertEqual(found.count(), 0)
 
+    def test_address_of_a_customer_statements(self):
+        """It should find, update and delete an Address by its Customer and id"""
+        customer = CustomerFactory()
+        customer.create()
+        address = AddressFactory(customer_id=customer.customer_id)
+        address.create()
+
+        self.assertEqual(AddressModel.find_for_customer(0, address.address_id), (False, None))
+        self.assertEqual(AddressModel.find_for_customer(customer.customer_id, 0), (True, None))
+        exists, found = AddressModel.find_for_customer(customer.customer_id, address.address_id)
+        self.assertTrue(exists)
+        self.assertEqual(found.address, address.address)
+
+        self.assertIsNone(AddressModel.update_for_customer(customer.customer_id, address.address_id, "x", versions=[0]))
+        updated = AddressModel.update_for_customer(customer.customer_id, address.address_id, "new_address", versions=[1])
+        self.assertEqual(updated.address, "new_address")
+        self.assertEqual(updated.version, 2)
+        self.assertEqual(AddressModel.find_or_404(address.address_id).address, "new_address")
+
+        self.assertFalse(AddressModel.delete_for_customer(0, address.address_id))
+        self.assertTrue(AddressModel.delete_for_customer(customer.customer_id, address.address_id))
+        self.assertEqual(AddressModel.all(), [])
+
     def test_find_or_404_found_address(self):
         """It should Find an address or return 404 not found"""
         test_customer = CustomerFactory()
@@ -0,0 +1,74 @@
+"""
+Test cases for the connection pool instrumentation
+
+Test cases can be run with:
+    nosetests -v --with-spec --spec-color
+"""
+import threading
+import unittest
+
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from service.utils.pool import TimedQueuePool, checkout_waits, pool_stats
+
+
+######################################################################
+#  C O N N E C T I O N   P O O L   T E S T   C A S E S
+######################################################################
+class TestTimedQueuePool(unittest.TestCase):
+    """ Test Cases for TimedQueuePool """
+
+    def setUp(self):
+        """This runs before each test"""
+        checkout_waits.reset()
+        self.engine = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=1, max_overflow=1,
+                                    connect_args={"check_same_thread": False})
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.engine.dispose()
+
+    def test_records_checkouts(self):
+        """It should count every checkout and its wait"""
+        for _ in range(3):
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        stats = pool_stats(self.engine.pool)
+        self.assertEqual(stats["checkouts"], 3)
+        self.assertEqual((stats["size"], stats["checked_out"], stats["checked_in"]), (1, 0, 1))
+        self.assertGreaterEqual(stats["wait_max_ms"], stats["wait_p50_ms"])
+
+    def test_reports_overflow(self):
+        """It should report connections in use beyond the pool size as overflow"""
+        first = self.engine.connect()
+        second = self.engine.connect()
+        stats = pool_stats(self.engine.pool)
+        self.assertEqual((stats["checked_out"], stats["overflow"]), (2, 1))
+        second.close()
+        first.close()
+
+    def test_exports_metrics(self):
+        """It should time the checkouts and gauge the connections in use and overflow for Prometheus"""
+        checkouts = REGISTRY.get_sample_value("db_pool_checkout_wait_seconds_count") or 0
+        first = self.engine.connect()
+        second = self.engine.connect()
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_checkout_wait_seconds_count") - checkouts, 2)
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_connections_in_use"), 2)
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_overflow_connections"), 1)
+        second.close()
+        first.close()
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_connections_in_use"), 0)
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_overflow_connections"), 0)
+
+    def test_records_wait_for_busy_pool(self):
+        """It should record how long a checkout waited for a busy pool"""
+        engine = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=1, max_overflow=0,
+                               connect_args={"check_same_thread": False})
+        held = engine.connect()
+        timer = threading.Timer(0.05, held.close)
+        timer.start()
+        with engine.connect():
+            pass
+        timer.join()
+        self.assertGreaterEqual(pool_stats(engine.pool)["wait_max_ms"], 40)
+        engine.dispose()
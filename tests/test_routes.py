@@ -6,11 +6,20 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+import re
+import gzip
+import json
 import logging
 import unittest
-
-from service import app
-from service.models import CustomerModel, AddressModel, Gender, db
+from datetime import date
+from contextlib import contextmanager
+
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+from service import app, create_app, jobs
+from service.models import (
+    CustomerModel, AddressModel, Gender, JobModel, JobOutputModel, customer_cache, customer_group_commit, db
+)
 from service.utils import status
 from tests.factories import AddressFactory, CustomerFactory  # HTTP Status Codes
 
@@ -23,6 +32,27 @@ DATABASE_URI = os.getenv(
 CONTENT_TYPE_JSON = "application/json"
 
 
+@contextmanager
+def count_queries():
+    """Counts the SQL statements sent to the database inside the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def next_link(response):
+    """Returns the rel="next" url of the Link header, or None"""
+    match = re.search(r'<([^>]*)>; rel="next"', response.headers.get("Link", ""))
+    return match.group(1) if match else None
+
+
 ######################################################################
 #  T E S T   C U S T O M E R S   S E R V I C E
 ######################################################################
@@ -37,21 +67,28 @@ class TestCustomersService(unittest.TestCase):
         app.config["TESTING"] = True
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        create_app()
         app.logger.setLevel(logging.CRITICAL)
+        app.config["CUSTOMER_CACHE_URL"] = "memory://"
         CustomerModel.init_db(app)
         AddressModel.init_db(app)
 
     @classmethod
     def tearDownClass(cls):
         """ This runs once after the entire test suite """
+        app.config["CUSTOMER_CACHE_URL"] = ""
+        CustomerModel.init_db(app)
         db.session.close()
 
     def setUp(self):
         """ This runs before each test """
         self.client = app.test_client()
+        db.session.query(JobOutputModel).delete()
+        db.session.query(JobModel).delete()
         db.session.query(AddressModel).delete()
         db.session.query(CustomerModel).delete()  # clean up the last tests
         db.session.commit()
+        customer_cache.clear()
 
     def tearDown(self):
         """ This runs after each test """
@@ -266,6 +303,207 @@ class TestCustomersService(unittest.TestCase):
         self.assertEqual(data["last_name"], test_customer.last_name)
         self.assertEqual(data["email"], test_customer.email)
 
+    def test_get_a_customer_from_cache(self):
+        """It should serve a repeated Get of a Customer without querying the database"""
+        test_customer = self._create_customers(1)[0]
+        self.client.get(f"{BASE_URL}/{test_customer.customer_id}")
+        with count_queries() as statements:
+            response = self.client.get(f"{BASE_URL}/{test_customer.customer_id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["email"], test_customer.email)
+        self.assertEqual(statements, [])
+        self.assertEqual(customer_cache.stats()["hits"], 1)
+
+    def test_customer_writes_invalidate_cache(self):
+        """It should not serve a cached Customer after it was written"""
+        test_customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{test_customer.customer_id}"
+        self.client.get(url)
+        self.client.delete(f"{url}/deactivate")
+        self.assertFalse(self.client.get(url).get_json()["is_active"])
+        self.client.put(f"{url}/activate")
+        self.assertTrue(self.client.get(url).get_json()["is_active"])
+        data = self.client.get(url).get_json()
+        data["nickname"] = "cached"
+        self.client.put(url, json=data)
+        self.assertEqual(self.client.get(url).get_json()["nickname"], "cached")
+        self.client.delete(url)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_address_operations_send_one_statement(self):
+        """It should read, update and delete an Address with one SQL statement each"""
+        customer = self._create_customers(1)[0]
+        address = self._create_addresses(customer.customer_id, 1)[0]
+        url = f"{BASE_URL}/{customer.customer_id}/addresses/{address.address_id}"
+        update_statements = 1 if db.engine.dialect.full_returning else 2
+
+        with count_queries() as statements:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(statements), 1)
+        etag = response.headers["ETag"]
+
+        address.address = "One statement"
+        with count_queries() as statements:
+            response = self.client.put(url, json=address.serialize(), headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["address"], "One statement")
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(len(statements), update_statements)
+
+        response = self.client.put(url, json=address.serialize(), headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        with count_queries() as statements:
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(len(statements), 1)
+
+        with count_queries() as statements:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn("Address", response.get_json()["message"])
+        self.assertEqual(len(statements), 1)
+        response = self.client.put(url, json=address.serialize())
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn("Address", response.get_json()["message"])
+        response = self.client.get(f"{BASE_URL}/0/addresses/{address.address_id}")
+        self.assertIn("Customer", response.get_json()["message"])
+
+    def test_address_writes_invalidate_cache(self):
+        """It should drop the cached Customer when one of its Addresses is written"""
+        test_customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{test_customer.customer_id}"
+        self.client.get(url)
+        address = AddressFactory(customer_id=test_customer.customer_id)
+        response = self.client.post(f"{url}/addresses", json=address.serialize())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        address_url = f"{url}/addresses/{response.get_json()['address_id']}"
+        self.client.delete(address_url)
+        self.assertEqual(customer_cache.stats()["invalidations"], 3)
+        self.assertEqual(customer_cache.stats()["size"], 0)
+
+    def test_stats(self):
+        """It should report the customer cache counters"""
+        test_customer = self._create_customers(1)[0]
+        self.client.get(f"{BASE_URL}/{test_customer.customer_id}")
+        self.client.get(f"{BASE_URL}/{test_customer.customer_id}")
+        response = self.client.get("/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = response.get_json()["customer_cache"]
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+        self.assertIn("checkouts", response.get_json()["db_pool"])
+
+    def test_get_a_customer_not_modified(self):
+        """It should answer 304 to a Get whose If-None-Match has the current ETag"""
+        test_customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{test_customer.customer_id}"
+        response = self.client.get(url)
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, f'"{test_customer.customer_id}-1"')
+        customer_cache.clear()
+        with count_queries() as statements:
+            response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(len(statements), 1)
+        self.assertIn("version", statements[0])
+
+    def test_get_a_changed_customer(self):
+        """It should answer 200 with a new ETag once the Customer changed"""
+        test_customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{test_customer.customer_id}"
+        etag = self.client.get(url).headers["ETag"]
+        self.client.delete(f"{url}/deactivate")
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["ETag"], f'"{test_customer.customer_id}-2"')
+        self.assertFalse(response.get_json()["is_active"])
+
+    def test_update_a_customer_if_match(self):
+        """It should Update a Customer only while its If-Match ETag is current"""
+        test_customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{test_customer.customer_id}"
+        response = self.client.get(url)
+        etag, data = response.headers["ETag"], response.get_json()
+        data["nickname"] = "first"
+        response = self.client.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        data["nickname"] = "second"
+        response = self.client.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.client.get(url).get_json()["nickname"], "first")
+
+    def test_list_addresses_not_modified(self):
+        """It should answer 304 to a list of Addresses that did not change"""
+        test_customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{test_customer.customer_id}/addresses"
+        addresses = self._create_addresses(test_customer.customer_id, 2)
+        etag = self.client.get(url).headers["ETag"]
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(f"{url}/{addresses[0].address_id}")
+        address_etag = response.headers["ETag"]
+        response = self.client.get(f"{url}/{addresses[0].address_id}", headers={"If-None-Match": address_etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.delete(f"{url}/{addresses[1].address_id}")
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_metrics(self):
+        """It should count, time and report the database work of requests per resource"""
+        labels = {"resource": "CustomerCollection", "method": "GET"}
+
+        def sample(name, **extra):
+            return REGISTRY.get_sample_value(name, {**labels, **extra}) or 0
+
+        requests, queries = sample("http_requests_total", status="200"), sample("http_request_db_queries_sum")
+        self._create_customers(2)
+        self.client.get(BASE_URL)
+        self.assertEqual(sample("http_requests_total", status="200") - requests, 1)
+        self.assertEqual(sample("http_request_db_queries_sum") - queries, 1)
+        self.assertEqual(sample("http_requests_in_progress"), 0)
+
+        self.client.get(f"{BASE_URL}/0")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('http_request_duration_seconds_bucket{le="0.001",method="GET",resource="CustomerCollection"}',
+                      response.get_data(as_text=True))
+        self.assertIn('resource="CustomerResource"', response.get_data(as_text=True))
+        self.assertNotIn('resource="prometheus_metrics"', response.get_data(as_text=True))
+
+    def test_sql_profile(self):
+        """It should profile the SQL of a request asking for it with Server-Timing"""
+        customer = self._create_customers(1)[0]
+        response = self.client.get(f"{BASE_URL}/{customer.customer_id}")
+        self.assertNotIn("Server-Timing", response.headers)
+
+        with self.assertLogs(app.logger, logging.INFO) as logs:
+            response = self.client.get(BASE_URL, headers={"X-SQL-Profile": "1"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = response.headers["Server-Timing"]
+        for name in ("db", "serialize", "marshal", "total"):
+            self.assertRegex(timing, rf"\b{name};dur=[0-9.]+")
+        self.assertIn('desc="1 queries"', timing)
+        self.assertTrue(any(re.search(r"#1 [0-9.]+ms rows=\S+ SELECT", line) for line in logs.output))
+
+    def test_slow_query_log(self):
+        """It should log the statements slower than SLOW_QUERY_MS with their route"""
+        customer = self._create_customers(1)[0]
+        threshold = app.config["SLOW_QUERY_MS"]
+        app.config["SLOW_QUERY_MS"] = 0.000001
+        try:
+            with self.assertLogs(app.logger, logging.WARNING) as logs:
+                self.client.get(f"{BASE_URL}/{customer.customer_id}")
+        finally:
+            app.config["SLOW_QUERY_MS"] = threshold
+        self.assertIn("GET /api/customers/<int:customer_id>: SELECT", logs.output[0])
+
     def test_activate_a_customer(self):
         """It should activate a customer"""
         # create a customer to activate
@@ -306,6 +544,341 @@ class TestCustomersService(unittest.TestCase):
         # There should be only 5 customers, but there are 5 customers created when testing Address. Need to be fixed
         self.assertEqual(len(data), 5)
 
+    def test_get_customer_list_by_page(self):
+        """It should page through the Customer list with a cursor"""
+        customers = self._create_customers(5)
+        response = self.client.get(f"{BASE_URL}?limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        pages = [response.get_json()]
+        while next_link(response):
+            response = self.client.get(next_link(response))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.get_json())
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        ids = [customer["customer_id"] for page in pages for customer in page]
+        self.assertEqual(ids, sorted(customer.customer_id for customer in customers))
+
+    def test_get_customer_list_by_nickname_and_page(self):
+        """It should keep the filter when paging through a filtered list"""
+        customers = CustomerFactory.create_batch(3)
+        for test_customer in customers:
+            test_customer.nickname = "pager"
+            response = self.client.post(BASE_URL, json=test_customer.serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self._create_customers(2)
+
+        response = self.client.get(f"{BASE_URL}?nickname=pager&limit=2")
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertIn("nickname=pager", next_link(response))
+        response = self.client.get(next_link(response))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 1)
+        self.assertEqual(response.get_json()[0]["nickname"], "pager")
+        self.assertNotIn("Link", response.headers)
+
+    def test_get_customer_list_with_addresses(self):
+        """It should List Customers with their addresses in two queries"""
+        customers = self._create_customers(5)
+        for customer in customers:
+            self._create_addresses(customer.customer_id, 2)
+        db.session.remove()
+        with count_queries() as statements:
+            response = self.client.get(f"{BASE_URL}?include=addresses")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(len(data), 5)
+        for customer in data:
+            self.assertEqual(len(customer["addresses"]), 2)
+            for address in customer["addresses"]:
+                self.assertEqual(address["customer_id"], customer["customer_id"])
+        self.assertEqual(len(statements), 2)
+
+    def test_get_customer_list_without_addresses(self):
+        """It should List Customers in one query when addresses are not included"""
+        customers = self._create_customers(5)
+        for customer in customers:
+            self._create_addresses(customer.customer_id, 2)
+        db.session.remove()
+        with count_queries() as statements:
+            response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(len(data), 5)
+        self.assertNotIn("addresses", data[0])
+        self.assertEqual(len(statements), 1)
+
+    def test_get_customer_list_with_fields(self):
+        """It should List only the requested fields of Customers, reading only their columns"""
+        customers = self._create_customers(3)
+        self._create_addresses(customers[0].customer_id, 2)
+        db.session.remove()
+        with count_queries() as statements:
+            response = self.client.get(f"{BASE_URL}?fields=email,customer_id,is_active&limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data[0], {
+            "email": customers[0].email, "is_active": customers[0].is_active, "customer_id": customers[0].customer_id
+        })
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("password", statements[0])
+        self.assertNotIn("nickname", statements[0])
+        response = self.client.get(next_link(response))
+        self.assertEqual(response.get_json(), [
+            {"email": customers[2].email, "is_active": customers[2].is_active, "customer_id": customers[2].customer_id}
+        ])
+
+        with count_queries() as statements:
+            response = self.client.get(f"{BASE_URL}?fields=customer_id,addresses&limit=1")
+        self.assertEqual(list(response.get_json()[0]), ["addresses", "customer_id"])
+        self.assertEqual(len(response.get_json()[0]["addresses"]), 2)
+        self.assertNotIn("password", statements[0])
+        response = self.client.get(f"{BASE_URL}?fields=last_name&include=addresses&lastname=&match=prefix&limit=1")
+        self.assertEqual(list(response.get_json()[0]), ["addresses", "last_name"])
+
+    def test_get_customer_list_bad_fields(self):
+        """It should not List Customers with unknown fields"""
+        for query in ("fields=email,orders", "fields=,"):
+            response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"{BASE_URL}/1?fields=addresses")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_a_customer_with_fields(self):
+        """It should Get only the requested fields of a Customer, from the cache when it is there"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer.customer_id}?fields=email,nickname"
+        with count_queries() as statements:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"nickname": customer.nickname, "email": customer.email})
+        self.assertNotIn("password", statements[0])
+        etag = response.headers["ETag"]
+
+        self.client.get(f"{BASE_URL}/{customer.customer_id}")
+        with count_queries() as statements:
+            response = self.client.get(url)
+        self.assertEqual(response.get_json(), {"nickname": customer.nickname, "email": customer.email})
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(statements, [])
+        response = self.client.get(f"{BASE_URL}/0?fields=email")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_a_customer_with_fields_etag(self):
+        """It should give a projection an ETag of its own and answer 304 only to that one"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer.customer_id}"
+        full_etag = self.client.get(url).headers["ETag"]
+        etag = self.client.get(f"{url}?fields=nickname,email").headers["ETag"]
+        self.assertEqual(etag, f'"{customer.customer_id}-1-email.nickname"')
+        self.assertEqual(self.client.get(f"{url}?fields=email,nickname").headers["ETag"], etag)
+
+        response = self.client.get(f"{url}?fields=email,nickname", headers={"If-None-Match": full_etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"email": customer.email, "nickname": customer.nickname})
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["ETag"], full_etag)
+        response = self.client.get(f"{url}?fields=email,nickname", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(url, headers={"If-None-Match": full_etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_update_a_customer_if_match_fields_etag(self):
+        """It should Update a Customer whose If-Match is the current ETag of a projection of it"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer.customer_id}"
+        etag = self.client.get(f"{url}?fields=email,nickname").headers["ETag"]
+        data = self.client.get(url).get_json()
+        data["nickname"] = "projected"
+        response = self.client.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["nickname"], "projected")
+        response = self.client.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_create_customers_in_bulk(self):
+        """It should Create many Customers from a JSON array"""
+        customers = [CustomerFactory().serialize() for _ in range(3)]
+        customers[0]["addresses"] = [{"customer_id": 0, "address": "1 Bulk Street"}]
+        response = self.client.post(f"{BASE_URL}/bulk", json=customers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.get_json()
+        self.assertEqual(data["created"], 3)
+        self.assertEqual(data["failed"], 0)
+        self.assertEqual([result["index"] for result in data["results"]], [0, 1, 2])
+        for result, customer in zip(data["results"], customers):
+            found = CustomerModel.find(result["customer_id"])
+            self.assertEqual(found.email, customer["email"])
+        first = CustomerModel.find(data["results"][0]["customer_id"])
+        self.assertEqual([address.address for address in first.addresses], ["1 Bulk Street"])
+
+    def test_create_customers_in_bulk_from_ndjson(self):
+        """It should Create many Customers from newline delimited JSON"""
+        body = "\n".join(json.dumps(CustomerFactory().serialize()) for _ in range(4))
+        response = self.client.post(f"{BASE_URL}/bulk", data=body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.get_json()["created"], 4)
+        self.assertEqual(len(CustomerModel.all()), 4)
+
+    def test_create_customers_in_bulk_atomic(self):
+        """It should not Create any Customer in atomic mode when one is invalid"""
+        customers = [CustomerFactory().serialize() for _ in range(3)]
+        customers[1]["email"] = "not an email"
+        response = self.client.post(f"{BASE_URL}/bulk", json=customers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        data = response.get_json()
+        self.assertEqual((data["created"], data["failed"]), (0, 3))
+        self.assertIn("email", data["results"][1]["error"])
+        for index in (0, 2):
+            self.assertEqual(data["results"][index], {"index": index, "error": "not created: batch rolled back"})
+        self.assertEqual(CustomerModel.all(), [])
+
+    def test_create_customers_in_bulk_atomic_conflict(self):
+        """It should not Create any Customer in atomic mode when the database rejects one, naming it"""
+        existing = self._create_customers(1)[0]
+        customers = [CustomerFactory().serialize() for _ in range(3)]
+        customers[2]["email"] = existing.email
+        response = self.client.post(f"{BASE_URL}/bulk", json=customers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        data = response.get_json()
+        self.assertEqual((data["created"], data["failed"]), (0, 3))
+        self.assertEqual([result["index"] for result in data["results"]], [0, 1, 2])
+        self.assertNotIn("customer_id", data["results"][2])
+        self.assertNotEqual(data["results"][2]["error"], "not created: batch rolled back")
+        for index in (0, 1):
+            self.assertEqual(data["results"][index]["error"], "not created: batch rolled back")
+        self.assertEqual([customer.customer_id for customer in CustomerModel.all()], [existing.customer_id])
+
+    def test_create_customers_in_bulk_best_effort(self):
+        """It should Create the valid Customers in best-effort mode"""
+        customers = [CustomerFactory().serialize() for _ in range(3)]
+        customers[1]["gender"] = "male"
+        body = "\n".join(json.dumps(customer) for customer in customers) + "\n{not json"
+        response = self.client.post(f"{BASE_URL}/bulk?mode=best-effort", data=body,
+                                    content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        data = response.get_json()
+        self.assertEqual(data["created"], 2)
+        self.assertEqual(data["failed"], 2)
+        self.assertIn("customer_id", data["results"][0])
+        self.assertIn("error", data["results"][1])
+        self.assertIn("customer_id", data["results"][2])
+        self.assertIn("error", data["results"][3])
+        self.assertEqual(len(CustomerModel.all()), 2)
+
+    def test_deactivate_customers_in_bulk(self):
+        """It should Deactivate the listed Customers with one statement and count them"""
+        customers = self._create_customers(4)
+        ids = [customer.customer_id for customer in customers[:3]]
+        self.client.get(f"{BASE_URL}/{ids[0]}")
+        with count_queries() as statements:
+            response = self.client.put(f"{BASE_URL}/bulk/deactivate", json={"customer_ids": ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"updated": 3})
+        self.assertEqual(len([sql for sql in statements if sql.lstrip().upper().startswith("UPDATE")]), 1)
+        response = self.client.get(f"{BASE_URL}/{ids[0]}")
+        self.assertFalse(response.get_json()["is_active"])
+        self.assertEqual(response.headers["ETag"], f'"{ids[0]}-2"')
+        self.assertTrue(CustomerModel.find(customers[3].customer_id).is_active)
+
+        response = self.client.put(f"{BASE_URL}/bulk/deactivate", json={"customer_ids": ids})
+        self.assertEqual(response.get_json(), {"updated": 0})
+
+    def test_activate_customers_in_bulk_by_filter(self):
+        """It should Activate the Customers matching a filter and stream their ids"""
+        customers = CustomerFactory.create_batch(3, is_active=False)
+        customers[0].email, customers[0].birthday = "one@Churn.example", date(1990, 5, 1)
+        customers[1].email, customers[1].birthday = "two@churn.example", date(2001, 5, 1)
+        customers[2].email, customers[2].birthday = "three@other.example", date(1990, 5, 1)
+        for customer in customers:
+            customer.create()
+        body = {"email_domain": "churn.example", "birthday_from": "1990-01-01", "birthday_to": "1999-12-31"}
+        response = self.client.put(f"{BASE_URL}/bulk/activate", json=body, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(lines, [{"customer_id": customers[0].customer_id}])
+        self.assertEqual([customer.is_active for customer in CustomerModel.all()].count(True), 1)
+
+    def test_change_status_in_bulk_bad_selection(self):
+        """It should not change the status of Customers without a valid selection"""
+        for body in ({}, {"customer_ids": "1,2"}, {"customer_ids": [1, "2"]}, {"birthday_from": "May 1st"},
+                     {"is_active": False}, [1, 2]):
+            response = self.client.put(f"{BASE_URL}/bulk/deactivate", json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+        max_items = app.config["BULK_MAX_ITEMS"]
+        app.config["BULK_MAX_ITEMS"] = 2
+        try:
+            response = self.client.put(f"{BASE_URL}/bulk/deactivate", json={"customer_ids": [1, 2, 3]})
+        finally:
+            app.config["BULK_MAX_ITEMS"] = max_items
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_job_lifecycle(self):
+        """It should queue a Job, report its progress and serve its result"""
+        self._create_customers(3)
+        response = self.client.post("/api/jobs", json={"kind": "export", "params": {}})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = response.get_json()
+        self.assertEqual(job["status"], "QUEUED")
+        location = response.headers["Location"]
+        self.assertTrue(location.endswith(f"/api/jobs/{job['job_id']}"))
+        response = self.client.get(f"{location}/result")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        jobs.run_worker(app, once=True)
+        job = self.client.get(location).get_json()
+        self.assertEqual(job["status"], "SUCCEEDED")
+        self.assertEqual((job["done"], job["total"]), (3, 3))
+        self.assertIsNotNone(job["finished_at"])
+        response = self.client.get(f"{location}/result")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(len(response.data.splitlines()), 3)
+
+        response = self.client.post("/api/jobs", json={"kind": "deactivate", "params": {"email_domain": "nowhere.test"}})
+        jobs.run_worker(app, once=True)
+        response = self.client.get(f"{response.headers['Location']}/result")
+        self.assertEqual(response.get_json(), {"updated": 0})
+
+    def test_job_errors(self):
+        """It should not queue invalid Jobs nor find unknown ones"""
+        for body in ({"kind": "reindex", "params": {}}, {"kind": "deactivate", "params": {}}, ["export"]):
+            response = self.client.post("/api/jobs", json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+        self.assertEqual(self.client.get("/api/jobs/0").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get("/api/jobs/0/result").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_customers(self):
+        """It should stream every Customer as newline delimited JSON"""
+        customers = self._create_customers(3)
+        response = self.client.get(f"{BASE_URL}/export")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertNotIn("Content-Encoding", response.headers)
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual([line["customer_id"] for line in lines], [customer.customer_id for customer in customers])
+        self.assertEqual(lines[0]["email"], customers[0].email)
+
+    def test_export_customers_gzip(self):
+        """It should gzip the Customer export when the client accepts it"""
+        self._create_customers(2)
+        response = self.client.get(f"{BASE_URL}/export", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        lines = gzip.decompress(response.data).splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_export_customers_with_addresses(self):
+        """It should embed the addresses in the Customer export when asked"""
+        customer = self._create_customers(1)[0]
+        self._create_addresses(customer.customer_id, 3)
+        response = self.client.get(f"{BASE_URL}/export?include=addresses")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(len(lines[0]["addresses"]), 3)
+
     def test_delete_an_address_of_a_customer(self):
         """It should delete an address of a customer"""
         test_customer = CustomerFactory()
@@ -411,6 +984,70 @@ class TestCustomersService(unittest.TestCase):
             self.assertEqual(customer.first_name, customers[0].first_name)
             self.assertEqual(customer.last_name, customers[0].last_name)
 
+    def test_get_customer_list_by_name_prefix(self):
+        """It should get customer list by case insensitive name prefix"""
+        for first_name, last_name in [("Fido", "Lido"), ("Kitty", "Lidocaine"), ("Fiona", "Smith")]:
+            customer = CustomerFactory(first_name=first_name, last_name=last_name)
+            response = self.client.post(BASE_URL, json=customer.serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get(f"{BASE_URL}?lastname=lid&match=prefix")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(customer["last_name"] for customer in response.get_json()), ["Lido", "Lidocaine"])
+        response = self.client.get(f"{BASE_URL}?firstname=fi&lastname=l&match=prefix")
+        self.assertEqual([customer["first_name"] for customer in response.get_json()], ["Fido"])
+
+    def test_page_customer_list_by_name_prefix(self):
+        """It should page name prefix matches in name order"""
+        for last_name in ["Lidocaine", "Smith", "lido", "Lid"]:
+            CustomerFactory(last_name=last_name).create()
+        response = self.client.get(f"{BASE_URL}?lastname=LID&match=prefix&limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([customer["last_name"] for customer in response.get_json()], ["Lid", "lido"])
+        response = self.client.get(next_link(response))
+        self.assertEqual([customer["last_name"] for customer in response.get_json()], ["Lidocaine"])
+        self.assertIsNone(next_link(response))
+
+    def test_search_customer_list(self):
+        """It should List the Customers matching a search, best match first, a page at a time"""
+        names = [("John", "Smith"), ("Jon", "Smithers"), ("Mary", "Jones"), ("Johnny", "Appleseed")]
+        for first_name, last_name in names:
+            CustomerFactory(first_name=first_name, last_name=last_name, nickname="nick",
+                            email=f"{first_name}.{last_name}@example.com").create()
+        response = self.client.get(f"{BASE_URL}?q=smithers")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([customer["last_name"] for customer in response.get_json()], ["Smithers"])
+
+        response = self.client.get(f"{BASE_URL}?q=Smith&limit=1&fields=last_name")
+        self.assertEqual(response.get_json(), [{"last_name": "Smith"}])
+        response = self.client.get(next_link(response))
+        self.assertEqual(response.get_json(), [{"last_name": "Smithers"}])
+        self.assertIsNone(next_link(response))
+
+        response = self.client.get(f"{BASE_URL}?q=zebra")
+        self.assertEqual(response.get_json(), [])
+        response = self.client.get(f"{BASE_URL}?q=smith&cursor=LTE")  # an offset of -1
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_sees_writes(self):
+        """It should search the Customers as they are now"""
+        customer = CustomerFactory(first_name="Zelda", last_name="Quartz")
+        customer.create()
+        self.assertEqual(len(self.client.get(f"{BASE_URL}?q=quartz").get_json()), 1)
+        customer.last_name = "Opal"
+        customer.update()
+        self.assertEqual(self.client.get(f"{BASE_URL}?q=quartz").get_json(), [])
+        self.assertEqual(len(self.client.get(f"{BASE_URL}?q=opal&include=addresses").get_json()), 1)
+
+    def test_name_prefix_rejects_id_cursor(self):
+        """It should reject a customer_id cursor on a name prefix search"""
+        for customer in CustomerFactory.create_batch(2):
+            customer.create()
+        response = self.client.get(f"{BASE_URL}?limit=1")
+        cursor = re.search(r"cursor=([^&>]*)", next_link(response)).group(1)
+        response = self.client.get(f"{BASE_URL}?lastname=a&match=prefix&cursor={cursor}")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_customer_list_by_birthday(self):
         """It should get customer list by birthday"""
         customers = CustomerFactory.create_batch(3)
@@ -425,6 +1062,31 @@ class TestCustomersService(unittest.TestCase):
             customer = CustomerModel()
             customer.deserialize(customer_json)
             self.assertEqual(customer.birthday, customers[0].birthday)
+
+    def test_get_customer_list_by_birthday_of_any_year(self):
+        """It should get the customers born on a day, in a month or in a window of any year"""
+        birthdays = [date(1980, 10, 18), date(2001, 10, 18), date(1990, 10, 2), date(1975, 12, 30), date(1999, 1, 3)]
+        customers = [CustomerFactory(birthday=birthday) for birthday in birthdays]
+        for customer in customers:
+            customer.create()
+
+        def birthdays_of(query):
+            response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(customer["birthday"] for customer in response.get_json())
+
+        self.assertEqual(birthdays_of("birthday_month=10&birthday_day=18"), ["1980-10-18", "2001-10-18"])
+        self.assertEqual(birthdays_of("birthday_month=10"), ["1980-10-18", "1990-10-02", "2001-10-18"])
+        self.assertEqual(birthdays_of("birthday_window=12-25/01-05"), ["1975-12-30", "1999-01-03"])
+        self.assertEqual(birthdays_of("birthday_window=10-01/10-17"), ["1990-10-02"])
+
+    def test_get_customer_list_by_bad_birthday_of_any_year(self):
+        """It should not get customers by a day of the year that does not exist"""
+        for query in ("birthday_month=13", "birthday_month=2&birthday_day=30", "birthday_day=18",
+                      "birthday_window=12-25", "birthday_window=02-30/03-01", "birthday_window=a-b/c-d"):
+            response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
     ######################################################################
     #  T E S T   S A D   P A T H S
     ######################################################################
@@ -444,6 +1106,29 @@ class TestCustomersService(unittest.TestCase):
         response = self.client.post(BASE_URL)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_customer_duplicate_email(self):
+        """It should not Create a Customer with an email already in use"""
+        test_customer = self._create_customers(1)[0]
+        customer = CustomerFactory(email=test_customer.email.upper()).serialize()
+        response = self.client.post(BASE_URL, json=customer)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_create_customer_group_commit(self):
+        """It should Create a Customer and answer a duplicate of it with a conflict under group commit"""
+        customer_group_commit.configure(window=0.001)
+        try:
+            customer = CustomerFactory().serialize()
+            response = self.client.post(BASE_URL, json=customer)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            new_customer = response.get_json()
+            self.assertEqual(new_customer["email"], customer["email"])
+            self.assertEqual(response.headers["ETag"], f'"{new_customer["customer_id"]}-1"')
+            self.assertEqual(CustomerModel.find(new_customer["customer_id"]).email, customer["email"])
+            response = self.client.post(BASE_URL, json=customer)
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        finally:
+            customer_group_commit.configure(window=0)
+
     def test_create_customer_bad_gender(self):
         """It should not Create a Customer with bad gender data"""
         customer = CustomerFactory()
@@ -561,6 +1246,39 @@ class TestCustomersService(unittest.TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.get_json(), [])
 
+    def test_create_customers_in_bulk_not_a_list(self):
+        """It should not Create Customers in bulk from a JSON object"""
+        response = self.client.post(f"{BASE_URL}/bulk", json=CustomerFactory().serialize())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_customers_in_bulk_too_many(self):
+        """It should not Create more Customers in bulk than allowed"""
+        max_items = app.config["BULK_MAX_ITEMS"]
+        app.config["BULK_MAX_ITEMS"] = 2
+        try:
+            customers = [CustomerFactory().serialize() for _ in range(3)]
+            response = self.client.post(f"{BASE_URL}/bulk", json=customers)
+        finally:
+            app.config["BULK_MAX_ITEMS"] = max_items
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_get_customer_list_bad_include(self):
+        """It should not List Customers with an unknown include"""
+        response = self.client.get(f"{BASE_URL}?include=orders")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_customer_list_bad_cursor(self):
+        """It should not List Customers with a bad cursor"""
+        response = self.client.get(f"{BASE_URL}?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_customer_list_bad_limit(self):
+        """It should not List Customers with a limit out of range"""
+        response = self.client.get(f"{BASE_URL}?limit=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"{BASE_URL}?limit={app.config['MAX_PAGE_SIZE'] + 1}")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_update_customer_not_found(self):
         """It should not update a customer that doesn't exist"""
         response = self.client.put(f"{BASE_URL}/0", json={})
@@ -0,0 +1,60 @@
+"""
+Test cases for the in-process trigram search
+
+Test cases can be run with:
+    nosetests -v --with-spec --spec-color
+"""
+import unittest
+from unittest import mock
+
+from service.utils.search import TrigramIndex, trigrams
+
+DOCUMENTS = [
+    (1, "John Smith jsmith john.smith@example.com"),
+    (2, "Jon Smithers jon jon@example.com"),
+    (3, "Mary Jones mj mary.jones@example.org"),
+    (4, "Johnny Appleseed apples johnny@example.net"),
+]
+
+
+######################################################################
+#  T R I G R A M   I N D E X   T E S T   C A S E S
+######################################################################
+class TestTrigramIndex(unittest.TestCase):
+    """ Test Cases for TrigramIndex """
+
+    def setUp(self):
+        self.index = TrigramIndex()
+        self.index.refresh(1, lambda: DOCUMENTS)
+
+    def test_trigrams(self):
+        """It should make the trigrams of every word like pg_trgm, ignoring case"""
+        self.assertEqual(trigrams("Cat"), {"  c", " ca", "cat", "at "})
+        self.assertEqual(trigrams("a.B"), {"  a", " a ", "  b", " b "})
+        self.assertEqual(trigrams("--"), set())
+
+    def test_search_ranks_matches(self):
+        """It should rank the documents by the share of the query they hold, then by id"""
+        self.assertEqual(self.index.search("smith"), [1, 2])
+        self.assertEqual(self.index.search("SMITHERS"), [2])
+        self.assertEqual(self.index.search("john"), [1, 4])
+        self.assertEqual(self.index.search("jon"), [2, 3])
+
+    def test_search_partial_and_misspelt(self):
+        """It should find prefixes of words and near misses"""
+        self.assertEqual(self.index.search("appl"), [4])
+        self.assertEqual(self.index.search("smiht"), [])
+        self.assertEqual(self.index.search("smiht", threshold=0.3), [1, 2])
+        self.assertEqual(self.index.search("..."), [])
+
+    def test_refresh_on_new_fingerprint(self):
+        """It should rebuild only when the fingerprint changes"""
+        load = mock.Mock(return_value=[(9, "Zed Zulu")])
+        self.index.refresh(1, load)
+        load.assert_not_called()
+        self.index.refresh(2, load)
+        load.assert_called_once()
+        self.assertEqual(self.index.search("smith"), [])
+        self.assertEqual(self.index.search("zulu"), [9])
+        self.index.clear()
+        self.assertEqual(self.index.search("zulu"), [])